@@ -0,0 +1,129 @@
+"""
+Asyncio agent server: serves agent decisions to simulators running in other processes.
+
+Simulators connect over a Unix socket (see envs/remote.py) and can multiplex many
+episodes on one connection. Decision requests from all episodes and connections go
+through a single queue and are answered in batches, so a policy that implements
+get_actions_batch can evaluate them in one call.
+"""
+import asyncio
+import os
+import traceback
+
+from agents.greedy_agent import GreedyAgents
+from utils.protocol import (MSG_INIT, MSG_STEP, MSG_ACTIONS, MSG_CLOSE, MSG_ERROR,
+                            pack_frame, read_frame, decode_map, decode_state, encode_actions)
+
+
+class AgentServer:
+
+    def __init__(self, agent_factory=GreedyAgents, max_batch=64, batch_window=0.001):
+        """
+        :param agent_factory: Callable returning a new agent (init_agents/get_actions) per episode.
+            If the agent class defines get_actions_batch(agents, states), it is used to
+            answer a whole batch at once.
+        :param max_batch: Maximum number of decision requests answered together.
+        :param batch_window: Seconds to wait for more requests once the first one arrived.
+        """
+        self.agent_factory = agent_factory
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.episodes = {}  # (connection id, episode id) -> episode dict
+        self.queue = None
+        self.n_connections = 0
+        self.n_batches = 0
+        self.n_requests = 0
+
+    async def serve(self, path):
+        """Serves forever on the Unix socket at path."""
+        if os.path.exists(path):
+            os.remove(path)
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batch_loop())
+        server = await asyncio.start_unix_server(self._handle_connection, path=path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def _handle_connection(self, reader, writer):
+        self.n_connections += 1
+        conn_id = self.n_connections
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                msg_type, episode_id, payload = frame
+                key = (conn_id, episode_id)
+
+                if msg_type == MSG_INIT:
+                    grid, offset = decode_map(payload)
+                    state = decode_state(payload, grid, offset=offset)
+                    agent = self.agent_factory()
+                    agent.init_agents(state)
+                    self.episodes[key] = {'agent': agent, 'map': grid, 'robots': state['robots']}
+                elif msg_type == MSG_STEP:
+                    episode = self.episodes[key]
+                    state = decode_state(payload, episode['map'], episode['robots'])
+                    episode['robots'] = state['robots']
+                    await self.queue.put((writer, key, state))
+                elif msg_type == MSG_CLOSE:
+                    self.episodes.pop(key, None)
+        finally:
+            for key in [k for k in self.episodes if k[0] == conn_id]:
+                del self.episodes[key]
+            writer.close()
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.n_batches += 1
+            self.n_requests += len(batch)
+            try:
+                # Run the policy off the event loop so sockets keep being served meanwhile
+                results = await loop.run_in_executor(None, self._act_batch, batch)
+                frames = [pack_frame(MSG_ACTIONS, key[1], encode_actions(actions))
+                          for (_, key, _), actions in zip(batch, results)]
+            except Exception:
+                message = traceback.format_exc().encode()
+                frames = [pack_frame(MSG_ERROR, key[1], message) for _, key, _ in batch]
+
+            writers = set()
+            for (writer, _, _), frame in zip(batch, frames):
+                writer.write(frame)
+                writers.add(writer)
+            for writer in writers:
+                await writer.drain()
+
+    def _act_batch(self, batch):
+        agents = [self.episodes[key]['agent'] for _, key, _ in batch]
+        states = [state for _, _, state in batch]
+        act_batch = getattr(type(agents[0]), 'get_actions_batch', None)
+        if act_batch is not None and all(type(agent) is type(agents[0]) for agent in agents):
+            return act_batch(agents, states)
+        return [agent.get_actions(state) for agent, state in zip(agents, states)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve GreedyAgents decisions over a Unix socket')
+    parser.add_argument('--socket', type=str, default='/tmp/marl-delivery-agent.sock', help='Socket path')
+    parser.add_argument('--max_batch', type=int, default=64, help='Maximum requests per batch')
+    args = parser.parse_args()
+
+    print(f"Agent server listening on {args.socket}")
+    asyncio.run(AgentServer(GreedyAgents, max_batch=args.max_batch).serve(args.socket))
@@ -0,0 +1,109 @@
+"""
+Incremental package assignment for the greedy agents.
+
+IncrementalAssigner keeps the free (unassigned) packages in a per-cell index, so a
+robot looking for work only searches outwards from its cell in rings of growing
+Manhattan distance, or scans the free packages directly once there are fewer of
+them than cells left to search. It returns the same package as a scan of every
+package (closest first, lowest id on ties), but the cost of a step depends on the
+robots becoming free and the packages released, not on the total package count.
+
+It also allows bounded reassignment: each newly released package is matched
+against the robots still on their way to a pickup, the candidate (robot, package)
+pairs go into a heap ordered by the distance saved, and the best ones are applied
+while they save more than `margin` cells, at most `max_reassign` per step and once
+per robot per step. The package a robot gives up becomes free again.
+"""
+import bisect
+import heapq
+
+
+class IncrementalAssigner:
+
+    def __init__(self, n_rows, n_cols, margin=3, max_reassign=None):
+        """
+        :param margin: Distance (in cells) a reassignment must save.
+        :param max_reassign: Reassignments per step, None for no limit, 0 to disable them.
+        """
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.margin = margin
+        self.max_reassign = max_reassign
+        self.cells = {}  # cell -> sorted ids of the free packages there
+        self.free = {}   # package id -> cell
+        self.new = []    # Packages added since the last call to reassign
+
+    def add(self, package_id, cell):
+        """Makes a package available (released, or given up by a robot)."""
+        bisect.insort(self.cells.setdefault(cell, []), package_id)
+        self.free[package_id] = cell
+
+    def add_new(self, package_id, cell):
+        """Adds a newly released package, which is also a reassignment candidate."""
+        self.add(package_id, cell)
+        self.new.append(package_id)
+
+    def take(self, package_id):
+        cell = self.free.pop(package_id)
+        ids = self.cells[cell]
+        ids.remove(package_id)
+        if not ids:
+            del self.cells[cell]
+
+    def nearest(self, position):
+        """(package id, distance) of the closest free package, lowest id on ties, or None."""
+        if not self.free:
+            return None
+        r, c = position
+        max_d = max(r, self.n_rows - 1 - r) + max(c, self.n_cols - 1 - c)
+        searched = 0
+        for d in range(max_d + 1):
+            best = None
+            for dr in range(-d, d + 1):
+                dc = d - abs(dr)
+                for cell in ((r + dr, c + dc), (r + dr, c - dc)) if dc else ((r + dr, c),):
+                    ids = self.cells.get(cell)
+                    if ids and (best is None or ids[0] < best):
+                        best = ids[0]
+            if best is not None:
+                return best, d
+            searched += 4 * d or 1
+            if searched >= len(self.free):
+                # The remaining rings hold more cells than there are free packages
+                return min((abs(cr - r) + abs(cc - c), package_id) for package_id, (cr, cc) in self.free.items())[::-1]
+        return None
+
+    def reassign(self, positions, targets):
+        """
+        Moves robots heading to a pickup onto newly released packages that are much closer.
+        :param positions: (row, col) of every robot.
+        :param targets: robot index -> (package id, pickup cell) for robots not carrying yet.
+        :return: (robot, new package id, old package id) for every reassignment made.
+        """
+        new, self.new = self.new, []
+        if self.max_reassign == 0 or not targets:
+            return []
+        candidates = []
+        for package_id in new:
+            cell = self.free.get(package_id)
+            if cell is None:
+                continue
+            for i, (current, current_cell) in targets.items():
+                r, c = positions[i]
+                gain = abs(current_cell[0] - r) + abs(current_cell[1] - c) - abs(cell[0] - r) - abs(cell[1] - c)
+                if gain > self.margin:
+                    candidates.append((-gain, package_id, i))
+        heapq.heapify(candidates)
+
+        changes = []
+        moved = set()
+        while candidates and (self.max_reassign is None or len(changes) < self.max_reassign):
+            gain, package_id, i = heapq.heappop(candidates)
+            if i in moved or package_id not in self.free:
+                continue
+            old, old_cell = targets[i]
+            self.take(package_id)
+            self.add(old, old_cell)
+            moved.add(i)
+            changes.append((i, package_id, old))
+        return changes
@@ -0,0 +1,213 @@
+"""
+Deadlock and livelock detection for grid agents, with a recovery policy.
+
+DeadlockDetector keeps the last `history` positions, goals and goal distances of
+every robot in ring buffers. Only steps where a robot tried to follow its own
+plan count: moves forced on it (nudges, recovery) and planned 'S' steps do not.
+A robot is flagged when it kept trying to move towards the same goal but stayed in
+place for `stuck_threshold` steps (deadlock), or when it tried to move during the
+whole window towards the same goal while visiting at most two cells and getting no
+closer to it (livelock, e.g. two robots swapping places). The robot steps spent
+flagged, including the steps before detection, are counted as lost.
+
+DeadlockRecovery unblocks flagged robots: in each group of flagged robots that
+are close to each other, a random robot keeps the right of way and replans around
+the cells reserved by the other robots, while the others yield by stepping aside
+to a free cell and waiting there for a few steps.
+"""
+from collections import deque
+import numpy as np
+
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+ACTIONS = ['U', 'D', 'L', 'R']
+
+
+class DeadlockDetector:
+
+    def __init__(self, n_robots, n_cols, history=8, stuck_threshold=4):
+        """
+        :param n_cols: Number of columns of the map, cells are stored as row * n_cols + col.
+        :param history: Length of the position ring buffer, also the livelock window.
+        :param stuck_threshold: Consecutive blocked steps before a robot is flagged as deadlocked.
+        """
+        self.n_robots = n_robots
+        self.n_cols = n_cols
+        self.history = history
+        self.stuck_threshold = stuck_threshold
+        self.cells = np.full((n_robots, history), -1, dtype=np.int64)
+        self.active = np.zeros((n_robots, history), dtype=bool)  # Robot tried to follow its plan at that step
+        self.goals = np.full((n_robots, history), -1, dtype=np.int64)  # Goal cell, -1 for none
+        self.distances = np.zeros((n_robots, history), dtype=np.int64)  # Distance to the goal
+        self.stuck_steps = np.zeros(n_robots, dtype=np.int64)
+        self.flagged = np.zeros(n_robots, dtype=bool)
+        self.pos = 0
+        self.steps = 0
+        self.steps_lost = 0
+        self.events = 0
+
+    def update(self, positions, active, goals, distances):
+        """
+        Records one step.
+        :param positions: (row, col) of every robot after the step.
+        :param active: Whether each robot tried to make the move of its own plan during
+            the step (False for planned 'S' steps and for moves forced on it).
+        :param goals: (row, col) each robot is heading to after the step, None if none.
+        :param distances: Distance of each robot to its goal after the step.
+        :return: Boolean array of the robots flagged as deadlocked or livelocked.
+        """
+        cells = np.array([r * self.n_cols + c for r, c in positions], dtype=np.int64)
+        active = np.asarray(active, dtype=bool)
+        goals = np.array([-1 if goal is None else goal[0] * self.n_cols + goal[1] for goal in goals], dtype=np.int64)
+        distances = np.asarray(distances, dtype=np.int64)
+        last = (self.pos - 1) % self.history
+        no_progress = (goals >= 0) & (goals == self.goals[:, last]) & (distances >= self.distances[:, last])
+        blocked = active & (cells == self.cells[:, last]) & no_progress
+        self.cells[:, self.pos] = cells
+        self.active[:, self.pos] = active
+        self.goals[:, self.pos] = goals
+        self.distances[:, self.pos] = distances
+        self.pos = (self.pos + 1) % self.history
+        self.steps += 1
+
+        self.stuck_steps = np.where(blocked, self.stuck_steps + 1, 0)
+        stuck = self.stuck_steps >= self.stuck_threshold
+
+        livelock = np.zeros(self.n_robots, dtype=bool)
+        if self.steps >= self.history:
+            window = np.sort(self.cells, axis=1)
+            n_distinct = 1 + (np.diff(window, axis=1) != 0).sum(axis=1)
+            # The oldest entry of the window is the next one to be overwritten
+            same_goal = (self.goals >= 0).all(axis=1) & (self.goals == goals[:, None]).all(axis=1)
+            no_progress = same_goal & (distances >= self.distances[:, self.pos])
+            livelock = self.active.all(axis=1) & (n_distinct <= 2) & no_progress
+
+        flagged = stuck | livelock
+        new = flagged & ~self.flagged
+        # Steps already spent before detection are lost too
+        self.steps_lost += int(np.where(stuck[new], self.stuck_threshold, self.history).sum())
+        self.steps_lost += int((flagged & self.flagged).sum())
+        self.events += int(new.sum())
+        self.flagged = flagged
+        return flagged
+
+    def report(self):
+        return {
+            'deadlock_events': self.events,
+            'steps_lost': self.steps_lost,
+            'steps': self.steps,
+        }
+
+
+class DeadlockRecovery:
+
+    def __init__(self, rng, yield_steps=3, group_radius=2):
+        """
+        :param rng: np.random.Generator choosing who keeps the right of way.
+        :param yield_steps: Steps a yielding robot waits after stepping aside.
+        :param group_radius: Flagged robots within this Manhattan distance form one group.
+        """
+        self.rng = rng
+        self.yield_steps = yield_steps
+        self.group_radius = group_radius
+        self.waiting = {}  # robot index -> remaining steps to wait
+
+    def reset(self):
+        self.waiting.clear()
+
+    def adjust(self, grid, positions, actions, goals, flagged):
+        """
+        Rewrites the actions of flagged and yielding robots.
+        :param positions: (row, col) of every robot.
+        :param actions: (move_action, package_action) of every robot, modified in place.
+        :param goals: Cell each robot is heading to, or None.
+        :param flagged: Robots flagged by the detector.
+        """
+        for i in list(self.waiting):
+            if flagged[i]:
+                del self.waiting[i]
+                continue
+            self.waiting[i] -= 1
+            if self.waiting[i] < 0:
+                del self.waiting[i]
+            else:
+                actions[i] = ('S', actions[i][1])
+
+        for group in self.groups(positions, np.nonzero(flagged)[0]):
+            leader = group[self.rng.integers(len(group))]
+            others = {positions[j] for j in range(len(positions)) if j != leader}
+            if goals[leader] is not None:
+                move = reserved_bfs_move(grid, positions[leader], goals[leader], others)
+                if move is not None:
+                    actions[leader] = (move, actions[leader][1])
+            # Cells the leader and the robots already moved aside will use
+            reserved = set(positions) | {step(positions[leader], actions[leader][0])}
+            for j in group:
+                if j == leader:
+                    continue
+                free = [k for k, (dx, dy) in enumerate(DIRECTIONS)
+                        if is_free(grid, (positions[j][0] + dx, positions[j][1] + dy))
+                        and (positions[j][0] + dx, positions[j][1] + dy) not in reserved]
+                if free:
+                    k = free[self.rng.integers(len(free))]
+                    actions[j] = (ACTIONS[k], '0')
+                    reserved.add(step(positions[j], ACTIONS[k]))
+                else:
+                    actions[j] = ('S', '0')
+                self.waiting[j] = self.yield_steps
+
+    def groups(self, positions, robots):
+        """Splits the flagged robots into groups of robots close to each other."""
+        groups = []
+        remaining = list(robots)
+        while remaining:
+            group = [remaining.pop(0)]
+            k = 0
+            while k < len(group):
+                r, c = positions[group[k]]
+                near = [j for j in remaining
+                        if abs(positions[j][0] - r) + abs(positions[j][1] - c) <= self.group_radius]
+                for j in near:
+                    remaining.remove(j)
+                group += near
+                k += 1
+            groups.append(group)
+        return groups
+
+
+def is_free(grid, cell):
+    r, c = cell
+    return 0 <= r < len(grid) and 0 <= c < len(grid[0]) and grid[r][c] == 0
+
+
+def step(cell, move):
+    if move == 'S':
+        return cell
+    dx, dy = DIRECTIONS[ACTIONS.index(move)]
+    return (cell[0] + dx, cell[1] + dy)
+
+
+def reserved_bfs_move(grid, start, goal, reserved):
+    """First move of a shortest path from start to goal avoiding reserved cells, None if there is none."""
+    if start == goal:
+        return 'S'
+    queue = deque([goal])
+    d = {goal: 0}
+    while queue:
+        current = queue.popleft()
+        for dx, dy in DIRECTIONS:
+            next_pos = (current[0] + dx, current[1] + dy)
+            if next_pos in d or not is_free(grid, next_pos):
+                continue
+            if next_pos in reserved and next_pos != start:
+                continue
+            d[next_pos] = d[current] + 1
+            if next_pos == start:
+                queue.clear()
+                break
+            queue.append(next_pos)
+    if start not in d:
+        return None
+    for k, (dx, dy) in enumerate(DIRECTIONS):
+        if d.get((start[0] + dx, start[1] + dy)) == d[start] - 1:
+            return ACTIONS[k]
+    return None
@@ -1,4 +1,9 @@
 from utils.bfs import manhattan_distance
+from utils.traffic import TrafficMap, TrafficRouter
+from utils.distance_field import DistanceFieldCache
+from utils.hpa import HierarchicalPathfinder
+from agents.assignment import IncrementalAssigner
+from collections import deque
 # import numpy as np
 # Run a BFS to find the path from start to goal
 def run_bfs(map, start, goal):
@@ -38,9 +43,68 @@ def run_bfs(map, start, goal):
         t += 1
     return 'S', d[start]
 
+# Run a BFS from the goal and follow it from start to get the whole path
+def bfs_path(map, start, goal):
+    n_rows = len(map)
+    n_cols = len(map[0])
+
+    queue = deque([goal])
+    d = {goal: 0}
+    while queue:
+        current = queue.popleft()
+        for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+            next_pos = (current[0] + dx, current[1] + dy)
+            if next_pos[0] < 0 or next_pos[0] >= n_rows or next_pos[1] < 0 or next_pos[1] >= n_cols:
+                continue
+            if next_pos not in d and map[next_pos[0]][next_pos[1]] == 0:
+                d[next_pos] = d[current] + 1
+                queue.append(next_pos)
+
+    if start not in d:
+        return None
+
+    # Same tie-breaking order as run_bfs, so the path matches step-by-step moves
+    actions = ['U', 'D', 'L', 'R']
+    moves = []
+    current = start
+    while d[current] > 0:
+        for t, (dx, dy) in enumerate([(-1, 0), (1, 0), (0, -1), (0, 1)]):
+            next_pos = (current[0] + dx, current[1] + dy)
+            if d.get(next_pos) == d[current] - 1:
+                moves.append(actions[t])
+                current = next_pos
+                break
+    return moves
+
 class GreedyAgents:
 
-    def __init__(self):
+    def __init__(self, traffic=False, traffic_params=None, hierarchical=False, cluster_size=10,
+                 assignment='greedy', reassign_margin=3, max_reassign=None):
+        """
+        :param traffic: Route around congestion with a TrafficMap heatmap and weighted
+            shortest paths (utils/traffic.py) instead of plain BFS.
+        :param traffic_params: Keyword arguments of TrafficMap.
+        :param hierarchical: Route with the hierarchical pathfinder of utils/hpa.py (for large maps).
+        :param cluster_size: Cluster side of the hierarchical pathfinder.
+        :param assignment: 'greedy' scans every package for each free robot; 'incremental'
+            keeps the free packages indexed between steps and lets robots not carrying yet
+            switch to a newly released package (agents/assignment.py).
+        :param reassign_margin: Cells a reassignment must save (incremental assignment).
+        :param max_reassign: Reassignments per step, None for no limit, 0 to disable them.
+        """
+        if assignment not in ('greedy', 'incremental'):
+            raise ValueError("assignment must be 'greedy' or 'incremental'.")
+        self.assignment = assignment
+        self.reassign_margin = reassign_margin
+        self.max_reassign = max_reassign
+        self.assigner = None
+        self.hierarchical = hierarchical
+        self.cluster_size = cluster_size
+        self.use_traffic = traffic
+        self.traffic_params = traffic_params or {}
+        self.traffic = None
+        self.router = None
+        self.last_actions = None
         self.agents = []
         self.packages = []
         self.packages_free = []
@@ -55,9 +119,19 @@ class GreedyAgents:
         self.map = state['map']
         self.robots = [(robot[0]-1, robot[1]-1, 0) for robot in state['robots']]
         self.robots_target = ['free'] * self.n_robots
-        self.packages += [(p[0], p[1]-1, p[2]-1, p[3]-1, p[4]-1, p[5]) for p in state['packages']]
-
-        self.packages_free = [True] * len(self.packages)
+        if self.assignment == 'incremental':
+            self.assigner = IncrementalAssigner(len(self.map), len(self.map[0]), self.reassign_margin,
+                                                self.max_reassign)
+        self.add_packages(state['packages'])
+        if self.hierarchical:
+            # Near-shortest paths whose cost per query does not grow with the map
+            self.distances = HierarchicalPathfinder(self.map, self.cluster_size)
+        else:
+            # Same moves as run_bfs, without flooding the map on every call
+            self.distances = DistanceFieldCache(self.map)
+        if self.use_traffic:
+            self.traffic = TrafficMap(self.map, **self.traffic_params)
+            self.router = TrafficRouter(self.traffic)
 
     def update_move_to_target(self, robot_id, target_package_id, phase='start'):
 
@@ -80,7 +154,10 @@ class GreedyAgents:
             target_p = (pkg[1], pkg[2])
             if phase == 'target':
                 target_p = (pkg[3], pkg[4])
-            move, distance = run_bfs(self.map, (self.robots[i][0], self.robots[i][1]), target_p)
+            if self.router is not None:
+                move, distance = self.router.next_move((self.robots[i][0], self.robots[i][1]), target_p)
+            else:
+                move, distance = self.distances.next_move((self.robots[i][0], self.robots[i][1]), target_p)
 
             if distance == 0:
                 if phase == 'start':
@@ -98,6 +175,7 @@ class GreedyAgents:
         return move, str(pkg_act)
     
     def update_inner_state(self, state):
+        prev_robots = list(self.robots)
         # Update robot positions and states
         for i in range(len(state['robots'])):
             prev = (self.robots[i][0], self.robots[i][1], self.robots[i][2])
@@ -112,8 +190,79 @@ class GreedyAgents:
                     self.robots_target[i] = self.robots[i][2]
         
         # Update package positions and states
-        self.packages += [(p[0], p[1]-1, p[2]-1, p[3]-1, p[4]-1, p[5]) for p in state['packages']]
-        self.packages_free += [True] * len(state['packages'])    
+        self.add_packages(state['packages'])
+
+        if 'blocked_changes' in state:
+            changes = [(r-1, c-1, blocked) for r, c, blocked in state['blocked_changes']]
+            self.distances.apply_changes(changes)
+            if self.traffic is not None:
+                self.traffic.apply_changes(changes)
+        if self.router is not None:
+            self.update_traffic(prev_robots)
+
+    def add_packages(self, packages):
+        """Registers released packages, given as in the state (1-indexed cells)."""
+        new_packages = [(p[0], p[1]-1, p[2]-1, p[3]-1, p[4]-1, p[5]) for p in packages]
+        if self.assigner is not None:
+            # Packages are looked up by id - 1, so each one is registered only once
+            new_packages = [p for p in new_packages if p[0] > len(self.packages)]
+            for p in new_packages:
+                self.assigner.add_new(p[0], (p[1], p[2]))
+        self.packages += new_packages
+        self.packages_free += [True] * len(new_packages)
+
+    def closest_free_package(self, i):
+        """Id of the free package closest to robot i (Manhattan distance), None if there is none."""
+        if self.assigner is not None:
+            found = self.assigner.nearest((self.robots[i][0], self.robots[i][1]))
+            return found[0] if found is not None else None
+        closest_package_id = None
+        closed_distance = 1000000
+        for j in range(len(self.packages)):
+            if not self.packages_free[j]:
+                continue
+
+            pkg = self.packages[j]
+            d = abs(pkg[1]-self.robots[i][0]) + abs(pkg[2]-self.robots[i][1])
+            if d < closed_distance:
+                closed_distance = d
+                closest_package_id = pkg[0]
+        return closest_package_id
+
+    def assign_package(self, i, package_id):
+        self.packages_free[package_id-1] = False
+        self.robots_target[i] = package_id
+        if self.assigner is not None:
+            self.assigner.take(package_id)
+
+    def reassign(self):
+        """
+        Lets robots still heading to a pickup switch to much closer new packages.
+        :return: The robots whose target changed.
+        """
+        targets = {}
+        for i, target in enumerate(self.robots_target):
+            if target != 'free' and self.robots[i][2] == 0:
+                pkg = self.packages[target-1]
+                targets[i] = (target, (pkg[1], pkg[2]))
+        positions = [(robot[0], robot[1]) for robot in self.robots]
+        changes = self.assigner.reassign(positions, targets)
+        for i, package_id, old in changes:
+            self.robots_target[i] = package_id
+            self.packages_free[package_id-1] = False
+            self.packages_free[old-1] = True
+        return [i for i, package_id, old in changes]
+
+    def update_traffic(self, prev_robots):
+        """Feeds robot positions and the moves that were blocked last step to the heatmap"""
+        blocked = []
+        if self.last_actions is not None:
+            for i, (move, _) in enumerate(self.last_actions):
+                if move == 'S' or self.robots[i][:2] != prev_robots[i][:2]:
+                    continue
+                dx, dy = {'U': (-1, 0), 'D': (1, 0), 'L': (0, -1), 'R': (0, 1)}[move]
+                blocked.append((prev_robots[i][0] + dx, prev_robots[i][1] + dy))
+        self.traffic.update([(robot[0], robot[1]) for robot in self.robots], blocked)
 
     def get_actions(self, state):
         if self.is_init == False:
@@ -124,6 +273,9 @@ class GreedyAgents:
         else:
             self.update_inner_state(state)
 
+        if self.assigner is not None:
+            self.reassign()
+
         actions = []
         # print("State robot: ", self.robots)
         # Start assigning a greedy strategy
@@ -145,21 +297,10 @@ class GreedyAgents:
             else:
                 # Step 2: Find a package to pick up
                 # Find the closest package
-                closest_package_id = None
-                closed_distance = 1000000
-                for j in range(len(self.packages)):
-                    if not self.packages_free[j]:
-                        continue
-
-                    pkg = self.packages[j]                
-                    d = abs(pkg[1]-self.robots[i][0]) + abs(pkg[2]-self.robots[i][1])
-                    if d < closed_distance:
-                        closed_distance = d
-                        closest_package_id = pkg[0]
+                closest_package_id = self.closest_free_package(i)
 
                 if closest_package_id is not None:
-                    self.packages_free[closest_package_id-1] = False
-                    self.robots_target[i] = closest_package_id
+                    self.assign_package(i, closest_package_id)
                     move, action = self.update_move_to_target(i, closest_package_id-1)    
                     actions.append((move, str(action)))
                 else:
@@ -168,4 +309,58 @@ class GreedyAgents:
         # print("N robots = ", len(self.robots))
         # print("Actions = ", actions)
         # print(self.robots_target)
-        return actions
\ No newline at end of file
+        self.last_actions = actions
+        return actions
+
+    def plan_to_target(self, robot_id, target_package_id, phase='start'):
+        """Whole path to the package start (phase 'start') or target, ending with a pickup/drop"""
+        pkg = self.packages[target_package_id]
+        target_p = (pkg[1], pkg[2])
+        pkg_act = '1'
+        if phase == 'target':
+            target_p = (pkg[3], pkg[4])
+            pkg_act = '2'
+
+        moves = bfs_path(self.map, (self.robots[robot_id][0], self.robots[robot_id][1]), target_p)
+        if moves is None:
+            return [('S', '0')]
+        if not moves:
+            return [('S', pkg_act)]
+        return [(move, '0') for move in moves[:-1]] + [(moves[-1], pkg_act)]
+
+    def get_macro_actions(self, state, replan=None):
+        """
+        Macro-action counterpart of get_actions, to be used with Environment.step_macro.
+        :param replan: Robots that need a new plan (infos['replan']), None for all robots.
+        :return: One plan per robot, or None to keep the plan the robot is executing.
+        """
+        self.is_init = True
+        self.last_actions = None  # Blocked moves are not known between macro callbacks
+        self.update_inner_state(state)
+
+        if replan is None:
+            replan = range(self.n_robots)
+        replan = set(replan)
+        if self.assigner is not None:
+            replan.update(self.reassign())
+
+        plans = []
+        for i in range(self.n_robots):
+            if self.robots_target[i] != 'free':
+                if i not in replan:
+                    plans.append(None)
+                elif self.robots[i][2] != 0:
+                    plans.append(self.plan_to_target(i, self.robots_target[i]-1, 'target'))
+                else:
+                    plans.append(self.plan_to_target(i, self.robots_target[i]-1))
+            else:
+                # Free robots are idle, so they are reconsidered on every callback
+                closest_package_id = self.closest_free_package(i)
+
+                if closest_package_id is not None:
+                    self.assign_package(i, closest_package_id)
+                    plans.append(self.plan_to_target(i, closest_package_id-1))
+                else:
+                    plans.append([])
+
+        return plans
\ No newline at end of file
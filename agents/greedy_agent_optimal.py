@@ -1,44 +1,29 @@
-import random
-def run_bfs(map, start, goal):
-    n_rows = len(map)
-    n_cols = len(map[0])
-
-    queue = []
-    visited = set()
-    queue.append((goal, []))
-    visited.add(goal)
-    d = {}
-    d[goal] = 0
-
-    while queue:
-        current, path = queue.pop(0)
-
-        for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            next_pos = (current[0] + dx, current[1] + dy)
-            if next_pos[0] < 0 or next_pos[0] >= n_rows or next_pos[1] < 0 or next_pos[1] >= n_cols:
-                continue
-            if next_pos not in visited and map[next_pos[0]][next_pos[1]] == 0:
-                visited.add(next_pos)
-                d[next_pos] = d[current] + 1
-                queue.append((next_pos, path + [next_pos]))
-
-    if start not in d:
-        return 'S', 100000
-
-    t = 0
-    actions = ['U', 'D', 'L', 'R']
-    current = start
-    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-        next_pos = (current[0] + dx, current[1] + dy)
-        if next_pos in d:
-            if d[next_pos] == d[current] - 1:
-                return actions[t], d[next_pos]
-        t += 1
-    return 'S', d[start]
+import logging
+import numpy as np
+
+from agents.deadlock import DeadlockDetector, DeadlockRecovery
+from utils.distance_field import DistanceFieldCache
+from utils.hpa import HierarchicalPathfinder
+
+# Per-step debug output, enabled with e.g. main.py --log_level DEBUG
+logger = logging.getLogger(__name__)
 
 
 class GreedyAgentsOptimal:
-    def __init__(self):
+    def __init__(self, rng=None, deadlock_recovery=False, hierarchical=False, cluster_size=10):
+        # Optional np.random.Generator used to break ties between nudge directions;
+        # without one the fixed L/R/U/D order is used
+        self.rng = rng
+        # Deadlocks are always detected and reported (deadlock_report), recovering is optional
+        self.deadlock_recovery = deadlock_recovery
+        # Route with utils/hpa.py instead of BFS distance fields (for large maps)
+        self.hierarchical = hierarchical
+        self.cluster_size = cluster_size
+        self.detector = None
+        self.recovery = None
+        self.last_actions = None
+        self.last_active = None  # Robots that made their own planned move last step
+        self.goal_distances = []
         self.agents = []
         self.packages = []
         self.packages_free = []
@@ -53,9 +38,19 @@ class GreedyAgentsOptimal:
         self.map = state['map']
         self.robots = [(robot[0] - 1, robot[1] - 1, 0) for robot in state['robots']]
         self.robots_target = ['free'] * self.n_robots
+        self.goal_distances = [0] * self.n_robots
         self.packages += [(p[0], p[1] - 1, p[2] - 1, p[3] - 1, p[4] - 1, p[5]) for p in state['packages']]
 
         self.packages_free = [True] * len(self.packages)
+        if self.hierarchical:
+            # Near-shortest paths whose cost per query does not grow with the map
+            self.distances = HierarchicalPathfinder(self.map, self.cluster_size)
+        else:
+            # Same moves as run_bfs (agents/greedy_agent.py), without flooding the map on every call
+            self.distances = DistanceFieldCache(self.map)
+        self.detector = DeadlockDetector(self.n_robots, len(self.map[0]))
+        if self.deadlock_recovery:
+            self.recovery = DeadlockRecovery(self.rng if self.rng is not None else np.random.default_rng(0))
 
     def update_move_to_target(self, robot_id, target_package_id, phase='start'):
 
@@ -78,7 +73,9 @@ class GreedyAgentsOptimal:
             target_p = (pkg[1], pkg[2])
             if phase == 'target':
                 target_p = (pkg[3], pkg[4])
-            move, distance = run_bfs(self.map, (self.robots[i][0], self.robots[i][1]), target_p)
+            move, distance = self.distances.next_move((self.robots[i][0], self.robots[i][1]), target_p)
+            # next_move gives the distance left after the move
+            self.goal_distances[i] = distance + 1 if move != 'S' else distance
 
             if distance == 0:
                 if phase == 'start':
@@ -86,6 +83,7 @@ class GreedyAgentsOptimal:
                 else:
                     pkg_act = 2  # Drop
         else:
+            self.goal_distances[i] = 0
             move = 'S'
             pkg_act = 1
             if phase == 'start':
@@ -113,6 +111,22 @@ class GreedyAgentsOptimal:
         self.packages += [(p[0], p[1] - 1, p[2] - 1, p[3] - 1, p[4] - 1, p[5]) for p in state['packages']]
         self.packages_free += [True] * len(state['packages'])
 
+        if 'blocked_changes' in state:
+            self.distances.apply_changes([(r - 1, c - 1, blocked) for r, c, blocked in state['blocked_changes']])
+
+    def current_goal(self, robot_id):
+        """Cell the robot is heading to: its package start, or target when carrying, None if free"""
+        if self.robots_target[robot_id] == 'free':
+            return None
+        pkg = self.packages[self.robots_target[robot_id] - 1]
+        if self.robots[robot_id][2] != 0:
+            return (pkg[3], pkg[4])
+        return (pkg[1], pkg[2])
+
+    def deadlock_report(self):
+        """Deadlock events and robot steps lost to deadlocks and livelocks so far"""
+        return self.detector.report()
+
     def compute_valid_position(self, map, position, move):
         """
         Computes the intended new position for a robot given its current position and move command.
@@ -153,9 +167,12 @@ class GreedyAgentsOptimal:
         else:
             self.update_inner_state(state)
 
+        positions = [(robot[0], robot[1]) for robot in self.robots]
         actions = []
         map = state['map']
-        print("State robot: ", self.robots)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("State robots: %s", self.robots)
         # Start assigning a greedy strategy
         for i in range(self.n_robots):
             # Step 1: Check if the robot is already assigned to a package
@@ -195,17 +212,28 @@ class GreedyAgentsOptimal:
                 else:
                     actions.append(('S', '0'))
 
+        # The detector compares the planned moves, before nudges and recovery, with the
+        # distances to the goals they just gave
+        planned = [move for move, _ in actions]
+        flagged = np.zeros(self.n_robots, dtype=bool)
+        if self.last_active is not None:
+            goals = [self.current_goal(i) for i in range(self.n_robots)]
+            flagged = self.detector.update(positions, self.last_active, goals, self.goal_distances)
+
         # If a moving robot would collide with a stationary robot, force the stationary robot to move
         robots = state['robots']
         occupied = {}
         for i in range(len(actions)):
-            print(self.compute_valid_position(map, (self.robots[i][0], self.robots[i][1]), actions[i][0]))
+            if debug:
+                logger.debug("Robot %d intended position %s", i,
+                             self.compute_valid_position(map, (self.robots[i][0], self.robots[i][1]), actions[i][0]))
             if actions[i][0] != 'S':
                 occupied[self.compute_valid_position(map, (self.robots[i][0], self.robots[i][1]), actions[i][0])] = i
         for i in range(len(actions)):
             if actions[i][0] == 'S' and actions[i][1] != 1:
                 moves = ['L', 'R', 'U', 'D']
-                # random.shuffle(moves)
+                if self.rng is not None:
+                    self.rng.shuffle(moves)
                 for move in moves:
                     new_pos = self.compute_valid_position(map, (self.robots[i][0], self.robots[i][1]), move)
                     if new_pos not in occupied:
@@ -214,7 +242,12 @@ class GreedyAgentsOptimal:
                         actions[i] = (move, actions[i][1])
                         break
 
-        print("N robots = ", len(self.robots))
-        print("Actions = ", actions)
-        print(self.robots_target)
+        if self.recovery is not None:
+            goals = [self.current_goal(i) for i in range(self.n_robots)]
+            self.recovery.adjust(map, positions, actions, goals, flagged)
+        self.last_actions = actions
+        self.last_active = [move != 'S' and action[0] == move for move, action in zip(planned, actions)]
+
+        if debug:
+            logger.debug("N robots = %d, actions = %s, targets = %s", len(self.robots), actions, self.robots_target)
         return actions
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+PPO agent for inference: one shared actor-critic network decides for all robots.
+
+Observations of every robot (and of every episode when using get_actions_batch) are
+stacked into one tensor so a step costs a single CPU forward pass. The network can
+be exported to TorchScript and loaded back from either format. The agent leaves
+torch's global state alone: an untrained network draws its weights from its own
+torch.Generator, and the number of intra-op threads is set once per run by
+run_experiment from the agent's num_threads option (one thread is usually fastest
+for the small batches of one episode).
+"""
+import math
+import numpy as np
+import torch
+import torch.nn as nn
+
+from envs.actions import MOVES, PKG_ACTS
+from utils.state_converter import PackageTracker, convert_state, observation_size
+
+# Joint discrete action: index = move * len(PKG_ACTS) + package action
+ACTIONS = [(move, pkg_act) for move in MOVES for pkg_act in PKG_ACTS]
+
+
+class ActorCritic(nn.Module):
+
+    def __init__(self, obs_dim, n_actions=len(ACTIONS), hidden_dim=128):
+        super().__init__()
+        self.body = nn.Sequential(
+            nn.Linear(obs_dim, hidden_dim), nn.Tanh(),
+            nn.Linear(hidden_dim, hidden_dim), nn.Tanh(),
+        )
+        self.policy_head = nn.Linear(hidden_dim, n_actions)
+        self.value_head = nn.Linear(hidden_dim, 1)
+
+    def forward(self, obs):
+        h = self.body(obs)
+        return self.policy_head(h), self.value_head(h).squeeze(-1)
+
+
+def init_weights(module, generator):
+    """Initialises the linear layers like PyTorch's default, drawing from generator instead of the global RNG."""
+    with torch.no_grad():
+        for layer in module.modules():
+            if isinstance(layer, nn.Linear):
+                bound = 1 / math.sqrt(layer.in_features)
+                layer.weight.uniform_(-bound, bound, generator=generator)
+                layer.bias.uniform_(-bound, bound, generator=generator)
+    return module
+
+
+def build_policy(view_radius=2, hidden_dim=128):
+    """An ActorCritic with uninitialised weights; built on the meta device so the global RNG is not used."""
+    with torch.device('meta'):
+        policy = ActorCritic(observation_size(view_radius), hidden_dim=hidden_dim)
+    return policy.to_empty(device='cpu')
+
+
+# (model_path, view_radius, hidden_dim, seed of an untrained network) -> policy
+_policy_cache = {}
+
+
+def load_policy(model_path, view_radius=2, hidden_dim=128, seed=2025):
+    """
+    Loads a policy from a TorchScript file or a state dict checkpoint, or initialises an
+    untrained one from seed if model_path is None. Policies are cached by their parameters
+    so agents of different episodes share one network (and can be batched).
+    """
+    key = (model_path, view_radius, hidden_dim, seed if model_path is None else None)
+    if key in _policy_cache:
+        return _policy_cache[key]
+
+    if model_path is None:
+        policy = init_weights(build_policy(view_radius, hidden_dim), torch.Generator().manual_seed(seed))
+    else:
+        try:
+            policy = torch.jit.load(model_path, map_location='cpu')
+        except RuntimeError:
+            checkpoint = torch.load(model_path, map_location='cpu')
+            state_dict = checkpoint.get('state_dict', checkpoint)
+            policy = build_policy(view_radius, hidden_dim)
+            policy.load_state_dict(state_dict)
+    policy.eval()
+    _policy_cache[key] = policy
+    return policy
+
+
+class PPO:
+
+    def __init__(self, model_path=None, view_radius=2, hidden_dim=128, deterministic=True, seed=2025):
+        """
+        :param model_path: TorchScript file or state dict checkpoint, None for an untrained network.
+        :param deterministic: Take the most likely action instead of sampling.
+        :param seed: Seed of the action sampling, and of the weights of an untrained network.
+        """
+        self.policy = load_policy(model_path, view_radius, hidden_dim, seed)
+        self.view_radius = view_radius
+        self.deterministic = deterministic
+        self.generator = torch.Generator().manual_seed(seed)
+        self.tracker = PackageTracker()
+        self.grid = None
+        self.n_robots = 0
+
+    def init_agents(self, state):
+        self.n_robots = len(state['robots'])
+        self.grid = np.asarray(state['map'], dtype=np.float32)
+        self.tracker.update(state)
+
+    def observe(self, state):
+        self.tracker.update(state)
+        return convert_state(state, self.tracker, self.view_radius, self.grid)
+
+    def decode(self, action_ids):
+        """int8 action array (move code, package action code) of joint action indices."""
+        return np.stack(np.divmod(np.asarray(action_ids, dtype=np.int8), len(PKG_ACTS)), axis=1)
+
+    def act(self, obs):
+        """Runs one forward pass on a (batch, obs_dim) array and returns action indices."""
+        with torch.inference_mode():
+            logits, _ = self.policy(torch.from_numpy(obs))
+            if self.deterministic:
+                action_ids = logits.argmax(dim=-1)
+            else:
+                action_ids = torch.multinomial(torch.softmax(logits, dim=-1), 1, generator=self.generator).squeeze(-1)
+        return action_ids.tolist()
+
+    def get_actions(self, state):
+        return self.decode(self.act(self.observe(state)))
+
+    @staticmethod
+    def get_actions_batch(agents, states):
+        """
+        Decides for several episodes at once: the observations of all robots of all
+        episodes sharing a network are stacked into one forward pass.
+        """
+        obs = [agent.observe(state) for agent, state in zip(agents, states)]
+        results = [None] * len(agents)
+        groups = {}
+        for k, agent in enumerate(agents):
+            groups.setdefault((id(agent.policy), agent.deterministic), []).append(k)
+        for members in groups.values():
+            action_ids = agents[members[0]].act(np.concatenate([obs[k] for k in members]))
+            offset = 0
+            for k in members:
+                n = len(obs[k])
+                results[k] = agents[k].decode(action_ids[offset:offset + n])
+                offset += n
+        return results
+
+    def export_torchscript(self, path):
+        """Saves the network as TorchScript, loadable with PPO(model_path=path) without this module's classes."""
+        scripted = self.policy if isinstance(self.policy, torch.jit.ScriptModule) else torch.jit.script(self.policy)
+        scripted.save(path)
+        return path
@@ -0,0 +1,90 @@
+"""
+Scaling of the zone-partitioned simulation, against the single process env.
+
+A warehouse map of the given size is filled with a large fleet taking random
+actions (so the agent does not dominate the timing), and the same action sequence
+is stepped through Environment and PartitionedEnvironment with increasing numbers
+of zone workers, for each fleet size. Results are checked to be identical.
+Throughput is reported in simulated robot-steps per second, with the speedup over
+one zone worker and the CPU time the coordinator spends per step: the coordinator
+makes one round trip to the zones per step, so its time bounds the speedup.
+Zones only run in parallel up to the number of cores, printed first; on a single
+core more zones can only add overhead.
+
+Usage: python -m benchmarks.partitioned --size 120 --robots 1000 4000 --zones 1 2 4
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.pathfinding import warehouse_map
+from envs.env import Environment
+from envs.partitioned import PartitionedEnvironment
+
+
+def run(env, actions):
+    """
+    Steps env through actions.
+    :return: The elapsed time, the CPU time of this process and the reward of every step.
+    """
+    env.reset()
+    rewards = []
+    start, start_cpu = time.perf_counter(), time.process_time()
+    for step_actions in actions:
+        state, r, done, infos = env.step(step_actions)
+        rewards.append(r)
+    return time.perf_counter() - start, time.process_time() - start_cpu, rewards
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Partitioned vs single process simulation throughput')
+    parser.add_argument('--size', type=int, default=120, help='Side of the generated map')
+    parser.add_argument('--robots', type=int, nargs='+', default=[1000, 4000], help='Fleet sizes')
+    parser.add_argument('--packages', type=int, default=500)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--zones', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.size}x{args.size} map, {args.steps} steps")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, 'warehouse.txt')
+        with open(map_file, 'w') as f:
+            for row in warehouse_map(args.size, args.seed):
+                f.write(' '.join(str(x) for x in row) + '\n')
+
+        for n_robots in args.robots:
+            rng = np.random.default_rng(args.seed)
+            moves = np.array(['S', 'L', 'R', 'U', 'D'])
+            pkg_acts = np.array(['0', '1', '2'])
+            actions = [list(zip(moves[rng.integers(5, size=n_robots)].tolist(),
+                                pkg_acts[rng.integers(3, size=n_robots)].tolist()))
+                       for _ in range(args.steps)]
+            env_args = (map_file, args.steps + 1, n_robots, args.packages)
+            setups = [('Environment', lambda: Environment(*env_args, seed=args.seed)),
+                      ('Environment vectorized', lambda: Environment(*env_args, seed=args.seed,
+                                                                     step_kernel='vectorized'))]
+            for n_zones in args.zones:
+                setups.append((f'{n_zones} zone worker(s)', lambda n_zones=n_zones: PartitionedEnvironment(
+                    *env_args, seed=args.seed, n_zones=n_zones)))
+
+            print(f"{n_robots} robots")
+            reference = one_zone = None
+            for name, make_env in setups:
+                env = make_env()
+                elapsed, cpu, rewards = run(env, actions)
+                env.close()
+                if reference is None:
+                    reference = rewards
+                status = 'same' if rewards == reference else 'DIFFERENT'
+                line = f"  {name:24} {n_robots * args.steps / elapsed:12.0f} robot-steps/sec"
+                if isinstance(env, PartitionedEnvironment):
+                    one_zone = one_zone or elapsed
+                    line += f"  {one_zone / elapsed:5.2f}x {args.zones[0]} zone(s)  coordinator {cpu / args.steps * 1e3:6.2f} ms/step"
+                print(f"{line}   rewards {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmarks flat BFS against hierarchical pathfinding as the map grows.
+
+Warehouse-like maps (rows of shelves separated by aisles, plus random clutter) of
+increasing size are generated, and the same random (start, goal) queries are
+answered by run_bfs (a full flood per call, as the greedy agents used to do), by
+a BFS distance field per goal (utils/distance_field.py) and by the
+HierarchicalPathfinder (utils/hpa.py). Times are per query, in milliseconds.
+
+Usage: python -m benchmarks.pathfinding --sizes 20 50 100 200
+"""
+import argparse
+import random
+import time
+import numpy as np
+
+from agents.greedy_agent import run_bfs
+from utils.distance_field import DistanceField
+from utils.hpa import HierarchicalPathfinder
+
+
+def warehouse_map(size, seed=0, clutter=0.03):
+    """Shelves of 2 x 8 cells separated by 1-cell aisles, walled border."""
+    rng = np.random.default_rng(seed)
+    grid = np.zeros((size, size), dtype=int)
+    grid[0, :] = grid[-1, :] = grid[:, 0] = grid[:, -1] = 1
+    for r in range(2, size - 3, 4):
+        for c in range(2, size - 9, 10):
+            grid[r:r + 2, c:c + 8] = 1
+    grid[rng.random((size, size)) < clutter] = 1
+    return grid.tolist()
+
+
+def benchmark(size, n_queries=50, cluster_size=10, seed=0):
+    grid = warehouse_map(size, seed)
+    random.seed(seed)
+    free = [(r, c) for r in range(size) for c in range(size) if grid[r][c] == 0]
+    queries = [tuple(random.sample(free, 2)) for _ in range(n_queries)]
+    result = {'size': size}
+
+    start = time.perf_counter()
+    for s, g in queries:
+        run_bfs(grid, s, g)
+    result['run_bfs'] = (time.perf_counter() - start) / n_queries * 1e3
+
+    start = time.perf_counter()
+    for s, g in queries:
+        DistanceField(grid, g).next_move(s)
+    result['field'] = (time.perf_counter() - start) / n_queries * 1e3
+
+    start = time.perf_counter()
+    hpa = HierarchicalPathfinder(grid, cluster_size)
+    result['hpa_build'] = (time.perf_counter() - start) * 1e3
+    start = time.perf_counter()
+    for s, g in queries:
+        hpa.next_move(s, g)
+    result['hpa_new_goal'] = (time.perf_counter() - start) / n_queries * 1e3
+    # Later moves towards the same goals, as robots do on every step
+    start = time.perf_counter()
+    for s, g in queries:
+        hpa.next_move(s, g)
+    result['hpa_cached'] = (time.perf_counter() - start) / n_queries * 1e3
+    result['hpa_nodes'] = len(hpa.nodes)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flat BFS vs hierarchical pathfinding')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 50, 100, 200])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--cluster_size', type=int, default=10)
+    args = parser.parse_args()
+
+    columns = ['size', 'run_bfs', 'field', 'hpa_build', 'hpa_new_goal', 'hpa_cached', 'hpa_nodes']
+    print(' '.join(f'{c:>12}' for c in columns))
+    for size in args.sizes:
+        result = benchmark(size, args.queries, args.cluster_size)
+        print(' '.join(f'{round(result[c], 3):>12}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
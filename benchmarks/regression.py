@@ -0,0 +1,212 @@
+"""
+Regression benchmark: runs the cmd.txt scenarios for each agent, checks the episode
+outcomes against golden values and the speed against a timing baseline.
+
+Outcomes (total reward, deliveries, steps) must match benchmarks/golden.json
+exactly. Speed is measured per scenario as environment steps per second (time
+spent in Environment.step only) and agent milliseconds per step. Single episodes
+are too short for stable timings, so for each agent the geometric mean of the
+ratios to benchmarks/baseline_timing.json over the scenarios run may not be worse
+than the tolerance. Timings depend on the machine, so regenerate the baseline
+when changing hardware. The baseline is recorded with the reference step kernel and
+other kernels are checked against it, so they have to be at least as fast on the
+scenarios they are meant for. The vectorized kernel targets large fleets: check it
+on benchmarks/large_fleet.txt (50 to 200 robots), where it is ahead of the
+reference, rather than on the cmd.txt scenarios with 5 to 10 robots.
+
+Usage:
+    python -m benchmarks.regression                      # check everything
+    python -m benchmarks.regression --seeds 2025 --agents greedy
+    python -m benchmarks.regression --cmd_file benchmarks/large_fleet.txt --step_kernel vectorized
+    python -m benchmarks.regression --update-golden      # after an intended behavior change
+    python -m benchmarks.regression --update-baseline    # record timings on this machine
+    python -m benchmarks.regression --cmd_file benchmarks/large_fleet.txt --update-golden --update-baseline
+"""
+import argparse
+import json
+import math
+import os
+import shlex
+import sys
+import time
+
+from envs.env import Environment
+from main import make_agents, resolve_map_file
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILE = os.path.join(BENCHMARK_DIR, 'golden.json')
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline_timing.json')
+DEFAULT_AGENTS = ['greedy', 'greedy_optimal']
+
+
+def parse_scenarios(cmd_file='cmd.txt'):
+    """Reads the main.py command lines of cmd_file into scenario dicts."""
+    scenarios = []
+    with open(cmd_file, 'r') as f:
+        for line in f:
+            args = shlex.split(line)
+            if len(args) < 2 or args[1] != 'main.py':
+                continue
+            options = dict(zip(args[2::2], args[3::2]))
+            scenarios.append({
+                'map': options.get('--map', 'maps/map5.txt'),
+                'seed': int(options.get('--seed', 2025)),
+                'max_time_steps': int(options.get('--max_time_steps', 100)),
+                'num_agents': int(options.get('--num_agents', 5)),
+                'n_packages': int(options.get('--n_packages', 10)),
+            })
+    return scenarios
+
+
+def scenario_key(agent_type, scenario):
+    return (f"{agent_type}/{scenario['map']}/seed{scenario['seed']}/"
+            f"r{scenario['num_agents']}/p{scenario['n_packages']}/t{scenario['max_time_steps']}")
+
+
+def run_scenario(agent_type, scenario, repeat=1, step_kernel='reference'):
+    """
+    Runs one episode, timing the environment and the agent separately.
+    :param repeat: Number of runs; the fastest env and agent times are kept, which
+        makes the timings far less sensitive to noise from other processes.
+    """
+    results = [run_episode(agent_type, scenario, step_kernel) for _ in range(repeat)]
+    result = dict(results[0])
+    result['steps_per_sec'] = max(r['steps_per_sec'] for r in results)
+    result['agent_ms_per_step'] = min(r['agent_ms_per_step'] for r in results)
+    return result
+
+
+def run_episode(agent_type, scenario, step_kernel='reference'):
+    env = Environment(resolve_map_file(scenario['map']), scenario['max_time_steps'],
+                      scenario['num_agents'], scenario['n_packages'], seed=scenario['seed'],
+                      step_kernel=step_kernel)
+    agents = make_agents({'type': agent_type})
+    env_time = agent_time = 0.0
+    state = env.reset()
+    agents.init_agents(state)
+    done = False
+    while not done:
+        start = time.perf_counter()
+        actions = agents.get_actions(state)
+        agent_time += time.perf_counter() - start
+        start = time.perf_counter()
+        state, reward, done, infos = env.step(actions)
+        env_time += time.perf_counter() - start
+    return {
+        'total_reward': round(env.total_reward, 6),
+        'delivered': env.n_delivered,
+        'total_time_steps': env.t,
+        'steps_per_sec': env.t / env_time if env_time > 0 else float('inf'),
+        'agent_ms_per_step': agent_time / env.t * 1e3,
+    }
+
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def check_golden(key, result, golden):
+    """:return: The list of outcome mismatches for one scenario."""
+    expected = golden.get(key)
+    if expected is None:
+        return ['no golden result']
+    return [f'{name} {result[name]} != golden {expected[name]}'
+            for name in ('total_reward', 'delivered', 'total_time_steps') if result[name] != expected[name]]
+
+
+def check_timing(results, baseline, tolerance):
+    """
+    Compares the timings of the scenarios of one agent with the baseline.
+    :param results: (key, result) pairs.
+    :return: The failure messages and the geometric mean ratios (speed, agent time), None if no baseline.
+    """
+    speed, agent = [], []
+    for key, result in results:
+        timing = baseline.get(key)
+        if timing is not None:
+            speed.append(math.log(result['steps_per_sec'] / timing['steps_per_sec']))
+            agent.append(math.log(result['agent_ms_per_step'] / timing['agent_ms_per_step']))
+    if not speed:
+        return [], None
+    speed_ratio = math.exp(sum(speed) / len(speed))
+    agent_ratio = math.exp(sum(agent) / len(agent))
+    failures = []
+    if speed_ratio < 1 - tolerance:
+        failures.append(f'env steps/sec at {speed_ratio:.2f}x the baseline')
+    if agent_ratio > 1 + tolerance:
+        failures.append(f'agent ms/step at {agent_ratio:.2f}x the baseline')
+    return failures, (speed_ratio, agent_ratio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regression benchmark over the cmd.txt scenarios')
+    parser.add_argument('--cmd_file', type=str, default='cmd.txt')
+    parser.add_argument('--agents', type=str, nargs='+', default=DEFAULT_AGENTS)
+    parser.add_argument('--seeds', type=int, nargs='+', default=None, help='Only run these seeds')
+    parser.add_argument('--maps', type=str, nargs='+', default=None, help='Only run these maps')
+    parser.add_argument('--step_kernel', type=str, default='reference', choices=['reference', 'vectorized'])
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario, the best timing is kept')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative slowdown against the timing baseline')
+    parser.add_argument('--update-golden', dest='update_golden', action='store_true',
+                        help='Store the outcomes as the new golden values')
+    parser.add_argument('--update-baseline', dest='update_baseline', action='store_true',
+                        help='Store the timings as the new baseline')
+    args = parser.parse_args()
+    if args.update_baseline and args.step_kernel != 'reference':
+        parser.error("The timing baseline is recorded with the reference step kernel.")
+
+    scenarios = [s for s in parse_scenarios(args.cmd_file)
+                 if (args.seeds is None or s['seed'] in args.seeds)
+                 and (args.maps is None or s['map'] in args.maps)]
+    golden = load_json(GOLDEN_FILE)
+    baseline = load_json(BASELINE_FILE)
+
+    n_failed = 0
+    updating = args.update_golden or args.update_baseline
+    for agent_type in args.agents:
+        results = []
+        for scenario in scenarios:
+            key = scenario_key(agent_type, scenario)
+            result = run_scenario(agent_type, scenario, args.repeat, args.step_kernel)
+            results.append((key, result))
+            if args.update_golden:
+                golden[key] = {k: result[k] for k in ('total_reward', 'delivered', 'total_time_steps')}
+            if args.update_baseline:
+                baseline[key] = {k: round(result[k], 4) for k in ('steps_per_sec', 'agent_ms_per_step')}
+            failures = [] if updating else check_golden(key, result, golden)
+            n_failed += bool(failures)
+            status = 'FAIL' if failures else 'ok'
+            print(f"{status:4} {key}: reward={result['total_reward']:.2f} delivered={result['delivered']} "
+                  f"steps/sec={result['steps_per_sec']:.0f} agent_ms/step={result['agent_ms_per_step']:.3f}"
+                  + (f" ({'; '.join(failures)})" if failures else ''))
+
+        if not updating:
+            failures, ratios = check_timing(results, baseline, args.tolerance)
+            n_failed += bool(failures)
+            if ratios is not None:
+                print(f"{'FAIL' if failures else 'ok':4} {agent_type} timing: env steps/sec {ratios[0]:.2f}x, "
+                      f"agent ms/step {ratios[1]:.2f}x the baseline")
+            else:
+                print(f"skip {agent_type} timing: no baseline, record one with --update-baseline")
+
+    if args.update_golden:
+        save_json(GOLDEN_FILE, golden)
+    if args.update_baseline:
+        save_json(BASELINE_FILE, baseline)
+    if n_failed:
+        print(f"{n_failed} check(s) failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
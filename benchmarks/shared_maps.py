@@ -0,0 +1,94 @@
+"""
+Per-worker warmup time and memory with and without the shared map registry.
+
+A warehouse map of the given size is written to a temporary file, then pools of
+increasing size each run one greedy episode per worker. Without the registry every
+worker reads the map and floods a distance field for each new goal; with it the
+map and the all-pairs distance table are published once (utils/map_registry.py)
+and the workers attach to them. Reported per configuration: the publish time, the
+median episode time of a worker and its private memory (RssAnon, Linux only); the
+shared table is counted once, in the publish line. Rewards are checked to be identical.
+
+Usage: python -m benchmarks.shared_maps --size 60 --workers 1 2 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.pathfinding import warehouse_map
+from envs.env import Environment
+from main import make_agents
+from utils import map_registry
+
+
+def private_memory_mb():
+    """Private resident memory of this process in MB, None where /proc is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_worker(args):
+    map_file, agent, n_robots, n_packages, steps, seed = args
+    start = time.perf_counter()
+    env = Environment(map_file, steps, n_robots, n_packages, seed=seed)
+    agents = make_agents({'type': agent})
+    state = env.reset()
+    agents.init_agents(state)
+    done = False
+    while not done:
+        state, reward, done, infos = env.step(agents.get_actions(state))
+    return time.perf_counter() - start, private_memory_mb(), env.total_reward
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker warmup and memory with shared map tables')
+    parser.add_argument('--size', type=int, default=60, help='Side of the generated map')
+    parser.add_argument('--robots', type=int, default=20)
+    parser.add_argument('--packages', type=int, default=200)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--agent', type=str, default='greedy')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.size}x{args.size} map, {args.robots} robots, {args.steps} steps")
+    with tempfile.TemporaryDirectory() as tmp:
+        map_file = os.path.join(tmp, 'warehouse.txt')
+        with open(map_file, 'w') as f:
+            for row in warehouse_map(args.size, args.seed):
+                f.write(' '.join(str(x) for x in row) + '\n')
+
+        reference = None
+        for shared in (False, True):
+            if shared:
+                start = time.perf_counter()
+                size = map_registry.publish(map_file).table.nbytes
+                print(f"published in {time.perf_counter() - start:.2f}s, table {size / 2**20:.1f} MB shared")
+            try:
+                for n_workers in args.workers:
+                    tasks = [(map_file, args.agent, args.robots, args.packages, args.steps, args.seed)] * n_workers
+                    with multiprocessing.Pool(n_workers) as pool:
+                        results = pool.map(run_worker, tasks, chunksize=1)
+                    times, memory, rewards = zip(*results)
+                    if reference is None:
+                        reference = rewards[0]
+                    status = 'same' if all(r == reference for r in rewards) else 'DIFFERENT'
+                    memory = f"{statistics.median(memory):7.1f} MB" if memory[0] is not None else '    n/a'
+                    print(f"{'shared' if shared else 'private':8} {n_workers:3} worker(s)  episode "
+                          f"{statistics.median(times):6.2f}s  private memory {memory}  rewards {status}")
+            finally:
+                if shared:
+                    map_registry.unpublish(map_file)
+
+
+if __name__ == '__main__':
+    main()
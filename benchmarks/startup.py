@@ -0,0 +1,76 @@
+"""
+Startup-time benchmark for headless `python main.py` runs.
+
+Sweeps launch thousands of short-lived workers, so interpreter startup and module
+imports are a real share of their CPU time. This measures, over fresh processes:
+  - the import of main (what every worker pays before doing anything),
+  - a complete one-step headless run of main.py,
+and checks that no plotting or deep-learning library got imported along the way.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 20 --agent greedy
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Libraries a headless greedy run must not load
+HEAVY_MODULES = ['matplotlib', 'torch', 'gym', 'pandas', 'imageio']
+
+IMPORT_CHECK = (
+    "import sys, main\n"
+    "from envs.env import Environment\n"
+    "env = Environment('maps/map1.txt', 5, 2, 2, seed=1)\n"
+    "agents = main.make_agents({{'type': {agent!r}}})\n"
+    "state = env.reset()\n"
+    "agents.init_agents(state)\n"
+    "env.step(agents.get_actions(state))\n"
+    "print(' '.join(m for m in {modules!r} if m in sys.modules))\n"
+)
+
+
+def time_command(command, runs):
+    """Wall time in seconds of each of runs executions of command in a fresh process."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    print(f"{name:28} min {min(times) * 1e3:7.1f} ms   median {statistics.median(times) * 1e3:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time of headless main.py runs')
+    parser.add_argument('--runs', type=int, default=10, help='Fresh processes per measurement')
+    parser.add_argument('--agent', type=str, default='greedy_optimal')
+    args = parser.parse_args()
+
+    python = sys.executable
+    report('python -c pass', time_command([python, '-c', 'pass'], args.runs))
+    report('import main', time_command([python, '-c', 'import main'], args.runs))
+    with tempfile.TemporaryDirectory() as tmp:
+        run = [python, 'main.py', '--map', 'map1.txt', '--max_time_steps', '5', '--agent', args.agent,
+               '--log_file', os.path.join(tmp, 'episodes.jsonl')]
+        report('main.py, 5 steps', time_command(run, args.runs))
+
+    check = subprocess.run([python, '-c', IMPORT_CHECK.format(agent=args.agent, modules=HEAVY_MODULES)],
+                           cwd=ROOT_DIR, check=True, capture_output=True, text=True)
+    loaded = check.stdout.split()
+    if loaded:
+        print(f"Headless run imported {', '.join(loaded)}")
+        sys.exit(1)
+    print(f"Headless run imported none of {', '.join(HEAVY_MODULES)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Integer action encoding shared by the environment, the agent protocol and agents.
+
+Actions are an int8 array of shape (n_robots, 2): column 0 is the move code (index
+in MOVES) and column 1 the package action code (index in PKG_ACTS). The list of
+(move, package action) string tuples used by the agents is converted by
+as_action_array; unknown strings mean 'stay' and 'do nothing' as they always did.
+The reference step kernel reads such lists directly through split_actions, without
+building an array.
+"""
+import numpy as np
+
+MOVES = ['S', 'L', 'R', 'U', 'D']
+PKG_ACTS = ['0', '1', '2']
+MOVE_CODES = {move: i for i, move in enumerate(MOVES)}
+PKG_ACT_CODES = {pkg_act: i for i, pkg_act in enumerate(PKG_ACTS)}
+# Package action codes of both string and int package actions
+_PKG_ACT_LOOKUP = {**PKG_ACT_CODES, **{i: i for i in range(len(PKG_ACTS))}}
+# (row, col) offset of each move code
+MOVE_DELTAS = np.array([(0, 0), (0, -1), (0, 1), (-1, 0), (1, 0)], dtype=np.int32)
+
+STAY, PICKUP, DROP = 0, 1, 2
+
+
+def encode_actions(actions):
+    """int8 array of a list of (move, package action) tuples; package actions may be ints or strings."""
+    codes = np.zeros((len(actions), 2), dtype=np.int8)
+    codes[:, 0] = [MOVE_CODES.get(move, 0) for move, pkg_act in actions]
+    codes[:, 1] = [PKG_ACT_CODES.get(str(pkg_act), 0) for move, pkg_act in actions]
+    return codes
+
+
+def decode_actions(codes):
+    """List of (move, package action) string tuples of an action array."""
+    return [(MOVES[move], PKG_ACTS[pkg_act]) for move, pkg_act in np.asarray(codes).tolist()]
+
+
+def validate_actions(codes, n_robots):
+    """
+    Checks an action array in bulk.
+    :return: The actions as an int8 array of shape (n_robots, 2).
+    """
+    codes = np.asarray(codes)
+    if codes.shape != (n_robots, 2):
+        raise ValueError(f"Actions must have shape ({n_robots}, 2), got {codes.shape}.")
+    if not np.issubdtype(codes.dtype, np.integer):
+        raise ValueError(f"Actions must be integer codes, got dtype {codes.dtype}.")
+    invalid = (codes[:, 0] < 0) | (codes[:, 0] >= len(MOVES)) | (codes[:, 1] < 0) | (codes[:, 1] >= len(PKG_ACTS))
+    if invalid.any():
+        i = int(np.flatnonzero(invalid)[0])
+        raise ValueError(f"Invalid action {codes[i].tolist()} for robot {i}.")
+    return codes.astype(np.int8, copy=False)
+
+
+def as_action_array(actions, n_robots):
+    """Validated int8 action array from either an array or a list of (move, package action) tuples."""
+    if isinstance(actions, np.ndarray):
+        return validate_actions(actions, n_robots)
+    if len(actions) != n_robots:
+        raise ValueError("The number of actions must match the number of robots.")
+    return encode_actions(actions)
+
+
+def split_actions(actions, n_robots):
+    """
+    Move strings and package action codes of either an array or a list of (move, package
+    action) tuples, as two sequences. Tuples are decoded directly, which costs far less
+    than building and validating an array for the few robots of a step.
+    """
+    if isinstance(actions, np.ndarray):
+        codes = validate_actions(actions, n_robots).tolist()
+        return [MOVES[move] for move, pkg_act in codes], [pkg_act for move, pkg_act in codes]
+    if len(actions) != n_robots:
+        raise ValueError("The number of actions must match the number of robots.")
+    if not actions:
+        return [], []
+    moves, pkg_acts = zip(*actions)
+    if not MOVE_CODES.keys() >= set(moves):
+        moves = [move if move in MOVE_CODES else 'S' for move in moves]
+    return moves, [_PKG_ACT_LOOKUP.get(pkg_act, 0) for pkg_act in pkg_acts]
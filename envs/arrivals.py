@@ -0,0 +1,84 @@
+"""
+Lazy package generation for streaming (unbounded-horizon) episodes.
+
+Packages arrive as a Poisson process: inter-arrival times are exponential, so the
+number of packages released per time step is Poisson(rate). An arrival at time x
+is released at step ceil(x). Pickup cells are drawn from the free cells with
+weights raised around optional hotspots; targets are uniform over the free cells.
+Only the next arrival is ever materialized, so memory does not grow with the horizon.
+"""
+import math
+import numpy as np
+
+
+class PackageStream:
+
+    def __init__(self, grid, rng, rate=0.5, hotspots=None, hotspot_radius=3.0, start_id=1):
+        """
+        :param grid: The map (0 free, 1 obstacle).
+        :param rng: RandomState or Generator the arrivals are drawn from.
+        :param rate: Mean number of packages released per time step.
+        :param hotspots: Optional list of ((row, col), weight) with 0-indexed cells. A free
+            cell's pickup weight is 1 + sum(weight * exp(-d^2 / (2 * hotspot_radius^2))),
+            d being its euclidean distance to each hotspot.
+        :param start_id: Id of the first package produced.
+        """
+        if rate <= 0:
+            raise ValueError("The arrival rate must be positive.")
+        grid = np.asarray(grid)
+        self.n_rows = grid.shape[0]
+        self.rng = rng
+        self.rate = rate
+        self.free_cells = np.argwhere(grid == 0)
+        if len(self.free_cells) < 2:
+            raise ValueError("The map needs at least two free cells.")
+
+        weights = np.ones(len(self.free_cells))
+        for (row, col), weight in hotspots or []:
+            d2 = ((self.free_cells - (row, col)) ** 2).sum(axis=1)
+            weights += weight * np.exp(-d2 / (2.0 * hotspot_radius ** 2))
+        self.start_cdf = np.cumsum(weights) / weights.sum()
+
+        self.next_id = start_id
+        self.arrival = 0.0
+        self.next_time = None  # Release step of the next package
+        self._draw_next_arrival()
+
+    def _draw_next_arrival(self):
+        self.arrival += self.rng.exponential(1.0 / self.rate)
+        self.next_time = max(1, math.ceil(self.arrival))
+
+    def _random_cell(self, cdf=None):
+        if cdf is None:
+            i = int(self.rng.random() * len(self.free_cells))
+        else:
+            i = int(np.searchsorted(cdf, self.rng.random(), side='right'))
+        i = min(i, len(self.free_cells) - 1)
+        row, col = self.free_cells[i]
+        return (int(row), int(col))
+
+    def make_package(self, start_time):
+        """Draws one package released at start_time, as (package_id, start, target, start_time, deadline)."""
+        start = self._random_cell(self.start_cdf)
+        while True:
+            target = self._random_cell()
+            if start != target:
+                break
+        # Same deadline range as the batch mode of Environment.reset
+        low, high = self.n_rows / 2, 3 * self.n_rows
+        to_deadline = 10 + int(low + self.rng.random() * (high - low))
+        package_id = self.next_id
+        self.next_id += 1
+        return package_id, start, target, start_time, start_time + to_deadline
+
+    def release(self, t):
+        """Returns the packages released at steps up to t that were not returned before."""
+        packages = []
+        while self.next_time <= t:
+            packages.append(self.make_package(self.next_time))
+            self._draw_next_arrival()
+        return packages
+
+    @property
+    def n_created(self):
+        return self.next_id - 1
@@ -1,8 +1,12 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import os
-from matplotlib.colors import ListedColormap
-from matplotlib.patches import Patch
+import bisect
+from collections import deque
+from envs.actions import MOVE_DELTAS, PICKUP, DROP, as_action_array, split_actions
+from envs.arrivals import PackageStream
+from envs.features import FeaturePlanes
+from utils import map_registry
+from envs.metrics import RollingWindow
 
 class Robot: 
     def __init__(self, position): 
@@ -22,10 +26,16 @@ class Environment:
 
     def __init__(self, map_file, max_time_steps = 100, n_robots = 5, n_packages=20,
              move_cost=-0.01, delivery_reward=10., delay_reward=1., 
-             seed=2025): 
-        """ Initializes the simulation environment. :param map_file: Path to the map text file. :param move_cost: Cost incurred when a robot moves (LRUD). :param delivery_reward: Reward for delivering a package on time. """ 
+             seed=2025, rng_mode='legacy', arrival_mode='batch', arrival_rate=0.5,
+             hotspots=None, throughput_window=1000, metrics=None, step_kernel='reference',
+             feature_radius=None): 
+        """ Initializes the simulation environment. :param map_file: Path to the map text file. :param move_cost: Cost incurred when a robot moves (LRUD). :param delivery_reward: Reward for delivering a package on time. :param rng_mode: 'legacy' draws everything from one RandomState(seed) as before; 'streams' gives robot placement, package arrivals and agents independent Generators spawned from SeedSequence(seed) per episode (see reset). :param arrival_mode: 'batch' creates all n_packages on reset; 'stream' releases n_packages at time 0 then creates packages lazily with Poisson(arrival_rate) arrivals per step (see envs/arrivals.py), retires delivered packages and only ends at max_time_steps (None for no limit). :param hotspots: Stream mode pickup hotspots, a list of ((row, col), weight). :param throughput_window: Number of steps of the rolling deliveries window. :param metrics: Optional envs.metrics.MetricsCollector fed with pickups, deliveries, robot activity and blocked moves. :param step_kernel: 'reference' resolves moves robot by robot with position dicts; 'vectorized' keeps positions in an int32 array and resolves moves with NumPy over cell-id arrays (see move_vectorized), with identical results. The vectorized kernel is meant for large fleets: its fixed NumPy overhead makes it slower than the reference below about 50 robots. :param feature_radius: If not None, the env maintains observation feature planes (see envs/features.py) in self.features, with robot-centred views of this radius. """ 
         self.map_file = map_file
         self.grid = self.load_map()
+        # Cells blocked at runtime with set_cell_blocked, unblocked again on reset
+        self.blocked_cells = set()
+        self.blocked_changes = []
+        self.reported_changes = []
         self.n_rows = len(self.grid)
         self.n_cols = len(self.grid[0]) if self.grid else 0 
         self.move_cost = move_cost 
@@ -39,8 +49,34 @@ class Environment:
         self.n_robots = n_robots
         self.max_time_steps = max_time_steps
         self.n_packages = n_packages
-
-        self.rng = np.random.RandomState(seed)
+        if arrival_mode not in ('batch', 'stream'):
+            raise ValueError("arrival_mode must be 'batch' or 'stream'.")
+        if arrival_mode == 'batch' and max_time_steps is None:
+            raise ValueError("max_time_steps is required in batch arrival mode.")
+        self.arrival_mode = arrival_mode
+        self.arrival_rate = arrival_rate
+        self.hotspots = hotspots
+        self.throughput = RollingWindow(throughput_window)
+        self.metrics = metrics
+        if step_kernel not in ('reference', 'vectorized'):
+            raise ValueError("step_kernel must be 'reference' or 'vectorized'.")
+        self.step_kernel = step_kernel
+        self.features = FeaturePlanes(self.n_rows, self.n_cols, feature_radius) if feature_radius is not None else None
+
+        self.seed = seed
+        self.rng_mode = rng_mode
+        self.episode = -1
+        if rng_mode == 'legacy':
+            self.rng = np.random.RandomState(seed)
+            self.layout_rng = self.rng
+            self.package_rng = self.rng
+        elif rng_mode == 'streams':
+            # Created by reset() for each episode
+            self.rng = None
+            self.layout_rng = None
+            self.package_rng = None
+        else:
+            raise ValueError("rng_mode must be 'legacy' or 'streams'.")
         self.reset()
         self.done = False
         self.state = None
@@ -55,7 +91,11 @@ class Environment:
         Reads the map file and returns a 2D grid.
         Assumes that each line in the file contains numbers separated by space.
         0 indicates free cell and 1 indicates an obstacle.
+        Maps published with utils/map_registry.py are copied from shared memory instead.
         """
+        shared = map_registry.attach(self.map_file)
+        if shared is not None:
+            return shared.grid.tolist()
         grid = []
         with open(self.map_file, 'r') as f:
             for line in f:
@@ -86,17 +126,30 @@ class Environment:
         else:
             raise ValueError("Invalid robot position: must be on a free cell not occupied by an obstacle or another robot.")
 
-    def reset(self):
+    def reset(self, episode=None):
         """
         Resets the environment to its initial state.
         Clears all robots and packages, and reinitializes the grid.
+        :param episode: Index of the episode. In 'streams' mode the robot placement and
+            package streams of the episode are derived from (seed, episode) alone, so an
+            episode is reproduced whatever ran before it in this env. None continues with
+            the episode after the previous one. The legacy RandomState ignores it.
         """
+        self.episode = self.episode + 1 if episode is None else episode
+        if self.rng_mode == 'streams':
+            self.layout_rng = self.make_rng(0, self.episode)
+            self.package_rng = self.make_rng(1, self.episode)
         self.t = 0
         self.robots = []
         self.packages = []
         self.total_reward = 0
         self.done = False
         self.state = None
+        for r, c in self.blocked_cells:
+            self.grid[r][c] = 0
+        self.blocked_cells = set()
+        self.blocked_changes = []
+        self.reported_changes = []
 
         # Reinitialize the grid
         #self.grid = self.load_map(sel)
@@ -106,8 +159,27 @@ class Environment:
             # Randomly select a free cell for the robot
             position, tmp_grid = self.get_random_free_cell(tmp_grid)
             self.add_robot(position)
+        if self.step_kernel == 'vectorized':
+            self.init_kernel()
+        if self.features is not None:
+            self.features.reset(self.grid, [robot.position for robot in self.robots])
         
         N = self.n_rows
+        # Packages by id, delivered ones are dropped from it in stream mode
+        self.package_index = {}
+        self.n_delivered = 0
+        self.throughput.reset()
+        if self.metrics is not None:
+            self.metrics.reset()
+        # Remaining macro-action plan of each robot (see step_macro)
+        self.macro_plans = [deque() for _ in range(self.n_robots)]
+        if self.arrival_mode == 'stream':
+            self.stream = PackageStream(self.grid, self.package_rng, self.arrival_rate, self.hotspots)
+            self.add_packages([self.stream.make_package(0) for _ in range(self.n_packages)])
+            self.released_t = 0
+            return self.get_state()
+        self.stream = None
+
         list_packages = []
         for i in range(self.n_packages):
             # Randomly select a free cell for the package
@@ -117,11 +189,11 @@ class Environment:
                 if start != target:
                     break
             
-            to_deadline = 10 + self.rng.randint(N/2, 3*N)
+            to_deadline = 10 + self.randint(self.package_rng, N/2, 3*N)
             if i <= min(self.n_robots, 20):
                 start_time = 0
             else:
-                start_time = self.rng.randint(1, self.max_time_steps)
+                start_time = self.randint(self.package_rng, 1, self.max_time_steps)
             list_packages.append((start_time, start, target, start_time + to_deadline ))
 
         list_packages.sort(key=lambda x: x[0])
@@ -129,6 +201,10 @@ class Environment:
             start_time, start, target, deadline = list_packages[i]
             package_id = i+1
             self.packages.append(Package(start, start_time, target, deadline, package_id))
+            self.package_index[package_id] = self.packages[-1]
+
+        # Sorted release times, used to find the next event when skipping idle steps
+        self.release_times = [p.start_time for p in self.packages]
 
         return self.get_state()
     
@@ -138,22 +214,136 @@ class Environment:
         The state includes the positions of robots and packages.
         :return: State representation.
         """
-        selected_packages = []
-        for i in range(len(self.packages)):
-            if self.packages[i].start_time == self.t:
-                selected_packages.append(self.packages[i])
-                self.packages[i].status = 'waiting'
+        if self.stream is not None:
+            if self.released_t != self.t:
+                self.released = self.add_packages(self.stream.release(self.t))
+                self.released_t = self.t
+            selected_packages = self.released
+        else:
+            selected_packages = []
+            for i in range(len(self.packages)):
+                if self.packages[i].start_time == self.t:
+                    selected_packages.append(self.packages[i])
+                    if self.features is not None and self.packages[i].status == 'None':
+                        self.features.release(self.packages[i])
+                    self.packages[i].status = 'waiting'
 
         state = {
             'time_step': self.t,
             'map': self.grid,
-            'robots': [(robot.position[0] + 1, robot.position[1] + 1,
-                        robot.carrying) for robot in self.robots],
+            'robots': self.robot_states(),
             'packages': [(package.package_id, package.start[0] + 1, package.start[1] + 1, 
                           package.target[0] + 1, package.target[1] + 1, package.start_time, package.deadline) for package in selected_packages]
         }
+        if self.reported_changes:
+            # Cells toggled since the previous state, as (row, col, blocked)
+            state['blocked_changes'] = [(r + 1, c + 1, int(blocked)) for r, c, blocked in self.reported_changes]
         return state
-        
+
+    def robot_states(self):
+        """(row, col, carrying) of every robot, 1-indexed, as in the 'robots' entry of the state."""
+        return [(robot.position[0] + 1, robot.position[1] + 1, robot.carrying) for robot in self.robots]
+
+    def set_cell_blocked(self, position, blocked=True):
+        """
+        Blocks a free cell (e.g. a closed aisle) or frees a cell blocked before. The change
+        is reported once in the 'blocked_changes' entry of the next state returned by step().
+        :param position: Tuple (row, column), 0-indexed.
+        """
+        r, c = position
+        if not (0 <= r < self.n_rows and 0 <= c < self.n_cols):
+            raise ValueError("Cell out of the map.")
+        if blocked:
+            if self.grid[r][c] == 1:
+                raise ValueError("The cell is already an obstacle.")
+            if any(robot.position == (r, c) for robot in self.robots):
+                raise ValueError("Cannot block a cell occupied by a robot.")
+            self.blocked_cells.add((r, c))
+        else:
+            if (r, c) not in self.blocked_cells:
+                raise ValueError("Only cells blocked with set_cell_blocked can be unblocked.")
+            self.blocked_cells.remove((r, c))
+        self.grid[r][c] = 1 if blocked else 0
+        self.blocked_changes.append((r, c, blocked))
+        if self.features is not None:
+            self.features.set_blocked((r, c), blocked)
+        if self.step_kernel == 'vectorized':
+            self.free_mask[r * self.n_cols + c] = not blocked
+            self.update_next_cells(r, c)
+
+    def init_kernel(self):
+        """Allocates the arrays of the vectorized step kernel for the robots placed by reset."""
+        n_cells = self.n_rows * self.n_cols
+        # Robots are located by cell id, row * n_cols + col
+        self.cell_positions = np.array([r * self.n_cols + c for r, c in (robot.position for robot in self.robots)],
+                                       dtype=np.int32)
+        self.free_mask = (np.array(self.grid) == 0).ravel()
+        # Cell reached from each cell with each move code (the cell itself if the move is invalid)
+        self.next_cell = np.empty((n_cells, len(MOVE_DELTAS)), dtype=np.int32)
+        self.update_next_cells()
+        # Robot index by cell id, and lowest index of the robots moving into a cell;
+        # both are left at their fill value between steps
+        self.occupant = np.full(n_cells, -1, dtype=np.int32)
+        self.claim = np.full(n_cells, len(self.robots), dtype=np.int32)
+        self.robot_ids = np.arange(len(self.robots), dtype=np.int32)
+
+    def update_next_cells(self, row=None, col=None):
+        """Recomputes the next_cell table, for every cell or around a toggled cell."""
+        if row is None:
+            cells = np.arange(self.n_rows * self.n_cols)
+        else:
+            cells = np.array([(row + dr) * self.n_cols + col + dc for dr, dc in MOVE_DELTAS
+                              if 0 <= row + dr < self.n_rows and 0 <= col + dc < self.n_cols])
+        rows, cols = np.divmod(cells, self.n_cols)
+        for code, (dr, dc) in enumerate(MOVE_DELTAS):
+            r, c = rows + dr, cols + dc
+            inside = (r >= 0) & (r < self.n_rows) & (c >= 0) & (c < self.n_cols)
+            target = np.where(inside, r * self.n_cols + c, cells)
+            self.next_cell[cells, code] = np.where(self.free_mask[target], target, cells)
+
+    def add_packages(self, packages):
+        """
+        Adds released packages in stream mode.
+        :param packages: (package_id, start, target, start_time, deadline) tuples from the PackageStream.
+        :return: The new Package objects.
+        """
+        new_packages = []
+        for package_id, start, target, start_time, deadline in packages:
+            pkg = Package(start, start_time, target, deadline, package_id)
+            pkg.status = 'waiting'
+            self.packages.append(pkg)
+            self.package_index[package_id] = pkg
+            new_packages.append(pkg)
+            if self.features is not None:
+                self.features.release(pkg)
+        self.released = new_packages
+        return new_packages
+
+    @property
+    def n_created(self):
+        """Number of packages created so far (all of them in batch mode)."""
+        return self.stream.n_created if self.stream is not None else len(self.packages)
+
+    def make_rng(self, *key):
+        """
+        Returns a Generator for the component identified by key, spawned from SeedSequence(seed).
+        Keys (0, episode) and (1, episode) are the robot placement and package arrival streams.
+        """
+        return np.random.Generator(np.random.PCG64(np.random.SeedSequence(self.seed, spawn_key=key)))
+
+    def agent_rng(self, index=0, episode=None):
+        """
+        Independent random stream for the agent with the given index in an episode.
+        :param episode: Index of the episode, None for the episode of the last reset.
+        """
+        return self.make_rng(2, self.episode if episode is None else episode, index)
+
+    @staticmethod
+    def randint(rng, low, high):
+        """Draws an integer in [low, high) from either a legacy RandomState or a Generator."""
+        if isinstance(rng, np.random.Generator):
+            return int(rng.integers(int(low), int(high)))
+        return rng.randint(low, high)
 
     def get_random_free_cell_p(self):
         """
@@ -162,7 +352,7 @@ class Environment:
         """
         free_cells = [(i, j) for i in range(self.n_rows) for j in range(self.n_cols) \
                       if self.grid[i][j] == 0]
-        i = self.rng.randint(0, len(free_cells))
+        i = self.randint(self.package_rng, 0, len(free_cells))
         return free_cells[i]
 
 
@@ -173,7 +363,7 @@ class Environment:
         """
         free_cells = [(i, j) for i in range(self.n_rows) for j in range(self.n_cols) \
                       if new_grid[i][j] == 0]
-        i = self.rng.randint(0, len(free_cells))
+        i = self.randint(self.layout_rng, 0, len(free_cells))
         new_grid[free_cells[i][0]][free_cells[i][1]] = 1
         return free_cells[i], new_grid
 
@@ -181,25 +371,111 @@ class Environment:
     def step(self, actions):
         """
         Advances the simulation by one timestep.
-        :param actions: A list where each element is a tuple (move_action, package_action) for a robot.
+        :param actions: An int8 array of shape (n_robots, 2) with the move and package action
+            codes of envs/actions.py, or a list where each element is a tuple (move_action, package_action) for a robot.
             move_action: one of 'S', 'L', 'R', 'U', 'D'.
             package_action: '1' (pickup), '2' (drop), or '0' (do nothing).
         :return: The updated state and total accumulated reward.
         """
-        r = 0
-        if len(actions) != len(self.robots):
-            raise ValueError("The number of actions must match the number of robots.")
+        if self.step_kernel == 'vectorized':
+            actions = as_action_array(actions, len(self.robots))
+            pkg_acts = actions[:, 1].tolist()
+        else:
+            moves, pkg_acts = split_actions(actions, len(self.robots))
+        self.reported_changes, self.blocked_changes = self.blocked_changes, []
+
+        if self.step_kernel == 'vectorized':
+            r, moved, counts = self.move_vectorized(actions)
+        else:
+            r, moved, counts = self.move_reference(moves)
+
+        # -------- Process Package Actions --------
+        for i, pkg_act in enumerate(pkg_acts):
+            if not pkg_act:
+                continue
+            robot = self.robots[i]
+            # Pick up action.
+            if pkg_act == PICKUP:
+                if robot.carrying == 0:
+                    # Check for available packages at the current cell.
+                    for j in range(len(self.packages)):
+                        if self.packages[j].status == 'waiting' and self.packages[j].start == robot.position and self.packages[j].start_time <= self.t:
+                            # Pick the package with the smallest package_id.
+                            package_id = self.packages[j].package_id
+                            robot.carrying = package_id
+                            self.packages[j].status = 'in_transit'
+                            if self.metrics is not None:
+                                self.metrics.on_pickup(self.packages[j], self.t)
+                            if self.features is not None:
+                                self.features.pickup(self.packages[j])
+                            # print(package_id, 'in transit')
+                            break
 
-        #print("Package env: ")
-        #print([p.status for p in self.packages])
+            # Drop action.
+            elif pkg_act == DROP:
+                if robot.carrying != 0:
+                    package_id = robot.carrying
+                    pkg = self.package_index[package_id]
+                    # Check if the robot is at the target position.
+                    if robot.position == pkg.target:
+                        # Update package status to delivered.
+                        pkg.status = 'delivered'
+                        self.n_delivered += 1
+                        self.throughput.add(self.t)
+                        if self.metrics is not None:
+                            self.metrics.on_delivery(pkg, self.t)
+                        if self.features is not None:
+                            self.features.deliver(pkg)
+                        if self.stream is not None:
+                            del self.package_index[package_id]
+                        # Apply reward based on whether the delivery is on time.
+                        if self.t <= pkg.deadline:
+                            r += self.delivery_reward
+                        else:
+                            # Example: a reduced reward for late delivery.
+                            r += self.delay_reward
+                        robot.carrying = 0  
+        
+        if self.stream is not None and len(self.package_index) < len(self.packages):
+            # Retire delivered packages so memory only holds the live ones
+            self.packages = [p for p in self.packages if p.status != 'delivered']
+
+        # Increment the simulation timestep.
+        self.t += 1
+
+        self.total_reward += r
+
+        done = False
+        infos = {}
+        if self.stream is not None:
+            self.throughput.advance(self.t)
+            infos['throughput'] = self.throughput.rate()
+        if self.metrics is not None:
+            n_carrying = sum(robot.carrying != 0 for robot in self.robots)
+            n_moving = sum(moved[i] and robot.carrying == 0 for i, robot in enumerate(self.robots))
+            self.metrics.on_step(self.t, len(self.robots), n_carrying, n_moving, *counts)
+        if self.check_terminate():
+            done = True
+            infos['total_reward'] = self.total_reward
+            infos['total_time_steps'] = self.t
 
+        return self.get_state(), r, done, infos
+    
+    def move_reference(self, moves):
+        """
+        Moves the robots, resolving conflicts one robot at a time.
+        :param moves: The move string of each robot, as returned by split_actions.
+        :return: The movement reward, which robots moved and the (attempted, blocked,
+            invalid) move counts; the last two are None unless metrics are collected.
+        """
+        r = 0
         # -------- Process Movement --------
         proposed_positions = []
         # For each robot, compute the new position based on the movement action.
         old_pos = {}
         next_pos = {}
         for i, robot in enumerate(self.robots):
-            move, pkg_act = actions[i]
+            move = moves[i]
             new_pos = self.compute_new_position(robot.position, move)
             # Check if the new position is valid (inside bounds and not an obstacle).
             if not self.valid_position(new_pos):
@@ -257,65 +533,201 @@ class Environment:
             if computed_moved[i] == 0:
                 final_positions[i] = self.robots[i].position 
         
+        moved = counts = None
+        if self.metrics is not None:
+            n_attempts = n_blocked = n_invalid = 0
+            moved = [final_positions[i] != robot.position for i, robot in enumerate(self.robots)]
+            for i, robot in enumerate(self.robots):
+                if moves[i] != 'S':
+                    n_attempts += 1
+                    if proposed_positions[i] == robot.position:
+                        n_invalid += 1
+                    elif not moved[i]:
+                        n_blocked += 1
+            counts = (n_attempts, n_blocked, n_invalid)
+
         # Update robot positions and apply movement cost when applicable.
         for i, robot in enumerate(self.robots):
-            move, pkg_act = actions[i]
-            if move in ['L', 'R', 'U', 'D'] and final_positions[i] != robot.position:
-                r += self.move_cost
+            if final_positions[i] != robot.position:
+                if moves[i] != 'S':
+                    r += self.move_cost
+                if self.features is not None:
+                    self.features.move_robot(robot.position, final_positions[i])
             robot.position = final_positions[i]
+        return r, moved, counts
 
-        # -------- Process Package Actions --------
-        for i, robot in enumerate(self.robots):
-            move, pkg_act = actions[i]
-            #print(i, move, pkg_act)
-            # Pick up action.
-            if pkg_act == '1':
-                if robot.carrying == 0:
-                    # Check for available packages at the current cell.
-                    for j in range(len(self.packages)):
-                        if self.packages[j].status == 'waiting' and self.packages[j].start == robot.position and self.packages[j].start_time <= self.t:
-                            # Pick the package with the smallest package_id.
-                            package_id = self.packages[j].package_id
-                            robot.carrying = package_id
-                            self.packages[j].status = 'in_transit'
-                            # print(package_id, 'in transit')
-                            break
+    def move_vectorized(self, actions):
+        """
+        Moves the robots like move_reference, with NumPy operations on integer moves,
+        int32 cell positions and cell-id arrays. In the reference resolution a robot moves
+        into its target cell if it has the lowest index among the robots targeting that
+        cell and the cell is either empty or left by its occupant; robots waiting on
+        each other in a cycle (e.g. swapping cells) all stay. Moves are therefore settled
+        along the chains of robots following each other, one link per iteration.
+        A step costs a few dozen NumPy calls whatever the fleet size, so this kernel only
+        beats move_reference from about 50 robots on (benchmarks/large_fleet.txt); the
+        cmd.txt scenarios with 5 to 10 robots run faster with the reference kernel.
+        :return: Same as move_reference.
+        """
+        n = len(self.robots)
+        codes = actions[:, 0]
+        current = self.cell_positions
+        cells = self.next_cell[current, codes]
+        static = cells == current
+        movers = (~static).nonzero()[0]
+        moved = np.zeros(n, dtype=bool)
+
+        if movers.size:
+            targets = cells[movers]
+            self.occupant[current] = self.robot_ids
+            blocker = self.occupant[targets]
+            self.occupant[current] = -1
+            np.minimum.at(self.claim, targets, movers)
+            winner = self.claim[targets] == movers
+            self.claim[targets] = n
+
+            moved[movers[winner & (blocker < 0)]] = True
+            followers = winner & (blocker >= 0)
+            chained, ahead = movers[followers], blocker[followers]
+            while chained.size:
+                follow = moved[ahead]
+                if not follow.any():
+                    break
+                moved[chained[follow]] = True
+                chained, ahead = chained[~follow], ahead[~follow]
 
-            # Drop action.
-            elif pkg_act == '2':
-                if robot.carrying != 0:
-                    package_id = robot.carrying
-                    target = self.packages[package_id - 1].target
-                    # Check if the robot is at the target position.
-                    if robot.position == target:
-                        # Update package status to delivered.
-                        pkg = self.packages[package_id - 1]
-                        pkg.status = 'delivered'
-                        # Apply reward based on whether the delivery is on time.
-                        if self.t <= pkg.deadline:
-                            r += self.delivery_reward
-                        else:
-                            # Example: a reduced reward for late delivery.
-                            r += self.delay_reward
-                        robot.carrying = 0  
-        
-        # Increment the simulation timestep.
-        self.t += 1
+        r = 0
+        moved_ids = moved.nonzero()[0]
+        current[moved_ids] = cells[moved_ids]
+        for i, cell in zip(moved_ids.tolist(), cells[moved_ids].tolist()):
+            # Costs are added one at a time, so the reward is bit-identical to the reference
+            r += self.move_cost
+            position = divmod(cell, self.n_cols)
+            if self.features is not None:
+                self.features.move_robot(self.robots[i].position, position)
+            self.robots[i].position = position
+
+        counts = None
+        if self.metrics is not None:
+            attempts = codes != 0
+            counts = (int(attempts.sum()), int((attempts & ~static & ~moved).sum()), int((attempts & static).sum()))
+        return r, moved, counts
+
+    def step_macro(self, plans):
+        """
+        Executes multi-step plans internally, calling back to the agent only on events.
+        Each plan is consumed one (move_action, package_action) tuple per time step
+        through step(), so the dynamics are exactly those of step(). Execution stops
+        as soon as a robot finishes its plan, a robot is blocked (its move did not
+        change its position), new packages are released, cells were blocked or
+        unblocked (set_cell_blocked) or the episode ends.
+        :param plans: A list with one entry per robot: a list of (move_action, package_action)
+            tuples to execute in order, or None to keep executing the robot's current plan.
+            Robots without a plan stay in place.
+        :return: The state at the event, the reward accumulated since the call, done and infos.
+            infos['replan'] lists the robots whose plan finished or was blocked.
+        """
+        if len(plans) != len(self.robots):
+            raise ValueError("The number of plans must match the number of robots.")
+        for i, plan in enumerate(plans):
+            if plan is not None:
+                self.macro_plans[i] = deque(plan)
+
+        total_r = 0
+        changes = []
+        while True:
+            active = [len(plan) > 0 for plan in self.macro_plans]
+            actions = [plan.popleft() if plan else ('S', '0') for plan in self.macro_plans]
+            old_positions = [robot.position for robot in self.robots]
+            state, r, done, infos = self.step(actions)
+            total_r += r
+            changes += state.get('blocked_changes', [])
+
+            replan = []
+            for i, robot in enumerate(self.robots):
+                if not active[i]:
+                    continue
+                if actions[i][0] != 'S' and robot.position == old_positions[i]:
+                    # Blocked by a wall or another robot, the rest of the plan is stale
+                    self.macro_plans[i].clear()
+                    replan.append(i)
+                elif not self.macro_plans[i]:
+                    replan.append(i)
+
+            if done or replan or state['packages'] or changes:
+                if changes:
+                    state['blocked_changes'] = changes
+                infos['replan'] = replan
+                return state, total_r, done, infos
+
+    def is_idle(self, actions):
+        """
+        Checks whether stepping with the given actions can only advance the clock.
+        This is the case when every action is ('S', '0'), no robot is carrying a
+        package and no released package is waiting to be picked up.
+        :param actions: The actions of step(), an array or a list of tuples.
+        :return: True if nothing but the time step would change.
+        """
+        moves, pkg_acts = split_actions(actions, len(self.robots))
+        if any(pkg_acts) or any(move != 'S' for move in moves):
+            return False
+        for robot in self.robots:
+            if robot.carrying != 0:
+                return False
+        for p in self.packages:
+            if p.status == 'waiting':
+                return False
+        return True
 
-        self.total_reward += r
+    def next_release_time(self):
+        """
+        Returns the next time step (strictly after the current one) at which a
+        package is released, or None if no more packages will be released.
+        """
+        if self.stream is not None:
+            return self.stream.next_time
+        i = bisect.bisect_right(self.release_times, self.t)
+        if i < len(self.release_times):
+            return self.release_times[i]
+        return None
+
+    def fast_forward(self):
+        """
+        Jumps the clock straight to the next package release (or to max_time_steps).
+        Only valid when is_idle() holds for the actions the agents returned: every
+        skipped step would have produced zero reward and an unchanged state, so the
+        result is identical to calling step() repeatedly with those actions.
+        :return: Same tuple as step().
+        """
+        self.reported_changes, self.blocked_changes = self.blocked_changes, []
+        next_t = self.next_release_time()
+        if next_t is None:
+            # Everything has been delivered, so the episode ends on the next step
+            next_t = self.t + 1
+        previous_t = self.t
+        self.t = next_t if self.max_time_steps is None else min(next_t, self.max_time_steps)
+        if self.metrics is not None:
+            # Every robot was idle during the skipped steps
+            self.metrics.on_step(self.t, len(self.robots), 0, 0, 0, 0, 0, steps=self.t - previous_t)
 
         done = False
         infos = {}
+        if self.stream is not None:
+            self.throughput.advance(self.t)
+            infos['throughput'] = self.throughput.rate()
         if self.check_terminate():
             done = True
             infos['total_reward'] = self.total_reward
             infos['total_time_steps'] = self.t
 
-        return self.get_state(), r, done, infos
-    
+        return self.get_state(), 0, done, infos
+
     def check_terminate(self):
         if self.t == self.max_time_steps:
             return True
+        if self.stream is not None:
+            # Packages keep arriving, only the time limit ends the episode
+            return False
         
         for p in self.packages:
             if p.status != 'delivered':
@@ -352,11 +764,19 @@ class Environment:
             return False
         return True
 
+    def close(self):
+        """Releases resources held by the environment (worker processes in subclasses)."""
+        pass
+
     def render(self, save_frame=False):
         """
         Visualizes the environment using matplotlib, including robots, packages, and targets.
         Optionally saves the frame.
         """
+        # Imported here so headless runs never pay the matplotlib startup cost
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import ListedColormap
+        from matplotlib.patches import Patch
         fig, ax = plt.subplots(figsize=(10, 10))
         
         # Define colors for visualization elements
@@ -0,0 +1,96 @@
+"""
+Grid-shaped observation features kept up to date by the environment.
+
+FeaturePlanes holds one float32 array of shape (N_PLANES, n_rows + 2r, n_cols + 2r)
+with the planes below, padded by the view radius r so that every cell has a full
+(2r+1)x(2r+1) neighbourhood (padding counts as obstacle):
+    OBSTACLES  1 on obstacles and blocked cells
+    ROBOTS     1 where a robot stands
+    PACKAGES   number of waiting packages whose start is the cell
+    TARGETS    number of released, undelivered packages whose target is the cell
+    DEADLINES  earliest deadline of the waiting packages starting at the cell, 0 if none
+The environment updates single cells on robot moves, pickups, deliveries, releases
+and blocked cells, so a step costs O(changes) instead of O(n_rows * n_cols + n_packages).
+window() returns the neighbourhood of a cell as a strided view into the planes,
+crops() gathers those of many cells (e.g. all robots) in one indexing operation.
+"""
+import bisect
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+OBSTACLES, ROBOTS, PACKAGES, TARGETS, DEADLINES = range(5)
+N_PLANES = 5
+
+
+class FeaturePlanes:
+
+    def __init__(self, n_rows, n_cols, view_radius=2):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.view_radius = view_radius
+        r = view_radius
+        self.padded = np.zeros((N_PLANES, n_rows + 2 * r, n_cols + 2 * r), dtype=np.float32)
+        # Unpadded view of the planes, indexed by 0-based (row, col)
+        self.planes = self.padded[:, r:r + n_rows, r:r + n_cols]
+        # windows[:, row, col] is the (N_PLANES, 2r+1, 2r+1) neighbourhood of cell (row, col)
+        self.windows = sliding_window_view(self.padded, (2 * r + 1, 2 * r + 1), axis=(1, 2))
+        self.deadlines = {}  # start cell -> sorted deadlines of the waiting packages there
+
+    def reset(self, grid, robot_positions):
+        """
+        :param grid: The map, 1 for obstacles.
+        :param robot_positions: 0-based (row, col) of every robot.
+        """
+        self.padded[:] = 0
+        self.padded[OBSTACLES] = 1
+        self.planes[OBSTACLES] = grid
+        for r, c in robot_positions:
+            self.planes[ROBOTS, r, c] += 1
+        self.deadlines = {}
+
+    def set_blocked(self, position, blocked):
+        self.planes[OBSTACLES][position] = 1 if blocked else 0
+
+    def move_robot(self, old, new):
+        self.planes[ROBOTS][old] -= 1
+        self.planes[ROBOTS][new] += 1
+
+    def release(self, pkg):
+        self.planes[PACKAGES][pkg.start] += 1
+        self.planes[TARGETS][pkg.target] += 1
+        deadlines = self.deadlines.setdefault(pkg.start, [])
+        bisect.insort(deadlines, pkg.deadline)
+        self.planes[DEADLINES][pkg.start] = deadlines[0]
+
+    def pickup(self, pkg):
+        self.planes[PACKAGES][pkg.start] -= 1
+        deadlines = self.deadlines[pkg.start]
+        deadlines.pop(bisect.bisect_left(deadlines, pkg.deadline))
+        if deadlines:
+            self.planes[DEADLINES][pkg.start] = deadlines[0]
+        else:
+            del self.deadlines[pkg.start]
+            self.planes[DEADLINES][pkg.start] = 0
+
+    def deliver(self, pkg):
+        self.planes[TARGETS][pkg.target] -= 1
+
+    def window(self, row, col):
+        """Neighbourhood of a 0-based cell, a (N_PLANES, 2r+1, 2r+1) view sharing memory with the planes."""
+        return self.windows[:, row, col]
+
+    def crops(self, rows, cols, t=None):
+        """
+        Neighbourhoods of many cells at once.
+        :param rows: 0-based rows of the cells, e.g. of every robot.
+        :param cols: 0-based columns of the cells.
+        :param t: If given, the DEADLINES plane of the crops holds the deadline slack at
+            time t (deadline - t) instead of the deadline, 0 where no package waits.
+        :return: float32 array of shape (len(rows), N_PLANES, 2r+1, 2r+1).
+        """
+        crops = self.windows[:, rows, cols].transpose(1, 0, 2, 3)
+        if t is not None:
+            crops = np.ascontiguousarray(crops)
+            waiting = crops[:, PACKAGES] > 0
+            crops[:, DEADLINES] = np.where(waiting, crops[:, DEADLINES] - t, 0)
+        return crops
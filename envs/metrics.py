@@ -0,0 +1,180 @@
+"""
+Streaming metrics for long simulations. Every update is O(1) (amortized over
+skipped time steps) and memory does not depend on the episode length.
+"""
+import numpy as np
+
+
+class RollingWindow:
+
+    def __init__(self, window=1000):
+        """
+        Sum of per-step counts over the last `window` completed time steps, kept in a ring
+        buffer with one extra slot for the step in progress.
+        :param window: Number of time steps in the window.
+        """
+        self.window = window
+        self.counts = np.zeros(window + 1, dtype=np.int64)
+        self.total = 0      # Sum over the window and the current step
+        self.t = 0          # Current time step
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.t = 0
+
+    def advance(self, t):
+        """Moves the current step to t, zeroing the steps that left the window."""
+        if t <= self.t:
+            return
+        size = len(self.counts)
+        if t - self.t >= size:
+            self.counts[:] = 0
+            self.total = 0
+        else:
+            for s in range(self.t + 1, t + 1):
+                slot = s % size
+                self.total -= self.counts[slot]
+                self.counts[slot] = 0
+        self.t = t
+
+    def add(self, t, count=1):
+        self.advance(t)
+        self.counts[t % len(self.counts)] += count
+        self.total += count
+
+    def rate(self, per=100):
+        """Mean count per `per` time steps over the window (or the steps completed so far)."""
+        steps = min(self.t, self.window)
+        if steps == 0:
+            return 0.0
+        return (self.total - self.counts[self.t % len(self.counts)]) * per / steps
+
+
+class Histogram:
+
+    def __init__(self, bin_width=1, n_bins=1000):
+        """
+        Fixed-bin histogram of non-negative values, the last bin collects everything above range.
+        Percentiles are exact to within bin_width for values inside the range.
+        """
+        self.bin_width = bin_width
+        self.bins = np.zeros(n_bins + 1, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.bins[:] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def add(self, value):
+        i = int(value // self.bin_width)
+        self.bins[min(max(i, 0), len(self.bins) - 1)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def percentile(self, q):
+        """Lower edge of the bin holding the q-th percentile (0 <= q <= 100), None if empty."""
+        if not self.count:
+            return None
+        rank = max(1, int(np.ceil(q / 100 * self.count)))
+        i = int(np.searchsorted(np.cumsum(self.bins), rank))
+        if i == len(self.bins) - 1:
+            return self.max
+        return i * self.bin_width
+
+    def summary(self, percentiles=(50, 90, 99)):
+        result = {'count': self.count, 'mean': self.mean(), 'max': self.max}
+        for q in percentiles:
+            result[f'p{q}'] = self.percentile(q)
+        return result
+
+
+class MetricsCollector:
+
+    def __init__(self, window=1000, max_latency=1000):
+        """
+        Operational KPIs of an episode, fed by the Environment through O(1) hooks.
+        Pass one to Environment(metrics=...) and read summary() at any time.
+        :param window: Number of time steps of the rolling throughput window.
+        :param max_latency: Upper bound (in steps) of the wait and lead time histograms.
+        """
+        self.deliveries = RollingWindow(window)
+        self.wait_time = Histogram(n_bins=max_latency)      # Release to pickup
+        self.lead_time = Histogram(n_bins=max_latency)      # Release to delivery
+        self.transit_time = Histogram(n_bins=max_latency)   # Pickup to delivery
+        self.reset()
+
+    def reset(self):
+        self.deliveries.reset()
+        self.wait_time.reset()
+        self.lead_time.reset()
+        self.transit_time.reset()
+        self.pickup_times = {}  # package_id -> pickup time of the packages in transit
+        self.n_delivered = 0
+        self.n_on_time = 0
+        self.steps = 0
+        self.robot_steps = 0
+        self.carrying_steps = 0  # Robot steps spent carrying a package
+        self.moving_steps = 0    # Robot steps spent moving without a package
+        self.idle_steps = 0
+        self.move_attempts = 0
+        self.blocked_moves = 0   # Moves onto a free cell refused by the collision resolver
+        self.invalid_moves = 0   # Moves into a wall or off the map
+
+    def on_pickup(self, pkg, t):
+        self.wait_time.add(t - pkg.start_time)
+        self.pickup_times[pkg.package_id] = t
+
+    def on_delivery(self, pkg, t):
+        self.n_delivered += 1
+        self.n_on_time += t <= pkg.deadline
+        self.deliveries.add(t)
+        self.lead_time.add(t - pkg.start_time)
+        pickup_t = self.pickup_times.pop(pkg.package_id, None)
+        if pickup_t is not None:
+            self.transit_time.add(t - pickup_t)
+
+    def on_step(self, t, n_robots, n_carrying, n_moving, n_attempts, n_blocked, n_invalid, steps=1):
+        """
+        Records the `steps` time steps ending at time t, all with the same robot activity.
+        :param n_carrying: Robots carrying a package after the step.
+        :param n_moving: Robots that moved without carrying a package.
+        """
+        self.deliveries.advance(t)
+        self.steps += steps
+        self.robot_steps += n_robots * steps
+        self.carrying_steps += n_carrying * steps
+        self.moving_steps += n_moving * steps
+        self.idle_steps += (n_robots - n_carrying - n_moving) * steps
+        self.move_attempts += n_attempts
+        self.blocked_moves += n_blocked
+        self.invalid_moves += n_invalid
+
+    def summary(self):
+        robot_steps = max(self.robot_steps, 1)
+        return {
+            'steps': self.steps,
+            'delivered': self.n_delivered,
+            'deliveries_per_100_steps': self.n_delivered * 100 / max(self.steps, 1),
+            'rolling_deliveries_per_100_steps': self.deliveries.rate(),
+            'on_time_ratio': self.n_on_time / self.n_delivered if self.n_delivered else None,
+            'wait_time': self.wait_time.summary(),
+            'lead_time': self.lead_time.summary(),
+            'transit_time': self.transit_time.summary(),
+            'utilization': {
+                'carrying': self.carrying_steps / robot_steps,
+                'moving': self.moving_steps / robot_steps,
+                'idle': self.idle_steps / robot_steps,
+            },
+            'move_attempts': self.move_attempts,
+            'blocked_moves': self.blocked_moves,
+            'blocked_ratio': self.blocked_moves / self.move_attempts if self.move_attempts else None,
+            'invalid_moves': self.invalid_moves,
+        }
@@ -0,0 +1,552 @@
+"""
+Zone-partitioned simulation for very large fleets.
+
+PartitionedEnvironment splits the map into vertical strips (zones) holding about the
+same number of free cells, each simulated by a Zone in its own worker process. The
+zones own the robots (positions and loads) and the waiting packages of their cells;
+the coordinator keeps what agents and main.py see that is not per robot (package
+statuses, rewards, metrics) and a robot array refreshed from the robots each zone
+reports as changed. The dynamics are exactly those of Environment.step.
+
+A step is one round trip between the coordinator and the zones: every zone gets the
+action array of all robots and returns its result. Moves across zone borders are
+settled by the zones themselves, over pipes between neighbouring zones (a move
+changes the column by at most one, so only neighbours share cells):
+  1. claims: each zone computes the targets of its robots and sends the moves into a
+     neighbour's cells to that neighbour, with the robot's load.
+  2. resolve: the zone owning a cell settles it: the lowest robot index among the
+     robots moving into it wins, and wins the cell if it is empty or once its
+     occupant has moved away (the occupant always belongs to the same zone).
+  3. decisions (repeated while any zone has some to send): decisions about robots of
+     a neighbour are sent back to it, which may settle the robots following them.
+     Whether any zone sent decisions is shared through a barrier, so every zone runs
+     the same number of rounds.
+  4. finish: robots still waiting on each other (cycles) stay, robots that crossed a
+     border join the zone they moved into, and package actions are applied.
+Pickup and delivery events come back to the coordinator, which adds rewards and
+feeds metrics in robot order, so even the float sums match the single process env.
+"""
+import bisect
+import multiprocessing
+import traceback
+from collections import deque
+
+import numpy as np
+
+from envs.actions import MOVE_DELTAS, PICKUP, DROP, as_action_array
+from envs.env import Environment
+
+# (row, col) offset of each move code as plain ints
+DELTAS = [tuple(delta) for delta in MOVE_DELTAS.tolist()]
+
+
+def zone_bounds(grid, n_zones):
+    """First column of each zone plus the number of columns, splitting the free cells evenly."""
+    n_cols = len(grid[0])
+    if not 1 <= n_zones <= n_cols:
+        raise ValueError("n_zones must be between 1 and the number of map columns.")
+    free = [sum(row[c] == 0 for row in grid) for c in range(n_cols)]
+    total = sum(free)
+    bounds = [0]
+    count = 0
+    for c in range(n_cols - 1):
+        count += free[c]
+        # Cut once this strip holds its share, leaving at least one column per remaining zone
+        k = len(bounds)
+        if k < n_zones and count >= total * k / n_zones and n_cols - (c + 1) >= n_zones - k:
+            bounds.append(c + 1)
+    while len(bounds) < n_zones:
+        bounds.append(bounds[-1] + 1)
+    return bounds + [n_cols]
+
+
+class Zone:
+
+    def __init__(self, grid, bounds, index):
+        """
+        :param grid: The whole map (moves near the border look at the neighbouring zone's cells).
+        :param bounds: Zone column bounds from zone_bounds.
+        :param index: Index of this zone.
+        """
+        self.grid = grid
+        self.n_rows = len(grid)
+        self.n_cols = len(grid[0])
+        self.bounds = bounds
+        self.index = index
+        self.blocked = set()  # cells blocked at runtime, freed again on reset
+
+    def owner(self, cell):
+        return bisect.bisect_right(self.bounds, cell[1]) - 1
+
+    def reset(self, robots, packages, table):
+        """
+        :param robots: (robot index, position, carrying) of the robots in the zone.
+        :param packages: Ids of the packages starting in the zone, in increasing order.
+        :param table: package id -> (start, start_time, target) for every package.
+        """
+        for r, c in self.blocked:
+            self.grid[r][c] = 0
+        self.blocked = set()
+        self.robots = {i: [pos, carrying] for i, pos, carrying in robots}
+        self.occupant = {pos: i for i, pos, carrying in robots}
+        self.table = table
+        # Packages waiting at each cell, smallest id (hence earliest start_time) first
+        self.waiting = {}
+        for package_id in packages:
+            self.waiting.setdefault(table[package_id][0], deque()).append(package_id)
+
+    def set_blocked(self, position, blocked):
+        """Mirrors Environment.set_cell_blocked; every zone keeps the whole map, as moves look across borders."""
+        r, c = position
+        self.grid[r][c] = 1 if blocked else 0
+        if blocked:
+            self.blocked.add(position)
+        else:
+            self.blocked.discard(position)
+
+    def robot_ids(self):
+        return np.fromiter(self.robots, dtype=np.int64, count=len(self.robots))
+
+    def step(self, t, actions, count_carrying=False):
+        """
+        Simulates one step of the robots of the zone. This is a generator: it yields
+        ('exchange', messages), messages being a dict from neighbouring zone index to a
+        list, and is sent the dict of the lists those zones sent it, or ('any', flag)
+        and is sent whether the flag of any zone is set. ZoneLink.run drives it in a
+        zone worker, run_zone_steps drives the zones of one process together.
+        :param actions: The int8 action array of all robots.
+        :return: The result of finish().
+        """
+        claims = yield 'exchange', self.begin_step(actions)
+        outbound = self.resolve(claims)
+        while (yield 'any', any(outbound.values())):
+            outbound = self.update((yield 'exchange', outbound))
+        return self.finish(t, actions, count_carrying)
+
+    def begin_step(self, actions):
+        """
+        :param actions: The int8 action array of all robots.
+        :return: Neighbouring zone index -> (robot index, target, carrying) of the moves into its cells.
+        """
+        self.targets = {}
+        self.claims = {}
+        self.status = {}
+        self.dependents = {}
+        self.outbound = {}
+        self.sender = {}
+        self.arriving = {}
+        self.arrivals = []
+        self.n_attempts = self.n_invalid = 0
+        foreign = {}
+        ids = self.robot_ids()
+        codes = actions[ids, 0]
+        moving = codes.nonzero()[0]
+        for i, move in zip(ids[moving].tolist(), codes[moving].tolist()):
+            self.n_attempts += 1
+            r, c = self.robots[i][0]
+            dr, dc = DELTAS[move]
+            target = (r + dr, c + dc)
+            if not (0 <= target[0] < self.n_rows and 0 <= target[1] < self.n_cols) or self.grid[target[0]][target[1]] == 1:
+                self.n_invalid += 1
+                continue
+            self.targets[i] = target
+            zone = self.owner(target)
+            if zone == self.index:
+                self.claims.setdefault(target, []).append(i)
+            else:
+                foreign.setdefault(zone, []).append((i, target, self.robots[i][1]))
+        return foreign
+
+    def resolve(self, incoming):
+        """
+        Settles the moves into the cells of the zone.
+        :param incoming: Neighbouring zone index -> (robot index, target, carrying) of its moves into this zone.
+        :return: Neighbouring zone index -> (robot index, moved) of the decisions about its robots.
+        """
+        for zone, claims in incoming.items():
+            for i, target, carrying in claims:
+                self.claims.setdefault(target, []).append(i)
+                self.sender[i] = zone
+                self.arriving[i] = (target, carrying)
+        decided = []
+        for cell, robots in self.claims.items():
+            winner = min(robots)
+            blocker = self.occupant.get(cell)
+            for i in robots:
+                if i != winner:
+                    decided.append((i, False))
+                elif blocker is None:
+                    decided.append((i, True))
+                else:
+                    # Only the winner waits on the occupant, so there is one dependent per robot
+                    self.dependents[blocker] = i
+        for i in self.robots:
+            if i not in self.targets:
+                decided.append((i, False))
+        for i, moved in decided:
+            self.decide(i, moved)
+        return self.take_outbound()
+
+    def update(self, decisions):
+        """Applies the decisions neighbouring zones took about robots of this zone."""
+        for zone_decisions in decisions.values():
+            for i, moved in zone_decisions:
+                self.decide(i, moved)
+        return self.take_outbound()
+
+    def decide(self, i, moved):
+        # The robot following i into its cell moves exactly when i does
+        while i is not None:
+            if i in self.robots:
+                self.status[i] = moved
+                i = self.dependents.pop(i, None)
+            else:
+                self.outbound.setdefault(self.sender[i], []).append((i, moved))
+                if moved:
+                    self.arrivals.append(i)
+                i = None
+
+    def take_outbound(self):
+        outbound, self.outbound = self.outbound, {}
+        return outbound
+
+    def finish(self, t, actions, count_carrying=False):
+        """
+        Moves the robots and applies package actions.
+        :param actions: The int8 action array of all robots.
+        :return: Dict with the moved robot count, the move counts for metrics, the pickup
+            and delivery events (robot index, package action code, package id) and, as
+            an int32 array of (robot index, row, col, carrying) rows, the robots whose
+            position or load changed; robots that crossed a border are reported by the
+            zone they moved into.
+        """
+        moved = [i for i in self.targets if self.status.get(i, False)]
+        for i in moved:
+            del self.occupant[self.robots[i][0]]
+        moved_here = []
+        for i in moved:
+            target = self.targets[i]
+            if self.owner(target) == self.index:
+                self.robots[i][0] = target
+                self.occupant[target] = i
+                moved_here.append(i)
+            else:
+                del self.robots[i]
+        for i in self.arrivals:
+            target, carrying = self.arriving[i]
+            self.robots[i] = [target, carrying]
+            self.occupant[target] = i
+            moved_here.append(i)
+        changed = set(moved_here)
+
+        events = []
+        ids = self.robot_ids()
+        pkg_acts = actions[ids, 1]
+        acting = pkg_acts.nonzero()[0]
+        for i, pkg_act in zip(ids[acting].tolist(), pkg_acts[acting].tolist()):
+            robot = self.robots[i]
+            pos, carrying = robot
+            if pkg_act == PICKUP and carrying == 0:
+                queue = self.waiting.get(pos)
+                if queue and self.table[queue[0]][1] <= t:
+                    robot[1] = queue.popleft()
+                    events.append((i, pkg_act, robot[1]))
+                    changed.add(i)
+            elif pkg_act == DROP and carrying != 0 and pos == self.table[carrying][2]:
+                robot[1] = 0
+                events.append((i, pkg_act, carrying))
+                changed.add(i)
+
+        rows = [(i, self.robots[i][0][0], self.robots[i][0][1], self.robots[i][1]) for i in changed]
+        result = {
+            'n_moved': len(moved),
+            'n_attempts': self.n_attempts,
+            'n_blocked': len(self.targets) - len(moved),
+            'n_invalid': self.n_invalid,
+            'events': events,
+            'changed': np.array(rows, dtype=np.int32).reshape(-1, 4),
+        }
+        if count_carrying:
+            result['n_carrying'] = sum(robot[1] != 0 for robot in self.robots.values())
+            result['n_moving'] = sum(self.robots[i][1] == 0 for i in moved_here)
+        return result
+
+
+def run_zone_steps(steps, n_zones):
+    """Runs the Zone.step generators of all zones in this process in lockstep, routing their messages."""
+    requests = [next(step) for step in steps]
+    while True:
+        if requests[0][0] == 'exchange':
+            replies = [{j: requests[j][1].get(k, []) for j in (k - 1, k + 1) if 0 <= j < n_zones}
+                       for k in range(n_zones)]
+        else:
+            replies = [any(flag for _, flag in requests)] * n_zones
+        results = []
+        for k, (step, reply) in enumerate(zip(steps, replies)):
+            try:
+                requests[k] = step.send(reply)
+            except StopIteration as stop:
+                # Zones run the same rounds, so they all return in the same round
+                results.append(stop.value)
+        if results:
+            return results
+
+
+class ZoneLink:
+
+    def __init__(self, index, peers, barrier, flags):
+        """
+        Connections of a zone worker to the other zones.
+        :param peers: Neighbouring zone index -> Connection.
+        :param barrier: multiprocessing.Barrier shared by all zones.
+        :param flags: Shared array of 2 * n_zones flags, one slot per zone for even and odd rounds.
+        """
+        self.index = index
+        self.peers = peers
+        self.barrier = barrier
+        self.flags = flags
+        self.n_zones = len(flags) // 2
+        self.round = 0
+
+    def exchange(self, messages):
+        # Send right before receiving from the left, so that even messages larger than
+        # the pipe buffer cannot leave two neighbours blocked in send
+        left, right = self.peers.get(self.index - 1), self.peers.get(self.index + 1)
+        received = {}
+        if right is not None:
+            right.send(messages.get(self.index + 1, []))
+        if left is not None:
+            received[self.index - 1] = left.recv()
+            left.send(messages.get(self.index - 1, []))
+        if right is not None:
+            received[self.index + 1] = right.recv()
+        return received
+
+    def any(self, flag):
+        # Rounds alternate between two slots: a zone can only write the slot of round
+        # r + 2 after every zone passed the barrier of round r + 1, hence read round r
+        offset = self.round % 2 * self.n_zones
+        self.round += 1
+        self.flags[offset + self.index] = bool(flag)
+        self.barrier.wait()
+        return any(self.flags[offset:offset + self.n_zones])
+
+    def run(self, step):
+        """Runs a Zone.step generator against the other zone workers; returns its result."""
+        request = next(step)
+        while True:
+            kind, payload = request
+            reply = self.exchange(payload) if kind == 'exchange' else self.any(payload)
+            try:
+                request = step.send(reply)
+            except StopIteration as stop:
+                return stop.value
+
+    def abort(self):
+        """Releases the other zones after a failure: they fail at the barrier or on a closed pipe."""
+        self.barrier.abort()
+        for conn in self.peers.values():
+            conn.close()
+        self.peers = {}
+
+
+def zone_worker(conn, zone, link):
+    """Serves method calls on zone until 'close' is received; steps are run through link."""
+    while True:
+        method, args = conn.recv()
+        if method == 'close':
+            break
+        try:
+            result = getattr(zone, method)(*args)
+            if method == 'step':
+                result = link.run(result)
+            conn.send((True, result))
+        except Exception:
+            if method == 'step':
+                link.abort()
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+class PartitionedEnvironment(Environment):
+
+    def __init__(self, map_file, max_time_steps=100, n_robots=5, n_packages=20, n_zones=2, processes=True, **kwargs):
+        """
+        Environment whose robots are simulated by n_zones zone workers. Takes the Environment
+        arguments, except that only batch arrivals are supported (arrival_mode='stream'
+        raises a ValueError). Runtime blocked cells (set_cell_blocked) are forwarded to the zones.
+        :param n_zones: Number of vertical strips the map is split into.
+        :param processes: Run each zone in its own process; False runs them in this process
+            (same results, useful for debugging).
+        """
+        if kwargs.get('arrival_mode', 'batch') != 'batch':
+            raise ValueError("PartitionedEnvironment only supports batch arrivals.")
+        self.n_zones = n_zones
+        self.processes = processes
+        self.zones = None
+        # Robot objects of the base env; after a step they are brought up to date from
+        # robot_array only when read (see robots), the state is built from the array
+        self._robots = []
+        self.robots_stale = False
+        super().__init__(map_file, max_time_steps, n_robots, n_packages, **kwargs)
+
+    @property
+    def robots(self):
+        if self.robots_stale:
+            for robot, (r, c, carrying) in zip(self._robots, self.robot_array.tolist()):
+                robot.position = (r, c)
+                robot.carrying = carrying
+            self.robots_stale = False
+        return self._robots
+
+    @robots.setter
+    def robots(self, robots):
+        self._robots = robots
+        self.robots_stale = False
+
+    def start_zones(self):
+        self.bounds = zone_bounds(self.grid, self.n_zones)
+        zones = [Zone(self.grid, self.bounds, k) for k in range(self.n_zones)]
+        if not self.processes:
+            self.zones = zones
+            return
+        # Neighbouring zones settle border moves over their own pipes
+        peers = [{} for _ in range(self.n_zones)]
+        for k in range(self.n_zones - 1):
+            peers[k][k + 1], peers[k + 1][k] = multiprocessing.Pipe()
+        barrier = multiprocessing.Barrier(self.n_zones)
+        flags = multiprocessing.Array('b', 2 * self.n_zones, lock=False)
+        self.zones = []
+        self.workers = []
+        for k, zone in enumerate(zones):
+            parent, child = multiprocessing.Pipe()
+            link = ZoneLink(k, peers[k], barrier, flags)
+            worker = multiprocessing.Process(target=zone_worker, args=(child, zone, link), daemon=True)
+            worker.start()
+            child.close()
+            self.zones.append(parent)
+            self.workers.append(worker)
+        for zone_peers in peers:
+            for conn in zone_peers.values():
+                conn.close()
+
+    def call(self, method, args):
+        """Calls method on every zone with that zone's arguments, in parallel when zones are processes."""
+        if not self.processes:
+            results = [getattr(zone, method)(*a) for zone, a in zip(self.zones, args)]
+            return run_zone_steps(results, self.n_zones) if method == 'step' else results
+        for conn, a in zip(self.zones, args):
+            conn.send((method, a))
+        results = []
+        failures = []
+        for k, conn in enumerate(self.zones):
+            ok, value = conn.recv()
+            if not ok:
+                failures.append(f"Zone {k} failed in {method}:\n{value}")
+            results.append(value)
+        if failures:
+            raise RuntimeError('\n'.join(failures))
+        return results
+
+    def owner(self, cell):
+        return bisect.bisect_right(self.bounds, cell[1]) - 1
+
+    def reset(self, episode=None):
+        state = super().reset(episode)
+        if self.zones is None:
+            self.start_zones()
+        self.robot_array = np.array([(*robot.position, robot.carrying) for robot in self.robots],
+                                    dtype=np.int32).reshape(-1, 3)
+        robots = [[] for _ in range(self.n_zones)]
+        for i, robot in enumerate(self.robots):
+            robots[self.owner(robot.position)].append((i, robot.position, robot.carrying))
+        packages = [[] for _ in range(self.n_zones)]
+        for pkg in self.packages:
+            packages[self.owner(pkg.start)].append(pkg.package_id)
+        table = {pkg.package_id: (pkg.start, pkg.start_time, pkg.target) for pkg in self.packages}
+        self.call('reset', [(robots[k], packages[k], table) for k in range(self.n_zones)])
+        return state
+
+    def set_cell_blocked(self, position, blocked=True):
+        super().set_cell_blocked(position, blocked)
+        if self.zones is not None:
+            self.call('set_blocked', [(tuple(position), blocked)] * self.n_zones)
+
+    def robot_states(self):
+        if not self.robots_stale:
+            return super().robot_states()
+        rows, cols, carrying = (self.robot_array + (1, 1, 0)).T.tolist()
+        return list(zip(rows, cols, carrying))
+
+    def check_terminate(self):
+        # Batch arrivals only, so the episode ends once every package is delivered
+        return self.t == self.max_time_steps or self.n_delivered == len(self.packages)
+
+    def step(self, actions):
+        """Same as Environment.step, with the robots simulated by the zones in one round trip."""
+        actions = as_action_array(actions, self.n_robots)
+        self.reported_changes, self.blocked_changes = self.blocked_changes, []
+        count_carrying = self.metrics is not None
+        results = self.call('step', [(self.t, actions, count_carrying)] * self.n_zones)
+
+        r = 0
+        for _ in range(sum(result['n_moved'] for result in results)):
+            r += self.move_cost
+        changed = np.concatenate([result['changed'] for result in results])
+        if self.features is not None:
+            for i, row, col, carrying in changed.tolist():
+                old = tuple(self.robot_array[i, :2].tolist())
+                if old != (row, col):
+                    self.features.move_robot(old, (row, col))
+        self.robot_array[changed[:, 0]] = changed[:, 1:]
+        self.robots_stale = True
+        # In robot order, as Environment.step processes package actions
+        for i, pkg_act, package_id in sorted(event for result in results for event in result['events']):
+            pkg = self.package_index[package_id]
+            if pkg_act == PICKUP:
+                pkg.status = 'in_transit'
+                if self.metrics is not None:
+                    self.metrics.on_pickup(pkg, self.t)
+                if self.features is not None:
+                    self.features.pickup(pkg)
+                continue
+            pkg.status = 'delivered'
+            self.n_delivered += 1
+            self.throughput.add(self.t)
+            if self.metrics is not None:
+                self.metrics.on_delivery(pkg, self.t)
+            if self.features is not None:
+                self.features.deliver(pkg)
+            if self.t <= pkg.deadline:
+                r += self.delivery_reward
+            else:
+                r += self.delay_reward
+
+        self.t += 1
+        self.total_reward += r
+
+        done = False
+        infos = {}
+        if self.metrics is not None:
+            counts = [sum(result[key] for result in results)
+                      for key in ('n_carrying', 'n_moving', 'n_attempts', 'n_blocked', 'n_invalid')]
+            self.metrics.on_step(self.t, self.n_robots, *counts)
+        if self.check_terminate():
+            done = True
+            infos['total_reward'] = self.total_reward
+            infos['total_time_steps'] = self.t
+
+        return self.get_state(), r, done, infos
+
+    def is_idle(self, actions):
+        if self.robot_array[:, 2].any():
+            return False
+        return super().is_idle(actions)
+
+    def close(self):
+        """Stops the zone worker processes."""
+        if self.zones is not None and self.processes:
+            for conn, worker in zip(self.zones, self.workers):
+                conn.send(('close', ()))
+                worker.join()
+        self.zones = None
@@ -0,0 +1,136 @@
+"""
+Simulator side of the agent server protocol (see agents/agent_server.py).
+
+RemoteAgentClient multiplexes many episodes over one Unix socket connection and
+RemoteAgents stands in for a local agent object inside each episode, so several
+Environment instances can be driven concurrently against one agent server.
+"""
+import asyncio
+import itertools
+
+from utils.protocol import (MSG_INIT, MSG_STEP, MSG_ACTIONS, MSG_CLOSE, MSG_ERROR,
+                            pack_frame, read_frame, encode_map, encode_state, decode_actions)
+
+
+class RemoteAgentClient:
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.pending = {}  # episode id -> future waiting for actions
+        self.episode_ids = itertools.count(1)
+        self.read_task = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.read_task = asyncio.create_task(self._read_loop())
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+        if self.read_task is not None:
+            self.read_task.cancel()
+
+    def new_agents(self):
+        """Returns a RemoteAgents bound to a fresh episode id on this connection."""
+        return RemoteAgents(self, next(self.episode_ids))
+
+    async def _read_loop(self):
+        while True:
+            frame = await read_frame(self.reader)
+            if frame is None:
+                break
+            msg_type, episode_id, payload = frame
+            future = self.pending.pop(episode_id, None)
+            if future is None or future.done():
+                continue
+            if msg_type == MSG_ACTIONS:
+                future.set_result(decode_actions(payload))
+            elif msg_type == MSG_ERROR:
+                future.set_exception(RuntimeError(payload.decode()))
+
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Agent server closed the connection"))
+        self.pending.clear()
+
+    async def request(self, episode_id, payload):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[episode_id] = future
+        self.writer.write(pack_frame(MSG_STEP, episode_id, payload))
+        await self.writer.drain()
+        return await future
+
+    async def send(self, msg_type, episode_id, payload=b''):
+        self.writer.write(pack_frame(msg_type, episode_id, payload))
+        await self.writer.drain()
+
+
+class RemoteAgents:
+    """Async counterpart of the agent interface, backed by an agent server."""
+
+    def __init__(self, client, episode_id):
+        self.client = client
+        self.episode_id = episode_id
+        self.robots = None  # Robots of the last state sent, the base of the next delta
+
+    async def init_agents(self, state):
+        payload = encode_map(state['map']) + encode_state(state)
+        self.robots = state['robots']
+        await self.client.send(MSG_INIT, self.episode_id, payload)
+
+    async def get_actions(self, state):
+        payload = encode_state(state, self.robots)
+        self.robots = state['robots']
+        return await self.client.request(self.episode_id, payload)
+
+    async def close(self):
+        await self.client.send(MSG_CLOSE, self.episode_id)
+
+
+async def run_episode(env, agents):
+    """Runs one episode of env against remote agents, returns the final infos."""
+    state = env.reset()
+    await agents.init_agents(state)
+    done = False
+    infos = {}
+    while not done:
+        actions = await agents.get_actions(state)
+        state, reward, done, infos = env.step(actions)
+    await agents.close()
+    return infos
+
+
+async def run_episodes(path, envs):
+    """Drives all environments concurrently over one connection to the agent server at path."""
+    client = await RemoteAgentClient(path).connect()
+    try:
+        return await asyncio.gather(*[run_episode(env, client.new_agents()) for env in envs])
+    finally:
+        await client.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    from envs.env import Environment
+
+    parser = argparse.ArgumentParser(description='Run episodes against an agent server')
+    parser.add_argument('--socket', type=str, default='/tmp/marl-delivery-agent.sock', help='Socket path')
+    parser.add_argument('--map', type=str, default='maps/map2.txt', help='Path to map file')
+    parser.add_argument('--num_agents', type=int, default=5, help='Number of agents')
+    parser.add_argument('--n_packages', type=int, default=100, help='Number of packages')
+    parser.add_argument('--max_time_steps', type=int, default=1000, help='Maximum number of steps')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[2025, 10, 42, 3407, 11711], help='One episode per seed')
+    args = parser.parse_args()
+
+    envs = [Environment(args.map, args.max_time_steps, args.num_agents, args.n_packages, seed=seed)
+            for seed in args.seeds]
+    start = time.time()
+    results = asyncio.run(run_episodes(args.socket, envs))
+    for seed, infos in zip(args.seeds, results):
+        print(f"Seed {seed}: total reward {infos['total_reward']:.2f}, time steps {infos['total_time_steps']}")
+    print(f"Elapsed: {time.time() - start:.2f}s")
@@ -1,72 +1,362 @@
 from envs.env import Environment
-from agents.greedy_agent import GreedyAgents
-from agents.greedy_agent_optimal import GreedyAgentsOptimal
-# from agents.ppo_agent import PPO
 
-import numpy as np
-# import argparse
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import os
+import time
 
-def main():
-    # parser = argparse.ArgumentParser(description='Run the delivery simulation')
-    # parser.add_argument('--num_agents', type=int, default=5, help='Number of agents')
-    # parser.add_argument('--n_packages', type=int, default=10, help='Number of packages')
-    # parser.add_argument('--max_steps', type=int, default=100, help='Maximum number of steps')
-    # parser.add_argument('--seed', type=int, default=2025, help='Random seed')
-    # parser.add_argument('--map', type=str, default="maps/map5.txt", help='Path to map file')
-    # args = parser.parse_args()
-
-    print("Please enter the simulation parameters:")
-    num_agents = int(input("Enter number of agents (default 5): ") or 5)
-    n_packages = int(input("Enter number of packages (default 10): ") or 10)
-    max_steps = int(input("Enter maximum steps (default 100): ") or 100)
-    seed = int(input("Enter random seed (default 2025): ") or 2025)
-    map_file = input("Enter map file path (e.g., maps/map.txt, default maps/map5.txt): ") or "maps/map5.txt"
-
-    print("\nSelect an agent type:")
-    print("1: GreedyAgentsOptimal")
-    print("2: GreedyAgents")
-    # print("3: PPO")
-    
-    agent_choice = input("Enter agent number (default 1): ") or '1'
-
-    agent_map = {
-        '1': GreedyAgentsOptimal,
-        '2': GreedyAgents,
-        # '3': PPO
-    }
+logger = logging.getLogger(__name__)
+
+# Agent types accepted in configs and on the command line, as (module, class). The
+# modules are imported on first use, so headless greedy runs never load torch.
+agent_map = {
+    'greedy_optimal': ('agents.greedy_agent_optimal', 'GreedyAgentsOptimal'),
+    'greedy': ('agents.greedy_agent', 'GreedyAgents'),
+    'ppo': ('agents.ppo_agent', 'PPO'),
+}
+
+# Keys of environment.reward_config that the Environment understands
+REWARD_KEYS = ['move_cost', 'delivery_reward', 'delay_reward']
+
+
+def resolve_map_file(map_file):
+    """Accepts both 'maps/map1.txt' and the bare 'map1.txt' used in cmd.txt."""
+    if not os.path.exists(map_file) and os.path.exists(os.path.join('maps', map_file)):
+        return os.path.join('maps', map_file)
+    return map_file
+
+
+def make_agents(agent_config, rng=None):
+    """
+    :param rng: The agent's own np.random.Generator (Environment.agent_rng), None for legacy behavior.
+    """
+    agent_config = dict(agent_config)
+    agent_type = agent_config.pop('type', 'greedy_optimal')
+    if agent_type not in agent_map:
+        raise ValueError(f"Unknown agent type '{agent_type}', expected one of {sorted(agent_map)}")
+    module, name = agent_map[agent_type]
+    AgentClass = getattr(importlib.import_module(module), name)
+    if agent_type == 'ppo':
+        kwargs = {k: agent_config[k] for k in ('model_path', 'view_radius', 'hidden_dim', 'deterministic')
+                  if k in agent_config}
+        if rng is not None:
+            kwargs.setdefault('seed', int(rng.integers(2**31)))
+        return AgentClass(**kwargs)
+    if agent_type == 'greedy_optimal':
+        return AgentClass(rng=rng, deadlock_recovery=agent_config.get('deadlock_recovery', False),
+                          hierarchical=agent_config.get('hierarchical', False),
+                          cluster_size=agent_config.get('cluster_size', 10))
+    if agent_type == 'greedy':
+        return AgentClass(traffic=agent_config.get('traffic', False),
+                          traffic_params=agent_config.get('traffic_params'),
+                          hierarchical=agent_config.get('hierarchical', False),
+                          cluster_size=agent_config.get('cluster_size', 10),
+                          assignment=agent_config.get('assignment', 'greedy'),
+                          reassign_margin=agent_config.get('reassign_margin', 3),
+                          max_reassign=agent_config.get('max_reassign'))
+    return AgentClass()
 
-    AgentClass = agent_map.get(agent_choice, GreedyAgentsOptimal) 
-
-    # Initialize environment
-    env = Environment(
-        map_file=map_file,
-        max_time_steps=max_steps,
-        n_robots=num_agents,
-        n_packages=n_packages,
-        seed=seed
-    )
-    state = env.reset()
-    env.render(save_frame=True)  # Save initial state
-
-    # Initialize agents
-    agents = AgentClass()
+
+def run_episode(env, agents, render=False, event_driven=False, macro=False, episode=None):
+    """
+    Runs one episode from env.reset(episode) until done.
+    :param event_driven: Jump over time steps where nothing can happen (see Environment.fast_forward).
+    :param macro: Let agents that support it submit whole paths (see Environment.step_macro).
+    :param episode: Index of the episode (see Environment.reset), None for the next one.
+    :return: The infos of the last step.
+    """
+    state = env.reset(episode)
+    if render:
+        env.render(save_frame=True)  # Save initial state
     agents.init_agents(state)
-    print("Agents initialized.")
-    
-    # Main simulation loop
+
     done = False
+    replan = None
+    infos = {}
     while not done:
-        actions = agents.get_actions(state)
-        state, reward, done, infos = env.step(actions)
-        env.render(save_frame=True)  # Save each frame
-    
-    # Save the simulation as a GIF
-    gif_filename = f"simulation_{AgentClass.__name__}_{num_agents}agents_{n_packages}packages.gif"
-    gif_path = env.save_gif(gif_filename)
+        if macro and hasattr(agents, 'get_macro_actions'):
+            # The agent is only called back when a plan ends, is blocked or packages arrive
+            plans = agents.get_macro_actions(state, replan)
+            state, reward, done, infos = env.step_macro(plans)
+            replan = infos['replan']
+        else:
+            actions = agents.get_actions(state)
+            if event_driven and env.is_idle(actions):
+                # Nothing can happen until the next package is released
+                state, reward, done, infos = env.fast_forward()
+            else:
+                state, reward, done, infos = env.step(actions)
+        if render:
+            env.render(save_frame=True)  # Save each frame
+    return infos
+
+
+def config_hash(config):
+    """
+    Short hash of the config settings that can change the outcome of an episode: the
+    environment and agent sections (without the map and seed, which are part of the episode key)
+    and the stepping mode of the experiment.
+    """
+    exp_config = config.get('experiment', {})
+    settings = {
+        'environment': {k: v for k, v in config['environment'].items() if k not in ('map_file', 'seed')},
+        # The thread count changes the speed of the agent, not its decisions
+        'agent': {k: v for k, v in config.get('agent', {'type': 'greedy_optimal'}).items() if k != 'num_threads'},
+        'experiment': {k: exp_config.get(k, False) for k in ('event_driven', 'macro_actions')},
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def load_completed(log_file):
+    """
+    Reads the (config hash, map, seed, episode) keys of the episodes already logged,
+    ignoring a truncated last line.
+    """
+    completed = set()
+    if not os.path.exists(log_file):
+        return completed
+    with open(log_file, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            completed.add((record.get('config'), record['map'], record['seed'], record['episode']))
+    return completed
+
+
+def run_experiment(config):
+    """
+    Runs every (map, seed, episode) combination of a config and appends one JSON line
+    per finished episode to the log file. Episodes already in the log with the same
+    config (see config_hash) are skipped, so an interrupted sweep resumes where it stopped.
+
+    Config sections:
+        environment: map_file, num_agents, n_packages, max_steps, reward_config, rng_mode,
+            arrival_mode, arrival_rate, hotspots, step_kernel, n_zones (above 1 simulates the
+            map in that many zone worker processes, see envs/partitioned.py)
+        agent: type ('greedy_optimal', 'greedy' or 'ppo') and agent parameters; num_threads sets
+            torch's intra-op thread count for the run (ppo)
+        experiment (optional): maps, seeds, num_episodes, log_file, resume, render,
+            event_driven, macro_actions, metrics (adds a MetricsCollector summary to each record),
+            profile (directory where a sampling profile of the episodes of each map is written
+            as <agent>_<map>.collapsed, see utils/profiler.py)
+    :return: The records of the episodes run by this call.
+    """
+    env_config = config['environment']
+    agent_config = config.get('agent', {'type': 'greedy_optimal'})
+    exp_config = config.get('experiment', {})
+
+    maps = exp_config.get('maps', [env_config['map_file']])
+    seeds = exp_config.get('seeds', [env_config.get('seed', 2025)])
+    num_episodes = exp_config.get('num_episodes', 1)
+    render = exp_config.get('render', False)
+    log_file = exp_config.get('log_file', os.path.join('results', f"{agent_config.get('type', 'agent')}_episodes.jsonl"))
+    reward_config = {k: v for k, v in env_config.get('reward_config', {}).items() if k in REWARD_KEYS}
+    profile_dir = exp_config.get('profile')
+    config_key = config_hash(config)
+    if agent_config.get('type') == 'ppo':
+        if not agent_config.get('model_path'):
+            logger.warning("The ppo agent has no model_path, running an untrained randomly initialised policy.")
+        if agent_config.get('num_threads') is not None:
+            # Process-wide, so set once for the run rather than by each agent
+            import torch
+            torch.set_num_threads(agent_config['num_threads'])
+
+    completed = load_completed(log_file) if exp_config.get('resume', True) else set()
+    os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+    if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
+        with open(log_file, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                # A killed run left a partial line, terminate it so new records stay parseable
+                f.write(b'\n')
+
+    # Only the options that use them load the zone processes, metrics and profiler
+    if profile_dir:
+        from utils.profiler import SamplingProfiler
+    if exp_config.get('metrics', False):
+        from envs.metrics import MetricsCollector
+    if env_config.get('n_zones', 1) > 1:
+        from envs.partitioned import PartitionedEnvironment
+
+    records = []
+    with open(log_file, 'a') as log:
+        for map_file in maps:
+            profiler = SamplingProfiler() if profile_dir else None
+            for seed in seeds:
+                todo = [e for e in range(num_episodes) if (config_key, map_file, seed, e) not in completed]
+                if not todo:
+                    continue
+
+                env_kwargs = {}
+                EnvClass = Environment
+                if env_config.get('n_zones', 1) > 1:
+                    EnvClass = PartitionedEnvironment
+                    env_kwargs['n_zones'] = env_config['n_zones']
+                env = EnvClass(
+                    map_file=resolve_map_file(map_file),
+                    max_time_steps=env_config.get('max_steps', 100),
+                    n_robots=env_config.get('num_agents', 5),
+                    n_packages=env_config.get('n_packages', 10),
+                    seed=seed,
+                    rng_mode=env_config.get('rng_mode', 'legacy'),
+                    arrival_mode=env_config.get('arrival_mode', 'batch'),
+                    arrival_rate=env_config.get('arrival_rate', 0.5),
+                    hotspots=env_config.get('hotspots'),
+                    step_kernel=env_config.get('step_kernel', 'reference'),
+                    metrics=MetricsCollector() if exp_config.get('metrics', False) else None,
+                    **reward_config, **env_kwargs
+                )
+                for episode in range(num_episodes):
+                    if episode not in todo:
+                        if env.rng_mode == 'legacy':
+                            # Keep the RandomState where an uninterrupted run would have it;
+                            # streams are derived from (seed, episode) and need no replay
+                            env.reset(episode)
+                        continue
+
+                    agents = make_agents(agent_config,
+                                         env.agent_rng(episode=episode) if env.rng_mode == 'streams' else None)
+                    start = time.time()
+                    if profiler is not None:
+                        profiler.start()
+                    infos = run_episode(env, agents, render=render,
+                                        event_driven=exp_config.get('event_driven', False),
+                                        macro=exp_config.get('macro_actions', False), episode=episode)
+                    if profiler is not None:
+                        profiler.stop()
+                    record = {
+                        'map': map_file,
+                        'seed': seed,
+                        'episode': episode,
+                        'agent': agent_config.get('type', 'greedy_optimal'),
+                        'config': config_key,
+                        'total_reward': infos.get('total_reward', env.total_reward),
+                        'total_time_steps': infos.get('total_time_steps', env.t),
+                        'delivered': env.n_delivered,
+                        'n_packages': env.n_created,
+                        'wall_time': round(time.time() - start, 4),
+                    }
+                    if hasattr(agents, 'deadlock_report'):
+                        record['deadlock'] = agents.deadlock_report()
+                    if env.metrics is not None:
+                        record['metrics'] = env.metrics.summary()
+                    log.write(json.dumps(record) + '\n')
+                    log.flush()
+                    records.append(record)
+                    print(f"{map_file} seed={seed} episode={episode}: "
+                          f"reward={record['total_reward']:.2f} delivered={record['delivered']}/{record['n_packages']}")
+
+                    if render:
+                        gif_filename = f"simulation_{type(agents).__name__}_{os.path.basename(map_file)}_{seed}_{episode}.gif"
+                        env.save_gif(gif_filename)
+                env.close()
+            if profiler is not None and profiler.n_samples:
+                map_name = os.path.splitext(os.path.basename(map_file))[0]
+                path = profiler.write_collapsed(os.path.join(
+                    profile_dir, f"{agent_config.get('type', 'greedy_optimal')}_{map_name}.collapsed"))
+                print(f"Profile of {map_file}: {profiler.n_samples} samples written to {path}")
+                for label, own, total in profiler.top(10):
+                    print(f"  {own:6.1%} self {total:6.1%} total  {label}")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the delivery simulation')
+    parser.add_argument('--num_agents', type=int, default=5, help='Number of agents')
+    parser.add_argument('--n_packages', type=int, default=10, help='Number of packages')
+    parser.add_argument('--max_time_steps', '--max_steps', dest='max_steps', type=int, default=100,
+                        help='Maximum number of steps')
+    parser.add_argument('--seed', type=int, default=2025, help='Random seed')
+    parser.add_argument('--map', type=str, default="maps/map5.txt", help='Path to map file')
+    parser.add_argument('--agent', type=str, default='greedy_optimal', choices=sorted(agent_map),
+                        help='Agent type')
+    parser.add_argument('--model_path', type=str, default=None, help='PPO model file')
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help='Intra-op threads of torch for the PPO agent (default: torch decides)')
+    parser.add_argument('--traffic', action='store_true', help='Congestion-aware routing for the greedy agent')
+    parser.add_argument('--deadlock_recovery', action='store_true',
+                        help='Let the optimal greedy agent recover from detected deadlocks')
+    parser.add_argument('--hierarchical', action='store_true',
+                        help='Hierarchical pathfinding for the greedy agents (large maps)')
+    parser.add_argument('--assignment', type=str, default='greedy', choices=['greedy', 'incremental'],
+                        help='Package assignment of the greedy agent (incremental allows reassignment)')
+    parser.add_argument('--render', action='store_true', help='Render every frame and save a GIF')
+    parser.add_argument('--event_driven', action='store_true', help='Skip idle time steps')
+    parser.add_argument('--macro', action='store_true', help='Use macro-actions if the agent supports them')
+    parser.add_argument('--metrics', action='store_true', help='Collect and print operational metrics')
+    parser.add_argument('--log_file', type=str, default=None, help='JSONL file for episode results')
+    parser.add_argument('--rng_mode', type=str, default='legacy', choices=['legacy', 'streams'],
+                        help='Single RandomState (legacy) or independent per-component streams')
+    parser.add_argument('--arrival_mode', type=str, default='batch', choices=['batch', 'stream'],
+                        help='Create all packages on reset (batch) or Poisson arrivals over time (stream)')
+    parser.add_argument('--arrival_rate', type=float, default=0.5,
+                        help='Mean packages released per step in stream mode')
+    parser.add_argument('--step_kernel', type=str, default='reference', choices=['reference', 'vectorized'],
+                        help='Resolve robot moves robot by robot (reference) or with NumPy (vectorized, '
+                             'faster from about 50 robots on, slower for small fleets)')
+    parser.add_argument('--zones', type=int, default=1,
+                        help='Split the map into this many zones simulated by worker processes')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Directory for sampling profiles (collapsed stacks for flamegraphs)')
+    parser.add_argument('--log_level', type=str, default='WARNING',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Level of the agent debug output')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(levelname)s %(name)s: %(message)s')
+
+    agent_config = {'type': args.agent}
+    if args.model_path:
+        agent_config['model_path'] = args.model_path
+    if args.num_threads is not None:
+        agent_config['num_threads'] = args.num_threads
+    if args.traffic:
+        agent_config['traffic'] = True
+    if args.deadlock_recovery:
+        agent_config['deadlock_recovery'] = True
+    if args.hierarchical:
+        agent_config['hierarchical'] = True
+    if args.assignment != 'greedy':
+        agent_config['assignment'] = args.assignment
+    config = {
+        'environment': {
+            'map_file': args.map,
+            'num_agents': args.num_agents,
+            'n_packages': args.n_packages,
+            'max_steps': args.max_steps,
+            'rng_mode': args.rng_mode,
+            'arrival_mode': args.arrival_mode,
+            'arrival_rate': args.arrival_rate,
+            'step_kernel': args.step_kernel,
+            'n_zones': args.zones,
+        },
+        'agent': agent_config,
+        'experiment': {
+            'seeds': [args.seed],
+            'render': args.render,
+            'event_driven': args.event_driven,
+            'macro_actions': args.macro,
+            'metrics': args.metrics,
+            'profile': args.profile,
+            # A single command line run is always executed, even if logged before
+            'resume': False,
+        },
+    }
+    if args.log_file:
+        config['experiment']['log_file'] = args.log_file
+
+    record = run_experiment(config)[0]
     print(f"\nSimulation completed!")
-    print(f"Total reward: {env.total_reward:.2f}")
-    print(f"Total time steps: {env.t}")
-    print(f"Visualization saved to: {gif_path}")
+    print(f"Total reward: {record['total_reward']:.2f}")
+    print(f"Total time steps: {record['total_time_steps']}")
+    if 'deadlock' in record:
+        print(f"Deadlock events: {record['deadlock']['deadlock_events']}, "
+              f"robot steps lost: {record['deadlock']['steps_lost']}")
+    if 'metrics' in record:
+        print(json.dumps(record['metrics'], indent=2))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
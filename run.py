@@ -20,6 +20,7 @@ def main():
     # Override config with command line arguments
     if args.map:
         config['environment']['map_file'] = args.map
+        config.setdefault('experiment', {})['maps'] = [args.map]
     if args.agent:
         config['agent']['type'] = args.agent
 
@@ -0,0 +1,304 @@
+"""
+Offline datasets of expert trajectories, e.g. to bootstrap the PPO agent from the greedy agents.
+
+generate() runs an agent over every (map, seed) job in a process pool. Each robot at
+each step is one transition, stored column by column:
+    obs      float32 (obs_dim,)  convert_state observation (see utils/state_converter.py)
+    action   int8 (2,)           move and package action codes (see envs/actions.py)
+    reward   float32             team reward of the step
+    done     bool                last step of the episode
+    episode  int32               episode number, unique within the dataset (numbered by job)
+    robot    int16               robot index
+    t        int32               time step
+A job buffers its transitions and writes them as compressed .npz shards of shard_size
+transitions. index.json lists the finished jobs with their shards, so an interrupted
+generation resumes with the jobs missing from it.
+
+ShardLoader streams a dataset back in batches, loading and decompressing the next
+shards in a background thread while the current one is consumed.
+
+Usage:
+    python -m utils.dataset --out data/greedy --maps map1.txt map2.txt --seeds 0 --n_seeds 500
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import numpy as np
+
+COLUMNS = {
+    'action': ('int8', (2,)),
+    'reward': ('float32', ()),
+    'done': ('bool', ()),
+    'episode': ('int32', ()),
+    'robot': ('int16', ()),
+    't': ('int32', ()),
+}
+INDEX_FILE = 'index.json'
+
+
+class ShardWriter:
+
+    def __init__(self, out_dir, prefix, shard_size=100000):
+        """
+        :param prefix: Prefix of the shard file names, unique per job.
+        :param shard_size: Number of transitions per shard.
+        """
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.buffers = {}  # column -> list of arrays
+        self.n_buffered = 0
+        self.shards = []   # {'file', 'n'} of the shards written
+
+    def add(self, **columns):
+        """Adds transitions, each column an array with one row per transition."""
+        for name, values in columns.items():
+            self.buffers.setdefault(name, []).append(values)
+        self.n_buffered += len(next(iter(columns.values())))
+        if self.n_buffered >= self.shard_size:
+            self.flush(partial=False)
+
+    def flush(self, partial=True):
+        """Writes the buffered transitions; without partial, an incomplete last shard stays buffered."""
+        columns = {name: np.concatenate(values) for name, values in self.buffers.items()}
+        start = 0
+        while self.n_buffered - start >= self.shard_size or (partial and start < self.n_buffered):
+            n = min(self.shard_size, self.n_buffered - start)
+            file = f"{self.prefix}_{len(self.shards):04d}.npz"
+            np.savez_compressed(os.path.join(self.out_dir, file),
+                                **{name: values[start:start + n] for name, values in columns.items()})
+            self.shards.append({'file': file, 'n': n})
+            start += n
+        self.buffers = {name: [values[start:]] for name, values in columns.items()} if start < self.n_buffered else {}
+        self.n_buffered -= start
+
+    def close(self):
+        """Writes the buffered transitions and returns the list of shards."""
+        self.flush()
+        return self.shards
+
+
+def load_index(path):
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        return json.load(f)
+
+
+def write_index(path, index):
+    # Replaced atomically, so a killed run never leaves a truncated index
+    tmp = os.path.join(path, INDEX_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, os.path.join(path, INDEX_FILE))
+
+
+def run_job(job):
+    """
+    Runs the episodes of one (map, seed) job in a worker process and writes its shards.
+    :return: The index entry of the job.
+    """
+    # Imported here so the pool workers load them once, and the loader needs none of them
+    from envs.actions import as_action_array
+    from envs.env import Environment
+    from main import make_agents, resolve_map_file
+    from utils.state_converter import PackageTracker, convert_state
+
+    config = job['config']
+    env = Environment(resolve_map_file(job['map']), config['max_steps'], config['num_agents'],
+                      config['n_packages'], seed=job['seed'], rng_mode=config['rng_mode'])
+    prefix = f"{os.path.splitext(os.path.basename(job['map']))[0]}_s{job['seed']}"
+    writer = ShardWriter(config['out'], prefix, config['shard_size'])
+    robots = np.arange(env.n_robots, dtype=np.int16)
+    n_transitions = 0
+    for e in range(config['episodes']):
+        episode = job['index'] * config['episodes'] + e
+        # Streams depend on (seed, e) only, whichever worker runs the job
+        state = env.reset(e)
+        agents = make_agents({'type': config['agent']}, env.agent_rng(episode=e) if env.rng_mode == 'streams' else None)
+        tracker = PackageTracker()
+        tracker.update(state)
+        grid = np.asarray(state['map'], dtype=np.float32)
+        agents.init_agents(state)
+        done = False
+        while not done:
+            obs = convert_state(state, tracker, config['view_radius'], grid)
+            actions = as_action_array(agents.get_actions(state), env.n_robots)
+            t = env.t
+            state, reward, done, infos = env.step(actions)
+            tracker.update(state)
+            n = len(robots)
+            writer.add(obs=obs, action=actions, reward=np.full(n, reward, dtype=np.float32),
+                       done=np.full(n, done), episode=np.full(n, episode, dtype=np.int32),
+                       robot=robots, t=np.full(n, t, dtype=np.int32))
+            n_transitions += n
+    return {'map': job['map'], 'seed': job['seed'], 'n': n_transitions, 'shards': writer.close()}
+
+
+def generate(out, maps, seeds, agent='greedy_optimal', episodes=1, num_agents=5, n_packages=10,
+             max_steps=100, rng_mode='legacy', view_radius=2, shard_size=100000, workers=None,
+             shared_maps=True):
+    """
+    Generates (or resumes) a dataset of the agent's transitions over every (map, seed) pair.
+    :param workers: Number of worker processes, None for one per core.
+    :param shared_maps: Publish the maps and their distance tables in shared memory once
+        for all workers (see utils/map_registry.py).
+    :return: The index of the dataset.
+    """
+    from main import resolve_map_file
+    from utils import map_registry
+    from utils.state_converter import observation_size
+
+    os.makedirs(out, exist_ok=True)
+    config = {'agent': agent, 'episodes': episodes, 'num_agents': num_agents, 'n_packages': n_packages,
+              'max_steps': max_steps, 'rng_mode': rng_mode, 'view_radius': view_radius}
+    columns = dict(COLUMNS, obs=('float32', (observation_size(view_radius),)))
+    index = {'config': config, 'columns': {name: [dtype, list(shape)] for name, (dtype, shape) in columns.items()},
+             'n_transitions': 0, 'jobs': []}
+    if os.path.exists(os.path.join(out, INDEX_FILE)):
+        index = load_index(out)
+        if index['config'] != config:
+            raise ValueError(f"{out} holds a dataset generated with {index['config']}, not {config}.")
+    done = {(job['map'], job['seed']) for job in index['jobs']}
+
+    jobs = [{'index': k, 'map': map_file, 'seed': seed, 'config': dict(config, out=out, shard_size=shard_size)}
+            for k, (map_file, seed) in enumerate((m, s) for m in maps for s in seeds)
+            if (map_file, seed) not in done]
+    map_files = sorted({resolve_map_file(job['map']) for job in jobs}) if shared_maps else []
+    try:
+        for map_file in map_files:
+            map_registry.publish(map_file)
+        with multiprocessing.Pool(workers) as pool:
+            for entry in pool.imap_unordered(run_job, jobs):
+                index['jobs'].append(entry)
+                index['n_transitions'] += entry['n']
+                write_index(out, index)
+                print(f"{entry['map']} seed={entry['seed']}: {entry['n']} transitions, "
+                      f"{index['n_transitions']} in total")
+    finally:
+        for map_file in map_files:
+            map_registry.unpublish(map_file)
+    return index
+
+
+class ShardLoader:
+
+    def __init__(self, path, batch_size=4096, columns=None, shuffle=False, seed=None, prefetch=2):
+        """
+        :param path: Dataset directory (with index.json).
+        :param batch_size: Transitions per batch, None to yield whole shards.
+        :param columns: Columns to load, None for all of them.
+        :param shuffle: Visit the shards in random order and shuffle the transitions within each.
+        :param prefetch: Number of shards loaded ahead by the background thread.
+        """
+        self.path = path
+        self.index = load_index(path)
+        self.batch_size = batch_size
+        self.columns = columns if columns is not None else list(self.index['columns'])
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.prefetch = prefetch
+
+    def __len__(self):
+        return self.index['n_transitions']
+
+    @property
+    def files(self):
+        return [shard['file'] for job in self.index['jobs'] for shard in job['shards']]
+
+    def _load(self, files, shards, stop):
+        """Background thread: loads the shards in order and puts them (or an error) on the queue."""
+        try:
+            for file in files:
+                with np.load(os.path.join(self.path, file)) as data:
+                    shard = {name: data[name] for name in self.columns}
+                while not stop.is_set():
+                    try:
+                        shards.put(shard, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    return
+            shards.put(None)
+        except Exception as error:
+            shards.put(error)
+
+    def iter_shards(self):
+        files = self.files
+        if self.shuffle:
+            files = [files[k] for k in self.rng.permutation(len(files))]
+        shards = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._load, args=(files, shards, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                shard = shards.get()
+                if shard is None:
+                    return
+                if isinstance(shard, Exception):
+                    raise shard
+                if self.shuffle:
+                    order = self.rng.permutation(len(next(iter(shard.values()))))
+                    shard = {name: values[order] for name, values in shard.items()}
+                yield shard
+        finally:
+            stop.set()
+
+    def __iter__(self):
+        """Yields dicts of column arrays of batch_size transitions (the last batch may be shorter)."""
+        if self.batch_size is None:
+            yield from self.iter_shards()
+            return
+        pending = None
+        for shard in self.iter_shards():
+            n = len(next(iter(shard.values())))
+            start = 0
+            if pending is not None:
+                # Complete the batch left over from the previous shard
+                start = min(n, self.batch_size - len(next(iter(pending.values()))))
+                pending = {name: np.concatenate([pending[name], shard[name][:start]]) for name in shard}
+                if len(next(iter(pending.values()))) < self.batch_size:
+                    continue
+                yield pending
+                pending = None
+            while n - start >= self.batch_size:
+                yield {name: values[start:start + self.batch_size] for name, values in shard.items()}
+                start += self.batch_size
+            if start < n:
+                pending = {name: values[start:] for name, values in shard.items()}
+        if pending is not None:
+            yield pending
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate an offline dataset of expert trajectories')
+    parser.add_argument('--out', type=str, required=True, help='Dataset directory')
+    parser.add_argument('--maps', type=str, nargs='+', default=['map1.txt'])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[2025])
+    parser.add_argument('--n_seeds', type=int, default=None,
+                        help='Use n_seeds consecutive seeds starting at the first of --seeds')
+    parser.add_argument('--agent', type=str, default='greedy_optimal', choices=['greedy_optimal', 'greedy'])
+    parser.add_argument('--episodes', type=int, default=1, help='Episodes per (map, seed)')
+    parser.add_argument('--num_agents', type=int, default=5)
+    parser.add_argument('--n_packages', type=int, default=10)
+    parser.add_argument('--max_steps', type=int, default=100)
+    parser.add_argument('--rng_mode', type=str, default='legacy', choices=['legacy', 'streams'])
+    parser.add_argument('--view_radius', type=int, default=2)
+    parser.add_argument('--shard_size', type=int, default=100000, help='Transitions per shard')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, default one per core')
+    parser.add_argument('--no_shared_maps', action='store_true',
+                        help='Let every worker load the maps and compute distances itself')
+    args = parser.parse_args()
+
+    seeds = args.seeds if args.n_seeds is None else list(range(args.seeds[0], args.seeds[0] + args.n_seeds))
+    index = generate(args.out, args.maps, seeds, args.agent, args.episodes, args.num_agents, args.n_packages,
+                     args.max_steps, args.rng_mode, args.view_radius, args.shard_size, args.workers,
+                     not args.no_shared_maps)
+    print(f"{index['n_transitions']} transitions in {sum(len(job['shards']) for job in index['jobs'])} shards")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+BFS distance fields that are repaired incrementally when cells get blocked or unblocked.
+
+A DistanceField holds the number of steps from every cell to a goal on the
+4-connected grid, with the same conventions as run_bfs of the greedy agents (the
+goal is always the source, unreachable cells have no distance). When a cell is
+blocked, only the cells whose every shortest path went through it are cleared and
+re-flooded from their unaffected neighbours; when a cell is unblocked, distances
+are lowered outwards from it until they stop improving. Both cost O(affected
+cells + their boundary) instead of a flood of the whole map.
+"""
+from collections import OrderedDict, deque
+import heapq
+import numpy as np
+
+from utils import map_registry
+
+UNREACHABLE = -1
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+ACTIONS = ['U', 'D', 'L', 'R']
+
+
+class DistanceField:
+
+    def __init__(self, grid, goal):
+        """
+        :param grid: The map as a list of lists, shared with (and updated by) the environment.
+        :param goal: (row, col) the distances are measured to.
+        """
+        self.grid = grid
+        self.goal = goal
+        self.n_rows = len(grid)
+        self.n_cols = len(grid[0])
+        self.dist = np.full((self.n_rows, self.n_cols), UNREACHABLE, dtype=np.int64)
+        self.dist[goal] = 0
+        self.flood([goal])
+
+    @classmethod
+    def from_table(cls, grid, goal, dist):
+        """Field over precomputed distances, e.g. a read-only row of a shared table (see utils/map_registry.py)."""
+        field = cls.__new__(cls)
+        field.grid = grid
+        field.goal = goal
+        field.n_rows = len(grid)
+        field.n_cols = len(grid[0])
+        field.dist = dist
+        return field
+
+    def free(self, cell):
+        r, c = cell
+        return 0 <= r < self.n_rows and 0 <= c < self.n_cols and (self.grid[r][c] == 0 or cell == self.goal)
+
+    def neighbours(self, cell):
+        for dx, dy in DIRECTIONS:
+            next_pos = (cell[0] + dx, cell[1] + dy)
+            if self.free(next_pos):
+                yield next_pos
+
+    def flood(self, sources):
+        """BFS from cells whose distance is already final, lowering the distances it reaches."""
+        dist = self.dist
+        queue = deque(sources)
+        while queue:
+            current = queue.popleft()
+            d = dist[current] + 1
+            for next_pos in self.neighbours(current):
+                if dist[next_pos] == UNREACHABLE or dist[next_pos] > d:
+                    dist[next_pos] = d
+                    queue.append(next_pos)
+
+    def block(self, cell):
+        """Repairs the field after cell became an obstacle (call once the grid is updated)."""
+        if cell == self.goal or self.dist[cell] == UNREACHABLE:
+            return 0
+        dist = self.dist
+        # Cells that lost every neighbour one step closer to the goal, found in order of distance
+        affected = {cell}
+        queue = deque([cell])
+        while queue:
+            current = queue.popleft()
+            d = dist[current] + 1
+            for next_pos in self.neighbours(current):
+                if next_pos in affected or dist[next_pos] != d:
+                    continue
+                if not any(dist[p] == d - 1 and p not in affected for p in self.neighbours(next_pos)):
+                    affected.add(next_pos)
+                    queue.append(next_pos)
+        for p in affected:
+            dist[p] = UNREACHABLE
+
+        # Re-flood the affected cells from their boundary, with Dijkstra since the
+        # boundary distances differ
+        heap = []
+        for p in affected:
+            if p == cell:
+                continue
+            best = min((dist[q] for q in self.neighbours(p) if dist[q] != UNREACHABLE and q not in affected),
+                       default=None)
+            if best is not None:
+                dist[p] = best + 1
+                heapq.heappush(heap, (best + 1, p))
+        while heap:
+            d, current = heapq.heappop(heap)
+            if d != dist[current]:
+                continue
+            for next_pos in self.neighbours(current):
+                if next_pos in affected and (dist[next_pos] == UNREACHABLE or dist[next_pos] > d + 1):
+                    dist[next_pos] = d + 1
+                    heapq.heappush(heap, (d + 1, next_pos))
+        return len(affected)
+
+    def unblock(self, cell):
+        """Repairs the field after cell became free (call once the grid is updated)."""
+        best = min((self.dist[q] for q in self.neighbours(cell) if self.dist[q] != UNREACHABLE), default=None)
+        if best is None:
+            return
+        if self.dist[cell] == UNREACHABLE or self.dist[cell] > best + 1:
+            self.dist[cell] = best + 1
+        self.flood([cell])
+
+    def next_move(self, start):
+        """(move, distance) exactly as run_bfs(grid, start, goal) returns them."""
+        d = self.dist[start]
+        if d == UNREACHABLE:
+            return 'S', 100000
+        for t, (dx, dy) in enumerate(DIRECTIONS):
+            next_pos = (start[0] + dx, start[1] + dy)
+            if 0 <= next_pos[0] < self.n_rows and 0 <= next_pos[1] < self.n_cols:
+                if self.dist[next_pos] != UNREACHABLE and self.dist[next_pos] == d - 1:
+                    return ACTIONS[t], int(d - 1)
+        return 'S', int(d)
+
+
+class DistanceFieldCache:
+
+    def __init__(self, grid, max_fields=512):
+        """
+        Distance fields of the most recently used goals, kept valid under map changes.
+        :param grid: The map as a list of lists, shared with the environment.
+        :param max_fields: Number of fields kept, the least recently used one is dropped first.
+        """
+        self.grid = grid
+        self.max_fields = max_fields
+        self.fields = OrderedDict()
+        # Distance table of the map published by utils/map_registry.py, valid until the map changes
+        self.shared = map_registry.lookup(grid)
+
+    def field(self, goal):
+        field = self.fields.get(goal)
+        if field is None:
+            if len(self.fields) >= self.max_fields:
+                self.fields.popitem(last=False)
+            dist = self.shared.field_dist(goal) if self.shared is not None else None
+            if dist is not None:
+                field = self.fields[goal] = DistanceField.from_table(self.grid, goal, dist)
+            else:
+                field = self.fields[goal] = DistanceField(self.grid, goal)
+        else:
+            self.fields.move_to_end(goal)
+        return field
+
+    def next_move(self, start, goal):
+        return self.field(goal).next_move(start)
+
+    def apply_changes(self, changes):
+        """
+        Repairs every cached field after cells were toggled.
+        :param changes: (row, col, blocked) tuples with 0-indexed cells, in the order they
+            happened; the grid must already reflect them.
+        """
+        if changes and self.shared is not None:
+            # Shared fields are read-only, repair private copies from now on
+            self.shared = None
+            for field in self.fields.values():
+                if not field.dist.flags.writeable:
+                    field.dist = field.dist.astype(np.int64)
+        # Replay the changes one at a time from the grid as it was before them
+        for row, col, blocked in reversed(changes):
+            self.grid[row][col] = 0 if blocked else 1
+        for row, col, blocked in changes:
+            self.grid[row][col] = 1 if blocked else 0
+            for field in self.fields.values():
+                if blocked:
+                    field.block((row, col))
+                else:
+                    field.unblock((row, col))
@@ -0,0 +1,212 @@
+"""
+Hierarchical pathfinding (HPA*-style) for large grids.
+
+The map is cut into square clusters. Wherever two neighbouring clusters share free
+border cells, entrances are placed (one in the middle of a short opening, one at
+each end of a long one), giving abstract nodes linked across the border with cost 1
+and, inside a cluster, by their BFS distance within the cluster.
+
+A query only touches the abstract graph and the start's cluster: distances from the
+goal to every abstract node come from one Dijkstra over the (small) abstract graph,
+cached per goal, and the first move is taken on the cluster-local BFS field of the
+best next entrance. Paths are near-optimal rather than shortest, and a query costs
+O(entrances per cluster) once the goal is cached, independent of the map size.
+"""
+from collections import OrderedDict, deque
+import heapq
+import numpy as np
+
+UNREACHABLE = -1
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+ACTIONS = ['U', 'D', 'L', 'R']
+
+
+class HierarchicalPathfinder:
+
+    def __init__(self, grid, cluster_size=10, max_goals=256, long_opening=6):
+        """
+        :param grid: The map as a list of lists or array (0 free, 1 obstacle).
+        :param cluster_size: Side of the square clusters.
+        :param max_goals: Number of goals whose abstract distances are cached.
+        :param long_opening: Openings longer than this get an entrance at each end.
+        """
+        self.grid = np.array(grid, dtype=np.int8)
+        self.n_rows, self.n_cols = self.grid.shape
+        self.cluster_size = cluster_size
+        self.max_goals = max_goals
+        self.long_opening = long_opening
+        self.build()
+
+    def cluster(self, cell):
+        return (cell[0] // self.cluster_size, cell[1] // self.cluster_size)
+
+    def cluster_box(self, cluster):
+        r0, c0 = cluster[0] * self.cluster_size, cluster[1] * self.cluster_size
+        return r0, c0, min(r0 + self.cluster_size, self.n_rows), min(c0 + self.cluster_size, self.n_cols)
+
+    def build(self):
+        """(Re)builds the abstract graph and drops every cached field."""
+        self.nodes = []          # Cell of each abstract node
+        self.node_index = {}     # cell -> node id
+        self.cluster_nodes = {}  # cluster -> node ids
+        self.edges = []          # node id -> [(node id, cost)]
+        self.local_fields = {}
+        self.goal_cache = OrderedDict()
+
+        K = self.cluster_size
+        for r in range(K - 1, self.n_rows - 1, K):
+            # Border between the cluster rows above and below r + 0.5
+            self._add_entrances([((r, c), (r + 1, c)) for c in range(self.n_cols)])
+        for c in range(K - 1, self.n_cols - 1, K):
+            self._add_entrances([((r, c), (r, c + 1)) for r in range(self.n_rows)])
+
+        for cluster, node_ids in self.cluster_nodes.items():
+            for a in node_ids:
+                field = self.local_field(self.nodes[a])
+                for b in node_ids:
+                    if a != b:
+                        d = self._lookup(field, self.nodes[b])
+                        if d != UNREACHABLE:
+                            self.edges[a].append((b, d))
+
+    def _node(self, cell):
+        if cell not in self.node_index:
+            self.node_index[cell] = len(self.nodes)
+            self.nodes.append(cell)
+            self.edges.append([])
+            self.cluster_nodes.setdefault(self.cluster(cell), []).append(self.node_index[cell])
+        return self.node_index[cell]
+
+    def _add_entrances(self, pairs):
+        """Places entrances on the openings of one border, given as pairs of facing cells."""
+        opening = []
+        for a, b in pairs + [(None, None)]:
+            # An opening ends at an obstacle or where the border crosses into other clusters
+            if (a is not None and self.grid[a] == 0 and self.grid[b] == 0
+                    and (not opening or self.cluster(opening[-1][0]) == self.cluster(a))):
+                opening.append((a, b))
+                continue
+            if opening:
+                if len(opening) > self.long_opening:
+                    chosen = [opening[0], opening[-1]]
+                else:
+                    chosen = [opening[len(opening) // 2]]
+                for u, v in chosen:
+                    i, j = self._node(u), self._node(v)
+                    self.edges[i].append((j, 1))
+                    self.edges[j].append((i, 1))
+                opening = []
+            if a is not None and self.grid[a] == 0 and self.grid[b] == 0:
+                opening.append((a, b))
+
+    def local_field(self, cell):
+        """BFS distances from cell to the cells of its cluster, moving inside the cluster only."""
+        field = self.local_fields.get(cell)
+        if field is not None:
+            return field
+        r0, c0, r1, c1 = self.cluster_box(self.cluster(cell))
+        dist = np.full((r1 - r0, c1 - c0), UNREACHABLE, dtype=np.int64)
+        dist[cell[0] - r0, cell[1] - c0] = 0
+        queue = deque([cell])
+        while queue:
+            r, c = queue.popleft()
+            d = dist[r - r0, c - c0] + 1
+            for dx, dy in DIRECTIONS:
+                nr, nc = r + dx, c + dy
+                if r0 <= nr < r1 and c0 <= nc < c1 and self.grid[nr, nc] == 0 and dist[nr - r0, nc - c0] == UNREACHABLE:
+                    dist[nr - r0, nc - c0] = d
+                    queue.append((nr, nc))
+        field = self.local_fields[cell] = (r0, c0, dist)
+        return field
+
+    @staticmethod
+    def _lookup(field, cell):
+        r0, c0, dist = field
+        r, c = cell[0] - r0, cell[1] - c0
+        if 0 <= r < dist.shape[0] and 0 <= c < dist.shape[1]:
+            return dist[r, c]
+        return UNREACHABLE
+
+    def goal_distances(self, goal):
+        """Abstract-graph distance from every node to goal (UNREACHABLE if none), cached per goal."""
+        distances = self.goal_cache.get(goal)
+        if distances is not None:
+            self.goal_cache.move_to_end(goal)
+            return distances
+        distances = np.full(len(self.nodes), UNREACHABLE, dtype=np.int64)
+        field = self.local_field(goal)
+        heap = []
+        for node in self.cluster_nodes.get(self.cluster(goal), []):
+            d = self._lookup(field, self.nodes[node])
+            if d != UNREACHABLE:
+                distances[node] = d
+                heap.append((d, node))
+        heapq.heapify(heap)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d != distances[node]:
+                continue
+            for other, cost in self.edges[node]:
+                if distances[other] == UNREACHABLE or distances[other] > d + cost:
+                    distances[other] = d + cost
+                    heapq.heappush(heap, (d + cost, other))
+
+        if len(self.goal_cache) >= self.max_goals:
+            self.goal_cache.popitem(last=False)
+        self.goal_cache[goal] = distances
+        return distances
+
+    def next_move(self, start, goal):
+        """
+        Returns (move, distance) like run_bfs: the first move towards goal and the length
+        of the rest of the (near-shortest) path, or ('S', 100000) if goal cannot be reached.
+        """
+        if start == goal:
+            return 'S', 0
+        best, waypoint = None, None
+        if self.cluster(goal) == self.cluster(start):
+            d = self._lookup(self.local_field(goal), start)
+            if d != UNREACHABLE:
+                best, waypoint = d, goal
+
+        distances = self.goal_distances(goal)
+        start_node = self.node_index.get(start)
+        for node in self.cluster_nodes.get(self.cluster(start), []):
+            if node == start_node or distances[node] == UNREACHABLE:
+                continue
+            d = self._lookup(self.local_field(self.nodes[node]), start)
+            if d != UNREACHABLE and (best is None or d + distances[node] < best):
+                best, waypoint = d + distances[node], self.nodes[node]
+        if start_node is not None:
+            # Crossing into the neighbouring cluster
+            for other, cost in self.edges[start_node]:
+                if self.cluster(self.nodes[other]) != self.cluster(start) and distances[other] != UNREACHABLE:
+                    if best is None or cost + distances[other] < best:
+                        best, waypoint = cost + distances[other], self.nodes[other]
+
+        if best is None:
+            return 'S', 100000
+        return self._first_move(start, waypoint), int(best - 1)
+
+    def _first_move(self, start, waypoint):
+        if self.cluster(waypoint) != self.cluster(start):
+            dx, dy = waypoint[0] - start[0], waypoint[1] - start[1]
+            return ACTIONS[DIRECTIONS.index((dx, dy))]
+        field = self.local_field(waypoint)
+        d = self._lookup(field, start)
+        for t, (dx, dy) in enumerate(DIRECTIONS):
+            next_pos = (start[0] + dx, start[1] + dy)
+            if self._lookup(field, next_pos) == d - 1 and d > 0:
+                return ACTIONS[t]
+        return 'S'
+
+    def apply_changes(self, changes):
+        """
+        Updates the map with (row, col, blocked) cells toggled at runtime (0-indexed).
+        The abstract graph is rebuilt, which costs a pass over the whole map.
+        """
+        if not changes:
+            return
+        for row, col, blocked in changes:
+            self.grid[row, col] = 1 if blocked else 0
+        self.build()
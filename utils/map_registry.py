@@ -0,0 +1,212 @@
+"""
+Read-only maps and all-pairs distance tables shared by worker processes.
+
+publish(map_file) reads a map once, computes the BFS distance from every free cell
+to every cell, and places both in one multiprocessing.shared_memory block named
+after the map file. In any process, Environment.load_map attaches to the block of
+its map file when one is published instead of reading the file, and the
+DistanceFieldCache of the greedy agents serves its fields from the attached table
+while the map is unchanged. Pool workers started by the publisher then neither read
+nor flood the map, and the table exists once in memory whatever the number of workers.
+Blocks are meant for the processes of the publisher's pools: they share its resource
+tracker, so a block outlives its workers and is removed by unpublish(). Each process
+attaches to a map at most once: attach() remembers the block, or that there is none,
+by map name.
+
+There is no next-hop table. The first move from a cell towards a goal is the
+neighbour one step closer in the goal's row of the table (DistanceField.next_move),
+four lookups where a table of moves would add another byte per (goal, cell) pair.
+
+The table takes 2 bytes per (free cell, cell) pair, so it grows with the square of
+the map size. Above max_table_bytes publish() shares the grid with an empty table
+and the agents of every worker flood their own fields, as without a published map.
+
+Block layout:
+    header  int32 (3,)                          n_rows, n_cols, n_goals
+    grid    int8 (n_rows, n_cols)               1 for obstacles
+    goals   int32 (n_rows * n_cols,)            row of the table of each goal cell, -1 if none
+    table   int16 (n_goals, n_rows * n_cols)    distance of every cell to the goal, -1 if unreachable
+A table row reshaped to (n_rows, n_cols) is exactly DistanceField(grid, goal).dist.
+"""
+import hashlib
+import os
+import numpy as np
+
+UNREACHABLE = -1
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+HEADER = 3 * 4
+# Largest distance table publish() computes and shares by default (256 MiB)
+MAX_TABLE_BYTES = 256 * 2**20
+
+# Maps published or attached by this process, by block name
+_maps = {}
+# Block names attach() found no block for
+_missing = set()
+
+
+def block_name(map_file):
+    return 'marl_' + hashlib.sha1(os.path.abspath(map_file).encode()).hexdigest()[:16]
+
+
+def distance_table(grid, block=256):
+    """
+    BFS distances from every free cell, flooding block goals at a time with NumPy. The
+    frontier is the list of (goal, cell) pairs reached at the last distance, so the
+    work is proportional to the number of pairs rather than to goals * cells * distance.
+    :return: (goals, table): the table row of each cell (-1 for obstacles) and the
+        int16 table of shape (n_goals, n_rows * n_cols).
+    """
+    grid = np.asarray(grid, dtype=np.int8)
+    n_rows, n_cols = grid.shape
+    n_cells = n_rows * n_cols
+    free = (grid == 0).ravel()
+    goal_cells = np.flatnonzero(free)
+    if len(goal_cells) >= np.iinfo(np.int16).max:
+        raise ValueError("The map has too many free cells for an int16 distance table.")
+    goals = np.full(n_cells, -1, dtype=np.int32)
+    goals[goal_cells] = np.arange(len(goal_cells), dtype=np.int32)
+
+    # Neighbour of every cell in each direction, the cell itself on the border
+    cells = np.arange(n_cells)
+    rows, cols = np.divmod(cells, n_cols)
+    neighbours = []
+    for dr, dc in DIRECTIONS:
+        r, c = rows + dr, cols + dc
+        inside = (r >= 0) & (r < n_rows) & (c >= 0) & (c < n_cols)
+        neighbours.append(np.where(inside, r * n_cols + c, cells))
+
+    table = np.full((len(goal_cells), n_cells), UNREACHABLE, dtype=np.int16)
+    flat = table.reshape(-1)
+    # Position of each (goal, cell) pair in the candidates of a level, to drop duplicates
+    slot = np.empty(min(block, len(goal_cells)) * n_cells, dtype=np.int64)
+    for start in range(0, len(goal_cells), block):
+        offset = start * n_cells
+        sources = np.arange(min(block, len(goal_cells) - start))
+        pairs = sources * n_cells + goal_cells[start:start + len(sources)]
+        flat[offset + pairs] = 0
+        d = 0
+        while pairs.size:
+            d += 1
+            base = pairs - pairs % n_cells
+            candidates = np.concatenate([base + neighbour[pairs % n_cells] for neighbour in neighbours])
+            candidates = candidates[free[candidates % n_cells] & (flat[offset + candidates] == UNREACHABLE)]
+            positions = np.arange(candidates.size)
+            slot[candidates] = positions
+            pairs = candidates[slot[candidates] == positions]
+            flat[offset + pairs] = d
+    return goals, table
+
+
+class SharedMap:
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        n_rows, n_cols, n_goals = np.frombuffer(shm.buf, dtype=np.int32, count=3).tolist()
+        n_cells = n_rows * n_cols
+        offset = HEADER
+        self.grid = np.frombuffer(shm.buf, dtype=np.int8, count=n_cells, offset=offset).reshape(n_rows, n_cols)
+        offset += n_cells
+        offset += -offset % 4
+        self.goals = np.frombuffer(shm.buf, dtype=np.int32, count=n_cells, offset=offset)
+        offset += 4 * n_cells
+        self.table = np.frombuffer(shm.buf, dtype=np.int16, count=n_goals * n_cells,
+                                   offset=offset).reshape(n_goals, n_cells)
+        for array in (self.grid, self.goals, self.table):
+            array.flags.writeable = False
+
+    @staticmethod
+    def size(n_rows, n_cols, n_goals):
+        n_cells = n_rows * n_cols
+        return HEADER + n_cells + (-(HEADER + n_cells) % 4) + 4 * n_cells + 2 * n_goals * n_cells
+
+    def field_dist(self, goal):
+        """Read-only (n_rows, n_cols) distances to goal, None if goal is not a free cell of the map."""
+        row = self.goals[goal[0] * self.grid.shape[1] + goal[1]]
+        if row < 0:
+            return None
+        return self.table[row].reshape(self.grid.shape)
+
+    def close(self):
+        # The arrays point into the block, drop them before unmapping it
+        self.grid = self.goals = self.table = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Fields of agents still use the table, the mapping goes away with them
+            pass
+
+
+def publish(map_file, max_table_bytes=MAX_TABLE_BYTES):
+    """
+    Loads map_file into a new shared memory block; call unpublish once the workers are done.
+    :param max_table_bytes: Size above which the distance table is left out and only
+        the grid is shared, None for no limit.
+    """
+    from multiprocessing import shared_memory
+    name = block_name(map_file)
+    if name in _maps:
+        return _maps[name]
+    _missing.discard(name)
+    with open(map_file) as f:
+        grid = np.array([[int(x) for x in line.strip().split(' ')] for line in f], dtype=np.int8)
+    n_free = int(np.count_nonzero(grid == 0))
+    if max_table_bytes is not None and 2 * n_free * grid.size > max_table_bytes:
+        goals, table = np.full(grid.size, -1, dtype=np.int32), np.empty((0, grid.size), dtype=np.int16)
+    else:
+        goals, table = distance_table(grid)
+    n_rows, n_cols = grid.shape
+    shm = shared_memory.SharedMemory(name=name, create=True, size=SharedMap.size(n_rows, n_cols, len(table)))
+    np.frombuffer(shm.buf, dtype=np.int32, count=3)[:] = (n_rows, n_cols, len(table))
+    offset = HEADER
+    np.frombuffer(shm.buf, dtype=np.int8, count=grid.size, offset=offset)[:] = grid.ravel()
+    offset += grid.size
+    offset += -offset % 4
+    np.frombuffer(shm.buf, dtype=np.int32, count=grid.size, offset=offset)[:] = goals
+    offset += 4 * grid.size
+    np.frombuffer(shm.buf, dtype=np.int16, count=table.size, offset=offset)[:] = table.ravel()
+    shared = _maps[name] = SharedMap(shm, owner=True)
+    return shared
+
+
+def unpublish(map_file):
+    _missing.discard(block_name(map_file))
+    shared = _maps.pop(block_name(map_file), None)
+    if shared is not None and shared.owner:
+        shared.shm.unlink()
+        shared.close()
+
+
+def attach(map_file):
+    """The published block of map_file, attached read-only, or None if it was not published."""
+    name = block_name(map_file)
+    if name in _maps:
+        return _maps[name]
+    if name in _missing:
+        return None
+    from multiprocessing import shared_memory
+    try:
+        try:
+            # Only the publisher unlinks the block
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the block with the resource tracker
+            # too. Pool workers share the tracker of the publisher, where registering
+            # again is a no-op and unpublish() removes the entry, so it is left alone.
+            shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        _missing.add(name)
+        return None
+    shared = _maps[name] = SharedMap(shm)
+    return shared
+
+
+def lookup(grid):
+    """The published or attached map whose grid equals grid (a list of lists), or None."""
+    if not _maps:
+        return None
+    grid = np.asarray(grid, dtype=np.int8)
+    for shared in _maps.values():
+        if np.array_equal(shared.grid, grid):
+            return shared
+    return None
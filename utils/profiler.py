@@ -0,0 +1,116 @@
+"""
+Statistical sampling profiler for episode runs, standard library only.
+
+Every `interval` seconds of CPU time a SIGPROF timer (signal.setitimer) interrupts
+the main thread and the handler counts the current call stack. The profiled code
+runs unmodified, so unlike cProfile the overhead does not depend on the number of
+function calls. Where the timer is not available (Windows, or profiling from
+another thread) a background thread samples the stack with sys._current_frames()
+instead; that thread only runs when the profiled one releases the GIL, so its
+samples over-weight calls that release it (e.g. NumPy sorts) and are less exact.
+
+Profiles are written as collapsed stacks, one line per distinct stack:
+    main.py:run_episode;greedy_agent_optimal.py:GreedyAgentsOptimal.get_actions;... 42
+which flamegraph.pl, speedscope or inferno turn into a flamegraph. top() gives the
+functions with the most samples as a text summary.
+"""
+import collections
+import os
+import signal
+import sys
+import threading
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=0.001):
+        """:param interval: Seconds between two samples."""
+        self.interval = interval
+        self.stacks = collections.Counter()  # tuple of frame labels, outermost first -> samples
+        self.labels = {}  # code object -> label, frames of the same function are labelled once
+        self.running = False
+        self.previous_handler = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def n_samples(self):
+        return sum(self.stacks.values())
+
+    def start(self):
+        """Starts sampling the calling thread; samples add up over several start/stop periods."""
+        if self.running:
+            raise RuntimeError("The profiler is already running.")
+        self.running = True
+        if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            self.previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler if self.previous_handler is not None else signal.SIG_DFL)
+        else:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+        self.running = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def record(self, frame):
+        stack = []
+        while frame is not None:
+            label = self.labels.get(frame.f_code)
+            if label is None:
+                label = self.labels[frame.f_code] = frame_label(frame)
+            stack.append(label)
+            frame = frame.f_back
+        if stack:
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def _on_signal(self, signum, frame):
+        self.record(frame)
+
+    def _sample(self, thread_id):
+        while not self.stop_event.wait(self.interval):
+            self.record(sys._current_frames().get(thread_id))
+
+    def write_collapsed(self, path):
+        """Writes the samples as collapsed stacks, the input format of flamegraph tools."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{';'.join(stack)} {count}\n")
+        return path
+
+    def top(self, n=10):
+        """
+        Functions with the most samples.
+        :return: (label, self share, total share) tuples sorted by self share, where self
+            counts the samples in the function itself and total includes its callees.
+        """
+        n_samples = self.n_samples
+        if n_samples == 0:
+            return []
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+        return [(label, count / n_samples, total[label] / n_samples) for label, count in own.most_common(n)]
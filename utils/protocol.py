@@ -0,0 +1,124 @@
+"""
+Binary message framing between the simulator and an out-of-process agent server.
+
+Every message is a 9 byte header (message type, episode id, payload length)
+followed by the payload. Several episodes share one connection, the episode id
+tells them apart. States are sent as deltas: only the robots whose position or
+load changed since the previous message of the episode, plus the packages released
+in this step (the env already reports those incrementally). Cells blocked or
+unblocked since the previous state follow as an optional trailing block.
+"""
+import asyncio
+import struct
+import numpy as np
+
+from envs.actions import as_action_array
+
+HEADER = struct.Struct('<BII')  # message type, episode id, payload length
+
+MSG_INIT = 1     # client -> server: map and first state of a new episode
+MSG_STEP = 2     # client -> server: state delta, asks for actions
+MSG_ACTIONS = 3  # server -> client: one (move, package action) pair per robot
+MSG_CLOSE = 4    # client -> server: the episode is finished
+MSG_ERROR = 5    # server -> client: the agent failed, payload is the message
+
+MAP_HEADER = struct.Struct('<HH')     # rows, cols
+STEP_HEADER = struct.Struct('<iHHH')  # time step, n robots, n changed robots, n new packages
+
+ROBOT_DTYPE = np.dtype([('index', '<u2'), ('row', '<i2'), ('col', '<i2'), ('carrying', '<i4')])
+PACKAGE_DTYPE = np.dtype([('id', '<i4'), ('start_row', '<i2'), ('start_col', '<i2'),
+                          ('target_row', '<i2'), ('target_col', '<i2'),
+                          ('start_time', '<i4'), ('deadline', '<i4')])
+CHANGES_HEADER = struct.Struct('<H')  # n blocked/unblocked cells
+CHANGE_DTYPE = np.dtype([('row', '<i2'), ('col', '<i2'), ('blocked', '<u1')])
+
+
+def pack_frame(msg_type, episode_id, payload=b''):
+    return HEADER.pack(msg_type, episode_id, len(payload)) + payload
+
+
+async def read_frame(reader):
+    """
+    Reads one frame from an asyncio stream.
+    :return: (msg_type, episode_id, payload), or None when the peer closed the stream.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+        msg_type, episode_id, length = HEADER.unpack(header)
+        payload = await reader.readexactly(length) if length else b''
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return msg_type, episode_id, payload
+
+
+def encode_map(grid):
+    return MAP_HEADER.pack(len(grid), len(grid[0])) + np.asarray(grid, dtype=np.uint8).tobytes()
+
+
+def decode_map(payload):
+    """:return: The grid as a list of lists and the number of bytes consumed."""
+    n_rows, n_cols = MAP_HEADER.unpack_from(payload)
+    end = MAP_HEADER.size + n_rows * n_cols
+    grid = np.frombuffer(payload, dtype=np.uint8, count=n_rows * n_cols, offset=MAP_HEADER.size)
+    return grid.reshape(n_rows, n_cols).tolist(), end
+
+
+def encode_state(state, prev_robots=None):
+    """
+    Encodes a state as a delta against the robots of the previously sent state.
+    :param prev_robots: The 'robots' list of the previous message, None to send all robots.
+    """
+    robots = state['robots']
+    changed = [i for i in range(len(robots))
+               if prev_robots is None or robots[i] != prev_robots[i]]
+    robot_arr = np.empty(len(changed), dtype=ROBOT_DTYPE)
+    for k, i in enumerate(changed):
+        robot_arr[k] = (i, robots[i][0], robots[i][1], robots[i][2])
+    pkg_arr = np.array([tuple(p) for p in state['packages']], dtype=PACKAGE_DTYPE)
+    header = STEP_HEADER.pack(state['time_step'], len(robots), len(changed), len(pkg_arr))
+    payload = header + robot_arr.tobytes() + pkg_arr.tobytes()
+    if state.get('blocked_changes'):
+        changes = np.array([tuple(change) for change in state['blocked_changes']], dtype=CHANGE_DTYPE)
+        payload += CHANGES_HEADER.pack(len(changes)) + changes.tobytes()
+    return payload
+
+
+def decode_state(payload, grid, prev_robots=None, offset=0):
+    """
+    Rebuilds a state dict, in the same format as Environment.get_state, from a delta.
+    Blocked/unblocked cells are applied to grid in place.
+    :param prev_robots: The 'robots' list of the previous state of the episode.
+    """
+    time_step, n_robots, n_changed, n_packages = STEP_HEADER.unpack_from(payload, offset)
+    offset += STEP_HEADER.size
+    robot_arr = np.frombuffer(payload, dtype=ROBOT_DTYPE, count=n_changed, offset=offset)
+    offset += robot_arr.nbytes
+    pkg_arr = np.frombuffer(payload, dtype=PACKAGE_DTYPE, count=n_packages, offset=offset)
+    offset += pkg_arr.nbytes
+
+    robots = list(prev_robots) if prev_robots is not None else [None] * n_robots
+    for index, row, col, carrying in robot_arr.tolist():
+        robots[index] = (row, col, carrying)
+    state = {
+        'time_step': time_step,
+        'map': grid,
+        'robots': robots,
+        'packages': [tuple(p) for p in pkg_arr.tolist()],
+    }
+    if offset < len(payload):
+        n_changes, = CHANGES_HEADER.unpack_from(payload, offset)
+        changes = np.frombuffer(payload, dtype=CHANGE_DTYPE, count=n_changes, offset=offset + CHANGES_HEADER.size)
+        state['blocked_changes'] = [tuple(change) for change in changes.tolist()]
+        for row, col, blocked in state['blocked_changes']:
+            grid[row - 1][col - 1] = blocked
+    return state
+
+
+def encode_actions(actions):
+    """:param actions: An action array or a list of (move, package action) tuples."""
+    return as_action_array(actions, len(actions)).astype(np.uint8).tobytes()
+
+
+def decode_actions(payload):
+    """:return: The int8 action array, which Environment.step takes as is."""
+    return np.frombuffer(payload, dtype=np.uint8).reshape(-1, 2).astype(np.int8)
@@ -0,0 +1,148 @@
+"""
+Fixed-capacity on-policy rollout storage for PPO with multiple robots.
+
+All arrays are allocated once with shape (capacity, n_robots, ...). The env returns a
+single team reward per step, so callers usually broadcast it to every robot. GAE is
+computed without a Python loop over time: within an episode segment the recursion
+    A_t = delta_t + (gamma * lambda) * A_{t+1}
+is a discounted reverse cumulative sum, evaluated as scaled cumsums over chunks
+short enough for the scale factors to stay within float64 range.
+"""
+import math
+import numpy as np
+
+
+def discounted_reverse_cumsum(x, dones, discount):
+    """
+    Computes y_t = x_t + discount * (1 - dones_t) * y_{t+1} along axis 0, vectorized.
+    :param x: float array of shape (T, N).
+    :param dones: array of shape (T, N), nonzero where the episode ended after step t.
+    :return: float64 array of shape (T, N).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    T, N = x.shape
+    y = np.zeros((T, N))
+    if T == 0:
+        return y
+    if discount == 0:
+        return x.copy()
+
+    # Keep discount ** chunk above ~1e-290 so the scaled sums neither underflow nor overflow
+    chunk = T if discount >= 1 else max(1, min(T, int(290 / -math.log10(discount))))
+    carry = np.zeros(N)  # y at the first step after the current chunk
+    cols = np.arange(N)
+    for start in range(((T - 1) // chunk) * chunk, -1, -chunk):
+        end = min(start + chunk, T)
+        L = end - start
+        xs = x[start:end]
+        done = np.asarray(dones[start:end]) != 0
+
+        w = discount ** np.arange(L, dtype=np.float64)[:, None]
+        # Reverse cumsum of the scaled terms, with a zero row appended at the end
+        scaled = np.zeros((L + 1, N))
+        scaled[:L] = np.cumsum((w * xs)[::-1], axis=0)[::-1]
+
+        # Last step of the segment containing t within this chunk (L if it runs past the chunk)
+        seg_end = np.where(done, np.arange(L)[:, None], L)
+        seg_end = np.minimum.accumulate(seg_end[::-1], axis=0)[::-1]
+        stop = np.minimum(seg_end + 1, L)
+        y[start:end] = (scaled[:L] - scaled[stop, cols]) / w
+
+        # Steps whose segment continues past the chunk also receive the carried tail
+        open_ = seg_end == L
+        y[start:end] += np.where(open_, discount ** (L - np.arange(L))[:, None] * carry, 0.0)
+        carry = y[start]
+    return y
+
+
+class RolloutBuffer:
+
+    def __init__(self, capacity, n_robots, obs_dim, gamma=0.99, gae_lambda=0.95, batch_size=64):
+        """
+        :param capacity: Number of time steps stored before an update (update_interval).
+        :param batch_size: Number of robot transitions per minibatch.
+        """
+        self.capacity = capacity
+        self.n_robots = n_robots
+        self.gamma = gamma
+        self.gae_lambda = gae_lambda
+        self.batch_size = batch_size
+
+        self.obs = np.zeros((capacity, n_robots, obs_dim), dtype=np.float32)
+        self.actions = np.zeros((capacity, n_robots), dtype=np.int64)
+        self.logprobs = np.zeros((capacity, n_robots), dtype=np.float32)
+        self.values = np.zeros((capacity, n_robots), dtype=np.float32)
+        self.rewards = np.zeros((capacity, n_robots), dtype=np.float32)
+        self.dones = np.zeros((capacity, n_robots), dtype=np.float32)
+        self.advantages = np.zeros((capacity, n_robots), dtype=np.float32)
+        self.returns = np.zeros((capacity, n_robots), dtype=np.float32)
+
+        # Minibatch buffers, refilled in place by iter_minibatches
+        self._batch = {name: np.zeros((batch_size,) + getattr(self, name).shape[2:],
+                                      dtype=getattr(self, name).dtype)
+                       for name in ('obs', 'actions', 'logprobs', 'values', 'advantages', 'returns')}
+        self.pos = 0
+
+    @property
+    def full(self):
+        return self.pos == self.capacity
+
+    def reset(self):
+        self.pos = 0
+
+    def add(self, obs, actions, logprobs, values, rewards, dones):
+        """Stores one time step for all robots. Scalars (e.g. a team reward) are broadcast."""
+        if self.full:
+            raise ValueError("Rollout buffer is full, compute advantages and reset it first.")
+        t = self.pos
+        self.obs[t] = obs
+        self.actions[t] = actions
+        self.logprobs[t] = logprobs
+        self.values[t] = values
+        self.rewards[t] = rewards
+        self.dones[t] = dones
+        self.pos += 1
+
+    def compute_returns_and_advantages(self, last_values):
+        """
+        Computes GAE advantages and returns over the stored steps.
+        :param last_values: Value estimates of the state following the last stored step
+            (ignored for robots whose last stored step ended the episode).
+        """
+        T = self.pos
+        values = self.values[:T].astype(np.float64)
+        dones = self.dones[:T]
+        next_values = np.empty_like(values)
+        next_values[:-1] = values[1:]
+        next_values[-1] = last_values
+
+        deltas = self.rewards[:T] + self.gamma * next_values * (1.0 - dones) - values
+        advantages = discounted_reverse_cumsum(deltas, dones, self.gamma * self.gae_lambda)
+        self.advantages[:T] = advantages
+        self.returns[:T] = advantages + values
+
+    def iter_minibatches(self, rng=None, normalize_advantages=True):
+        """
+        Yields shuffled minibatches of robot transitions as dicts of arrays.
+        Transitions are gathered with np.take into preallocated buffers, so no memory
+        is allocated per minibatch; the yielded arrays are overwritten by the next one.
+        Advantages are normalized in place in the buffer.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        n = self.pos * self.n_robots
+        flat = {name: getattr(self, name)[:self.pos].reshape((n,) + getattr(self, name).shape[2:])
+                for name in self._batch}
+        if normalize_advantages and n > 1:
+            adv = flat['advantages']
+            adv -= adv.mean()
+            adv /= adv.std() + 1e-8
+
+        order = rng.permutation(n)
+        for start in range(0, n, self.batch_size):
+            idx = order[start:start + self.batch_size]
+            batch = {}
+            for name, out in self._batch.items():
+                view = out[:len(idx)]
+                np.take(flat[name], idx, axis=0, out=view)
+                batch[name] = view
+            yield batch
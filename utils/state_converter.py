@@ -0,0 +1,88 @@
+"""
+Converts environment states into fixed-size per-robot observation vectors for learned policies.
+
+The env only reports packages on the step they are released, so PackageTracker keeps
+the set of waiting and carried packages across steps. Observations of all robots are
+built together with NumPy; a robot's observation is:
+    - obstacle and robot occupancy in a (2r+1)x(2r+1) window centered on the robot
+    - its normalized row and column, and whether it carries a package
+    - the normalized offset to its goal (carried package target, else closest waiting
+      package start) and the normalized deadline slack of that package
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def observation_size(view_radius=2):
+    window = 2 * view_radius + 1
+    return 2 * window * window + 6
+
+
+class PackageTracker:
+
+    def __init__(self):
+        self.packages = {}   # package id -> (start_row, start_col, target_row, target_col, deadline), 0-based
+        self.waiting = set()
+
+    def update(self, state):
+        for p in state['packages']:
+            self.packages[p[0]] = (p[1] - 1, p[2] - 1, p[3] - 1, p[4] - 1, p[6])
+            self.waiting.add(p[0])
+        for robot in state['robots']:
+            if robot[2] != 0:
+                self.waiting.discard(robot[2])
+
+    def waiting_array(self):
+        """Waiting packages as an int array of rows (start_row, start_col, deadline)."""
+        if not self.waiting:
+            return np.zeros((0, 3), dtype=np.int64)
+        return np.array([(self.packages[i][0], self.packages[i][1], self.packages[i][4])
+                         for i in sorted(self.waiting)], dtype=np.int64)
+
+
+def convert_state(state, tracker, view_radius=2, obstacle_grid=None):
+    """
+    Builds the observations of all robots.
+    :param tracker: PackageTracker already updated with this state.
+    :param obstacle_grid: Optional cached np.array of state['map'].
+    :return: float32 array of shape (n_robots, observation_size(view_radius)).
+    """
+    grid = obstacle_grid if obstacle_grid is not None else np.asarray(state['map'], dtype=np.float32)
+    n_rows, n_cols = grid.shape
+    robots = np.asarray(state['robots'], dtype=np.int64).reshape(-1, 3)
+    n_robots = len(robots)
+    rows, cols, carrying = robots[:, 0] - 1, robots[:, 1] - 1, robots[:, 2]
+    r = view_radius
+
+    # Local windows: cells outside the map count as obstacles
+    padded = np.ones((2, n_rows + 2 * r, n_cols + 2 * r), dtype=np.float32)
+    padded[0, r:r + n_rows, r:r + n_cols] = grid
+    padded[1] = 0
+    padded[1, rows + r, cols + r] = 1
+    windows = sliding_window_view(padded, (2 * r + 1, 2 * r + 1), axis=(1, 2))
+    local = windows[:, rows, cols].transpose(1, 0, 2, 3).reshape(n_robots, -1)
+
+    # Goal of each robot: carried package target, otherwise closest waiting package
+    goal = np.stack([rows, cols], axis=1)
+    deadline = np.full(n_robots, state['time_step'], dtype=np.int64)
+    waiting = tracker.waiting_array()
+    if len(waiting):
+        dist = np.abs(waiting[None, :, 0] - rows[:, None]) + np.abs(waiting[None, :, 1] - cols[:, None])
+        closest = waiting[dist.argmin(axis=1)]
+        goal[:] = closest[:, :2]
+        deadline[:] = closest[:, 2]
+    for i in np.flatnonzero(carrying):
+        pkg = tracker.packages[carrying[i]]
+        goal[i] = (pkg[2], pkg[3])
+        deadline[i] = pkg[4]
+
+    scale = float(max(n_rows, n_cols))
+    obs = np.empty((n_robots, observation_size(view_radius)), dtype=np.float32)
+    obs[:, :local.shape[1]] = local
+    obs[:, -6] = rows / scale
+    obs[:, -5] = cols / scale
+    obs[:, -4] = carrying != 0
+    obs[:, -3] = (goal[:, 0] - rows) / scale
+    obs[:, -2] = (goal[:, 1] - cols) / scale
+    obs[:, -1] = (deadline - state['time_step']) / scale
+    return obs
@@ -0,0 +1,174 @@
+"""
+Memory-bounded history of environment states for replay.
+
+Frames are grouped in segments of keyframe_interval frames. The first frame of a
+segment stores every robot (the keyframe); the others only store the robots that
+changed since the previous frame. A segment is packed into NumPy arrays once full,
+and the oldest segments are dropped when more than max_frames frames are stored.
+Any retained frame is rebuilt from the keyframe of its segment.
+"""
+from collections import deque
+import numpy as np
+
+from envs.actions import as_action_array, decode_actions
+
+
+class _Segment:
+
+    def __init__(self, start, keyframe):
+        self.start = start  # Absolute index of the keyframe
+        self.keyframe = keyframe
+        self.sealed = False
+        self.times = []
+        self.rewards = []
+        self.deltas = [[]]       # Per frame: [(robot index, row, col, carrying), ...]
+        self.packages = []       # Per frame: list of package tuples released in that frame
+        self.actions = []        # Per frame: encoded actions or None
+
+    def __len__(self):
+        return len(self.times)
+
+    def seal(self):
+        """Packs the per-frame lists into flat arrays with offsets"""
+        n = len(self.times)
+        self.keyframe = np.array(self.keyframe, dtype=np.int32).reshape(-1, 3)
+        self.times = np.array(self.times, dtype=np.int32)
+        self.rewards = np.array(self.rewards, dtype=np.float64)
+
+        counts = [len(d) for d in self.deltas]
+        self.delta_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+        flat = [d for frame in self.deltas for d in frame]
+        self.delta_values = np.array(flat, dtype=np.int32).reshape(-1, 4)
+        self.deltas = None
+
+        counts = [len(p) for p in self.packages]
+        self.package_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+        flat = [p for frame in self.packages for p in frame]
+        self.package_values = np.array(flat, dtype=np.int32).reshape(-1, 7)
+        self.packages = None
+
+        n_robots = len(self.keyframe)
+        self.has_actions = np.array([a is not None for a in self.actions], dtype=bool)
+        packed = np.zeros((n, n_robots, 2), dtype=np.uint8)
+        for k, a in enumerate(self.actions):
+            if a is not None:
+                packed[k, :len(a)] = a
+        self.actions = packed
+        self.sealed = True
+
+    def frame_deltas(self, k):
+        if not self.sealed:
+            return self.deltas[k]
+        lo, hi = self.delta_offsets[k], self.delta_offsets[k + 1]
+        return self.delta_values[lo:hi].tolist()
+
+    def frame_packages(self, k):
+        if not self.sealed:
+            return self.packages[k]
+        lo, hi = self.package_offsets[k], self.package_offsets[k + 1]
+        return [tuple(p) for p in self.package_values[lo:hi].tolist()]
+
+    def frame_actions(self, k):
+        if not self.sealed:
+            codes = self.actions[k]
+        else:
+            codes = self.actions[k] if self.has_actions[k] else None
+        if codes is None:
+            return None
+        return decode_actions(codes)
+
+
+class StateHistory:
+
+    def __init__(self, grid, keyframe_interval=50, max_frames=10000):
+        """
+        :param grid: The map, shared by all rebuilt states.
+        :param keyframe_interval: Number of frames per keyframe.
+        :param max_frames: Approximate bound on the number of retained frames; whole
+            segments of the oldest frames are dropped beyond it.
+        """
+        self.grid = grid
+        self.keyframe_interval = keyframe_interval
+        self.max_frames = max(max_frames, keyframe_interval)
+        self.segments = deque()
+        self.n_frames = 0         # Retained frames
+        self.n_appended = 0       # Frames ever appended (absolute index of the next frame)
+        self._last_robots = None
+
+    def __len__(self):
+        return self.n_frames
+
+    @property
+    def first_frame(self):
+        """Absolute index of the oldest retained frame"""
+        return self.n_appended - self.n_frames
+
+    def clear(self):
+        self.segments.clear()
+        self.n_frames = 0
+        self.n_appended = 0
+        self._last_robots = None
+
+    def append(self, state, reward=0, actions=None):
+        robots = [tuple(robot) for robot in state['robots']]
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or len(segment) == self.keyframe_interval:
+            if segment is not None:
+                segment.seal()
+            segment = _Segment(self.n_appended, robots)
+            self.segments.append(segment)
+        else:
+            segment.deltas.append([(i,) + robots[i] for i in range(len(robots))
+                                   if robots[i] != self._last_robots[i]])
+        segment.times.append(state['time_step'])
+        segment.rewards.append(reward)
+        segment.packages.append([tuple(p) for p in state['packages']])
+        if actions is not None and len(actions):
+            segment.actions.append([tuple(codes) for codes in as_action_array(actions, len(actions)).tolist()])
+        else:
+            segment.actions.append(None)
+        self._last_robots = robots
+        self.n_appended += 1
+        self.n_frames += 1
+
+        # Drop whole segments of the oldest frames once over the bound
+        while self.n_frames - len(self.segments[0]) >= self.max_frames:
+            self.n_frames -= len(self.segments.popleft())
+
+    def _frame(self, segment, k, robots):
+        state = {
+            'time_step': int(segment.times[k]),
+            'map': self.grid,
+            'robots': list(robots),
+            'packages': segment.frame_packages(k),
+        }
+        return state, float(segment.rewards[k]), segment.frame_actions(k)
+
+    def __getitem__(self, i):
+        """
+        Rebuilds the i-th retained frame (negative indices count from the end).
+        :return: (state, reward, actions) where actions is None if none were recorded.
+        """
+        if i < 0:
+            i += self.n_frames
+        if not 0 <= i < self.n_frames:
+            raise IndexError("Frame index out of range")
+        # All segments but the last hold exactly keyframe_interval frames
+        index = self.first_frame + i
+        segment = self.segments[(index - self.segments[0].start) // self.keyframe_interval]
+        k = index - segment.start
+        robots = [tuple(robot) for robot in np.asarray(segment.keyframe).tolist()]
+        for j in range(1, k + 1):
+            for r_index, row, col, carrying in segment.frame_deltas(j):
+                robots[r_index] = (row, col, carrying)
+        return self._frame(segment, k, robots)
+
+    def __iter__(self):
+        """Streams all retained frames in order, applying deltas incrementally."""
+        for segment in list(self.segments):
+            robots = [tuple(robot) for robot in np.asarray(segment.keyframe).tolist()]
+            for k in range(len(segment)):
+                if k > 0:
+                    for r_index, row, col, carrying in segment.frame_deltas(k):
+                        robots[r_index] = (row, col, carrying)
+                yield self._frame(segment, k, robots)
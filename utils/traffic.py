@@ -0,0 +1,245 @@
+"""
+Live traffic layer for congestion-aware routing.
+
+TrafficMap keeps an exponentially decayed heatmap of robot occupancy and blocked
+moves. Decay is lazy: stored values are divided by the running decay factor, so a
+time step costs O(number of robots) instead of a pass over the grid. The heat is
+turned into integer cell costs per square region; a region's costs are only
+recomputed once enough heat was added to it (or periodically, to follow the decay),
+and only applied, bumping the region's version, when they changed by enough.
+
+TrafficRouter computes weighted distance fields towards goals with Dial's algorithm
+(Dijkstra with a bucket queue, cell costs being small integers) and caches them with
+the costs they were computed with, so following a cached field never loops. A cost
+change in a region cannot alter the distance of a cell closer to the goal than every
+cell of the region (costs are positive): a query from a robot at distance d only
+depends on the regions reached within d + max_cost. A field is recomputed once the
+cost change accumulated in those regions since it was computed exceeds the router's
+tolerance, so fields far from the congestion (or queried close to their goal) are
+kept, and tolerance=0 always routes on the current costs.
+"""
+import numpy as np
+
+# Same order and tie-breaking as the BFS of the greedy agents
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+ACTIONS = ['U', 'D', 'L', 'R']
+
+
+class TrafficMap:
+
+    def __init__(self, grid, decay=0.95, occupancy_weight=1.0, blocked_weight=4.0, cost_scale=2.0,
+                 max_cost=8, region_size=5, region_threshold=2.0, refresh_interval=20, change_threshold=3):
+        """
+        :param decay: Factor applied to the heat at every time step.
+        :param occupancy_weight: Heat added to a cell for each robot standing on it.
+        :param blocked_weight: Heat added to the cell a robot failed to move into.
+        :param cost_scale: Extra cost per unit of heat; the cost of entering a cell is
+            1 + round(cost_scale * heat), capped at max_cost.
+        :param region_size: Side of the square regions whose costs are recomputed together.
+        :param region_threshold: Heat added to a region before its costs are recomputed.
+        :param refresh_interval: Steps between recomputations of every region (so decayed heat is seen).
+        :param change_threshold: Sum of the absolute cost changes of a region from which its
+            recomputed costs are applied; smaller changes keep the current costs (and fields).
+        """
+        self.grid = np.asarray(grid)
+        self.n_rows, self.n_cols = self.grid.shape
+        self.decay = decay
+        self.occupancy_weight = occupancy_weight
+        self.blocked_weight = blocked_weight
+        self.cost_scale = cost_scale
+        self.max_cost = max_cost
+        self.region_size = region_size
+        self.region_threshold = region_threshold
+        self.refresh_interval = refresh_interval
+        self.change_threshold = change_threshold
+
+        self.region_shape = (-(-self.n_rows // region_size), -(-self.n_cols // region_size))
+        self.reset()
+
+    def reset(self):
+        self._heat = np.zeros((self.n_rows, self.n_cols))
+        self.scale = 1.0  # heat = _heat * scale
+        self.costs = np.ones((self.n_rows, self.n_cols), dtype=np.int64)
+        self.region_added = np.zeros(self.region_shape)
+        self.region_change = np.zeros(self.region_shape, dtype=np.int64)  # Total absolute cost change applied
+        self.version = 0       # Incremented whenever costs or the grid change
+        self.grid_version = 0  # Incremented whenever the grid changes
+        self.steps = 0
+
+    def apply_changes(self, changes):
+        """Updates the map with (row, col, blocked) cells toggled at runtime (0-indexed)."""
+        for row, col, blocked in changes:
+            self.grid[row, col] = 1 if blocked else 0
+        self.grid_version += 1
+        self.version += 1
+
+    @property
+    def heat(self):
+        return self._heat * self.scale
+
+    def add(self, cell, value):
+        r, c = cell
+        self._heat[r, c] += value / self.scale
+        self.region_added[r // self.region_size, c // self.region_size] += value
+
+    def update(self, positions, blocked=()):
+        """
+        Advances the heatmap by one time step.
+        :param positions: Cells occupied by robots.
+        :param blocked: Cells robots tried and failed to move into.
+        """
+        self.scale *= self.decay
+        if self.scale < 1e-100:
+            # Fold the factor back into the values before it underflows
+            self._heat *= self.scale
+            self.scale = 1.0
+        for cell in positions:
+            self.add(cell, self.occupancy_weight)
+        for cell in blocked:
+            self.add(cell, self.blocked_weight)
+
+        self.steps += 1
+        if self.steps % self.refresh_interval == 0:
+            changed = np.ones(self.region_shape, dtype=bool)
+        else:
+            changed = self.region_added >= self.region_threshold
+        if changed.any():
+            self.refresh(changed)
+
+    def refresh(self, regions):
+        """Recomputes the costs of the regions flagged in the boolean array regions."""
+        size = self.region_size
+        updated = False
+        for rr, rc in zip(*np.nonzero(regions)):
+            rows = slice(rr * size, (rr + 1) * size)
+            cols = slice(rc * size, (rc + 1) * size)
+            costs = 1 + np.rint(self.cost_scale * self._heat[rows, cols] * self.scale).astype(np.int64)
+            np.minimum(costs, self.max_cost, out=costs)
+            change = np.abs(costs - self.costs[rows, cols]).sum()
+            if change >= self.change_threshold:
+                self.costs[rows, cols] = costs
+                self.region_change[rr, rc] += change
+                updated = True
+            self.region_added[rr, rc] = 0
+        if updated:
+            self.version += 1
+
+
+class RouteField:
+
+    def __init__(self, traffic, goal):
+        self.costs = traffic.costs.copy()
+        self.dist, self.steps = dial(traffic.grid, self.costs, goal, traffic.max_cost)
+        # Smallest distance of the reachable cells of each region, inf if there is none
+        size = traffic.region_size
+        n_rows, n_cols = traffic.region_shape
+        padded = np.full((n_rows * size, n_cols * size), np.inf)
+        padded[:self.dist.shape[0], :self.dist.shape[1]] = np.where(self.dist >= 0, self.dist, np.inf)
+        self.region_min = padded.reshape(n_rows, size, n_cols, size).min(axis=(1, 3))
+        self.region_change = traffic.region_change.copy()
+
+    def drift(self, traffic, reach):
+        """Cost change since the field was computed in the regions within distance reach of the goal."""
+        return (traffic.region_change - self.region_change)[self.region_min <= reach].sum()
+
+
+class TrafficRouter:
+
+    def __init__(self, traffic, max_fields=256, tolerance=8):
+        """
+        :param traffic: The TrafficMap giving the cell costs.
+        :param max_fields: Number of distance fields cached (one per goal).
+        :param tolerance: Cost change a cached field may miss in the regions a query depends on.
+        """
+        self.traffic = traffic
+        self.max_fields = max_fields
+        self.tolerance = tolerance
+        self.fields = {}
+        self.grid_version = traffic.grid_version
+
+    def field(self, goal, reach=np.inf):
+        """The RouteField of goal, recomputed if it misses more than tolerance within distance reach."""
+        if self.grid_version != self.traffic.grid_version:
+            # Blocked cells change reachability, no field survives them
+            self.fields.clear()
+            self.grid_version = self.traffic.grid_version
+        field = self.fields.get(goal)
+        if field is None or field.drift(self.traffic, reach) > self.tolerance:
+            if field is None and len(self.fields) >= self.max_fields:
+                self.fields.pop(next(iter(self.fields)))
+            field = self.fields[goal] = RouteField(self.traffic, goal)
+        return field
+
+    def distance_field(self, goal):
+        """
+        Weighted distance from every cell to goal, where entering a cell costs its
+        traffic cost. Unreachable cells and obstacles are -1.
+        """
+        return self.field(goal).dist
+
+    def next_move(self, start, goal):
+        """
+        Returns (move, distance) like run_bfs: the first move of a cheapest path and the
+        number of steps of the path, or ('S', 100000) if goal cannot be reached.
+        """
+        if start == goal:
+            return 'S', 0
+        field = self.fields.get(goal)
+        if field is None or self.grid_version != self.traffic.grid_version:
+            field = self.field(goal)
+        if field.dist[start] < 0:
+            return 'S', 100000
+        # The start and its neighbours are at most max_cost further from the goal
+        field = self.field(goal, field.dist[start] + self.traffic.max_cost)
+        dist, costs = field.dist, field.costs
+        best, best_move, best_pos = None, 'S', start
+        for t, (dx, dy) in enumerate(DIRECTIONS):
+            r, c = start[0] + dx, start[1] + dy
+            if 0 <= r < dist.shape[0] and 0 <= c < dist.shape[1] and dist[r, c] >= 0:
+                value = dist[r, c] + costs[r, c]
+                if best is None or value < best:
+                    best, best_move, best_pos = value, ACTIONS[t], (r, c)
+        return best_move, int(field.steps[best_pos])
+
+
+def dial(grid, costs, goal, max_cost):
+    """
+    Dijkstra with a circular bucket queue of max_cost + 1 buckets, for positive integer
+    cell costs bounded by max_cost.
+    :return: (dist, steps): the distance field towards goal and the number of steps of
+        the cheapest path found from each cell, both -1 where goal cannot be reached.
+    """
+    n_rows, n_cols = grid.shape
+    dist = np.full((n_rows, n_cols), -1, dtype=np.int64)
+    steps = np.full((n_rows, n_cols), -1, dtype=np.int64)
+    if grid[goal] != 0:
+        return dist, steps
+    n_buckets = max_cost + 1
+    buckets = [[] for _ in range(n_buckets)]
+    best = {goal: 0}
+    hops = {goal: 0}
+    buckets[0].append(goal)
+    current, pending = 0, 1
+    while pending:
+        bucket = buckets[current % n_buckets]
+        while bucket:
+            cell = bucket.pop()
+            pending -= 1
+            if dist[cell] >= 0 or best[cell] != current:
+                continue  # Already settled, or a stale entry
+            dist[cell] = current
+            steps[cell] = hops[cell]
+            # Moving from a neighbour into cell costs the cost of cell
+            step = current + costs[cell]
+            r, c = cell
+            for dx, dy in DIRECTIONS:
+                nr, nc = r + dx, c + dy
+                if 0 <= nr < n_rows and 0 <= nc < n_cols and grid[nr, nc] == 0 and dist[nr, nc] < 0:
+                    neighbour = (nr, nc)
+                    if step < best.get(neighbour, step + 1):
+                        best[neighbour] = step
+                        hops[neighbour] = hops[cell] + 1
+                        buckets[step % n_buckets].append(neighbour)
+                        pending += 1
+        current += 1
+    return dist, steps
@@ -3,13 +3,21 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from matplotlib.colors import ListedColormap
 from matplotlib.patches import Rectangle, Circle, Arrow
+from matplotlib.collections import EllipseCollection, PolyCollection
 from matplotlib.widgets import Button, Slider
 import matplotlib as mpl
 import time
 from collections import defaultdict
 
+from envs.actions import MOVE_CODES, MOVES, as_action_array
+from utils.state_history import StateHistory
+
 class DeliveryVisualizer:
-    def __init__(self, env):
+    def __init__(self, env, keyframe_interval=50, max_history=10000):
+        """
+        :param keyframe_interval: Frames between two full snapshots in the replay history.
+        :param max_history: Approximate number of most recent frames kept for replay.
+        """
         self.env = env
         self.map = np.array(env.grid)
         self.fig, self.ax = plt.subplots(figsize=(12, 10))
@@ -17,8 +25,17 @@ class DeliveryVisualizer:
         self.package_markers = {}  # Track all packages by ID
         self.time_text = None
         self.reward_text = None
-        self.state_history = []  # Store all states for playback
-        self.reward_history = []  
+        # Bounded keyframe + delta history of states, rewards and actions for playback
+        self.history = StateHistory(env.grid, keyframe_interval, max_history)
+        self.package_index = {}  # package_id -> Package of the env
+        self.robot_texts = []
+        self.carried_texts = []
+        self.pickup_collection = None
+        self.target_collection = None
+        self._background = None  # Cached static layer for blitting
+        # Package id labels are static text artists, too many of them make every
+        # refresh of the background slow, so they are off for large instances by default
+        self.show_package_labels = len(env.packages) <= 100
         
         self.colors = {
             'wall': 'black',
@@ -29,6 +46,11 @@ class DeliveryVisualizer:
             'package_delivered': 'red',
             'target': 'purple'
         }
+        self.rgba = {name: np.array(mpl.colors.to_rgba(color)) for name, color in self.colors.items()}
+        # Arrow (x, y) offset of each move code, none for 'S'
+        self.arrow_directions = np.zeros((len(MOVES), 2))
+        for move, offset in {'U': (0, -0.5), 'D': (0, 0.5), 'L': (-0.5, 0), 'R': (0.5, 0)}.items():
+            self.arrow_directions[MOVE_CODES[move]] = offset
         
         # Add animation control variables
         self.animation_speed = 0.001  # seconds between frames
@@ -39,6 +61,8 @@ class DeliveryVisualizer:
         # Initialize the visualization
         self.setup_plot()
         self.setup_controls()
+        self._create_package_artists()
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
         
     def setup_plot(self):
         """Initialize the plot with the map"""
@@ -60,11 +84,11 @@ class DeliveryVisualizer:
         self.time_text = self.ax.text(0.02, 0.95, 'Time Step: 0', 
                                      transform=self.ax.transAxes, 
                                      fontsize=12, fontweight='bold', 
-                                     bbox=dict(facecolor='white', alpha=0.7))
+                                     bbox=dict(facecolor='white', alpha=0.7), animated=True)
         self.reward_text = self.ax.text(0.02, 0.90, 'Total Reward: 0.00', 
                                        transform=self.ax.transAxes,
                                        fontsize=12, fontweight='bold',
-                                       bbox=dict(facecolor='white', alpha=0.7))
+                                       bbox=dict(facecolor='white', alpha=0.7), animated=True)
         
         # Add a legend to explain map symbols
         self._create_legend()
@@ -108,6 +132,11 @@ class DeliveryVisualizer:
             if not self.animation_running:
                 self.step_animation()
                 
+    def show_frame(self, i):
+        """Display the i-th frame of the replay history (negative indices count from the end)"""
+        state, reward, actions = self.history[i]
+        self.update_display(state, reward, actions)
+
     def step_animation(self):
         """Advance the animation by one frame when paused"""
         # Can be implemented if you want step-by-step animation while paused
@@ -144,162 +173,176 @@ class DeliveryVisualizer:
         
     def update_visualization(self, state, reward=0, actions=None):
         """Update the visualization with the current state"""
-        self.state_history.append(state.copy())  # Store state for replay
-        self.reward_history.append(reward)
-        # Store actions along with the state for replay
-        if actions:
-            if not hasattr(self, 'action_history'):
-                self.action_history = []
-            self.action_history.append(actions)
-        self.update_display(state, reward, actions)
-        plt.pause(0.1)  # Short pause to update display
-        
-    def update_display(self, state, reward, actions=None):
-        """Update the display with the current state and planned actions"""
-        # Clear previous markers
-        for marker in self.robot_markers:
-            marker.remove()
-        self.robot_markers = []
-        
+        self.history.append(state, reward, actions)  # Store state for replay
+        self.update_display(state, reward, actions)  # Blits and processes GUI events
+        
+    def update_display(self, state, reward, actions=None, redraw=True):
+        """
+        Update the display with the current state and planned actions.
+        Artists are created once and updated in place; only the animated layer
+        (robots, arrows, package squares, texts) is redrawn, on top of a cached
+        background of the static layer (map, grid, legend, controls).
+        """
+        robots = state['robots']
+        if len(self.robot_texts) != len(robots):
+            self._create_robot_artists(len(robots))
+
         # Update time and reward text
         self.time_text.set_text(f'Time Step: {state["time_step"]}')
         
         # Use just the current reward value, not the sum
         self.reward_text.set_text(f'Total Reward: {reward}')
         
-        # Add centered large timestep indicator that fades
-        # timestep_big = self.ax.text(0.5, 0.5, f'{state["time_step"]}', 
-        #                           transform=self.ax.transAxes,
-        #                           fontsize=50, alpha=0.3, color='blue',
-        #                           ha='center', va='center')
-        # self.robot_markers.append(timestep_big)
-        
         # Update robot positions
-        for i, robot in enumerate(state['robots']):
+        positions = np.array([(robot[1]-1, robot[0]-1) for robot in robots], dtype=float).reshape(-1, 2)
+        self.robot_circles.set_offsets(positions)
+        arrows = np.zeros_like(positions)
+        # Movement direction indicator if actions are provided, as an array or a list of tuples
+        if actions is not None and len(actions):
+            codes = as_action_array(actions, len(actions))[:len(robots), 0]
+            arrows[:len(codes)] = self.arrow_directions[codes]
+        for i, robot in enumerate(robots):
             row, col, carrying = robot[0]-1, robot[1]-1, robot[2]
-            
-            # Draw the robot circle
-            robot_circle = Circle((col, row), 0.3, color=self.colors['robot'], 
-                                  alpha=0.7, zorder=3)
-            self.ax.add_patch(robot_circle)
-            self.robot_markers.append(robot_circle)
-            
-            # Add robot ID text
-            robot_text = self.ax.text(col, row, f'R{i}', 
-                                     ha='center', va='center', color='white',
-                                     fontsize=8, zorder=4)
-            self.robot_markers.append(robot_text)
-            
-            # Add movement direction indicator if actions are provided
-            if actions and i < len(actions):
-                move_direction = actions[i][0]  # First element is the movement direction
-                
-                # Define arrow endpoints based on direction
-                dx, dy = 0, 0
-                if move_direction == 'U':
-                    dx, dy = 0, -0.5
-                elif move_direction == 'D':
-                    dx, dy = 0, 0.5
-                elif move_direction == 'L':
-                    dx, dy = -0.5, 0
-                elif move_direction == 'R':
-                    dx, dy = 0.5, 0
-                    
-                # Only draw arrow if robot is actually moving (not staying still)
-                if move_direction != 'S':
-                    arrow = self.ax.arrow(col, row, dx, dy, head_width=0.2, 
-                                         head_length=0.2, fc='yellow', ec='black', 
-                                         zorder=5, alpha=0.8)
-                    self.robot_markers.append(arrow)
-            
-            # Add carried package indicator if carrying
+            self.robot_texts[i].set_position((col, row))
+
+            # Carried package indicator if carrying
+            carried_text = self.carried_texts[i]
+            carried_text.set_visible(carrying > 0)
             if carrying > 0:
-                carried_text = self.ax.text(col, row-0.4, f'P{carrying}', 
-                                           ha='center', va='center', color='black',
-                                           fontsize=7, zorder=4)
-                self.robot_markers.append(carried_text)
+                carried_text.set_position((col, row-0.4))
+                carried_text.set_text(f'P{carrying}')
+        self.robot_arrows.set_offsets(positions)
+        self.robot_arrows.set_UVC(arrows[:, 0], arrows[:, 1])
         
         # Process current packages
         self.process_packages(state)
         
-        # Refresh the canvas
-        self.fig.canvas.draw()
-        
+        if redraw:
+            self.redraw()
+        return self.animated_artists()
+
+    def _create_robot_artists(self, n_robots):
+        """Create the persistent robot artists (circles, ids, carried package ids, arrows)"""
+        for artist in self.robot_markers:
+            artist.remove()
+        self.robot_circles = EllipseCollection(0.6, 0.6, 0, units='xy', offsets=np.zeros((n_robots, 2)),
+                                               offset_transform=self.ax.transData,
+                                               facecolors=self.colors['robot'], alpha=0.7, zorder=3,
+                                               animated=True)
+        self.ax.add_collection(self.robot_circles)
+        self.robot_texts = [self.ax.text(0, 0, f'R{i}', ha='center', va='center', color='white',
+                                         fontsize=8, zorder=4, animated=True) for i in range(n_robots)]
+        self.carried_texts = [self.ax.text(0, 0, '', ha='center', va='center', color='black',
+                                           fontsize=7, zorder=4, visible=False, animated=True)
+                              for i in range(n_robots)]
+        zeros = np.zeros(n_robots)
+        self.robot_arrows = self.ax.quiver(zeros, zeros, zeros, zeros, angles='xy', scale_units='xy', scale=1,
+                                           width=0.006, color='yellow', edgecolor='black', linewidth=0.5,
+                                           zorder=5, alpha=0.8, animated=True)
+        self.robot_markers = [self.robot_circles, self.robot_arrows] + self.robot_texts + self.carried_texts
+
+    def _create_package_artists(self):
+        """Create the two collections holding the pickup and target squares of every package"""
+        for collection in (self.pickup_collection, self.target_collection):
+            if collection is not None:
+                collection.remove()
+        self.pickup_collection = PolyCollection([], alpha=0.5, zorder=2, animated=True)
+        self.target_collection = PolyCollection([], alpha=0.3, zorder=1, animated=True)
+        self.ax.add_collection(self.target_collection)
+        self.ax.add_collection(self.pickup_collection)
+        self.package_slots = {}
+        self.pickup_colors = np.zeros((0, 4))
+        self.target_colors = np.zeros((0, 4))
+
+    def animated_artists(self):
+        """Artists redrawn on every frame, in drawing order"""
+        artists = [self.target_collection, self.pickup_collection]
+        artists += self.robot_markers
+        artists += [self.time_text, self.reward_text]
+        return [a for a in artists if a is not None]
+
+    def _on_draw(self, event):
+        """After a full redraw, cache the static background and draw the animated layer on top"""
+        canvas = self.fig.canvas
+        self._background = canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.animated_artists():
+            self.fig.draw_artist(artist)
+
+    def redraw(self):
+        """Blit the animated layer over the cached background (full redraw if it is stale)"""
+        canvas = self.fig.canvas
+        if self._background is None:
+            canvas.draw()  # Calls _on_draw
+        else:
+            canvas.restore_region(self._background)
+            for artist in self.animated_artists():
+                self.fig.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def _square(self, row, col):
+        return [(col-0.4, row-0.4), (col+0.4, row-0.4), (col+0.4, row+0.4), (col-0.4, row+0.4)]
+
     def process_packages(self, state):
         """Process package visualization with respect to time"""
         # Get current time step
         current_time = state['time_step']
         
-        # Get packages from the environment's internal state
+        # Index the environment's packages by id (kept after the env retires delivered ones in stream mode)
         env_packages = self.env.packages
-        
-        # First, hide any package markers that shouldn't be visible
-        # (those with start time > current_time and not yet in transit/delivered)
-        for pkg_id in list(self.package_markers.keys()):
-            pkg = next((p for p in env_packages if p.package_id == pkg_id), None)
-            if pkg and pkg.start_time > current_time and pkg.status == 'None':
-                # Remove the visual elements if they exist
-                marker = self.package_markers[pkg_id]
-                marker['pickup'].remove()
-                marker['target'].remove()
-                marker['pickup_text'].remove()
-                marker['target_text'].remove()
-                del self.package_markers[pkg_id]
-        
-        # Process only packages that should be visible now
-        for pkg in env_packages:
-            pkg_id = pkg.package_id
-            
-            # Skip packages that haven't appeared yet
-            if pkg.start_time > current_time and pkg.status == 'None':
-                continue
-                
-            start_row, start_col = pkg.start[0], pkg.start[1]
-            target_row, target_col = pkg.target[0], pkg.target[1]
-            status = pkg.status  # 'None', 'waiting', 'in_transit', or 'delivered'
-            
-            # Create marker if it doesn't exist
-            if pkg_id not in self.package_markers:
-                # Pickup location marker
-                pickup_marker = Rectangle((start_col-0.4, start_row-0.4), 0.8, 0.8,
-                                        color=self.colors['package_waiting'], alpha=0.5, zorder=2)
-                self.ax.add_patch(pickup_marker)
-                
-                # Target location marker
-                target_marker = Rectangle((target_col-0.4, target_row-0.4), 0.8, 0.8, 
-                                         color=self.colors['target'], alpha=0.3, zorder=1)
-                self.ax.add_patch(target_marker)
-                
-                # Package ID at pickup
-                pickup_text = self.ax.text(start_col, start_row, f'P{pkg_id}',
-                                          ha='center', va='center', color='black',
-                                          fontsize=7, zorder=2)
-                
-                # Package ID at target
-                target_text = self.ax.text(target_col, target_row, f'T{pkg_id}',
-                                          ha='center', va='center', color='black',
-                                          fontsize=7, zorder=1)
-                
-                self.package_markers[pkg_id] = {
-                    'pickup': pickup_marker,
-                    'target': target_marker,
-                    'pickup_text': pickup_text,
-                    'target_text': target_text,
-                    'status': status
-                }
-            
-            # Update color based on status
+        if len(env_packages) and env_packages[-1].package_id not in self.package_index:
+            self.package_index.update((p.package_id, p) for p in env_packages)
+
+        # Create squares for packages seen for the first time
+        new_packages = [p for p in env_packages
+                        if p.package_id not in self.package_slots
+                        and not (p.start_time > current_time and p.status == 'None')]
+        if new_packages:
+            for pkg in new_packages:
+                self.package_slots[pkg.package_id] = len(self.package_slots)
+                self.package_markers[pkg.package_id] = {'status': None}
+                if self.show_package_labels:
+                    # Labels belong to the static layer, the background must be refreshed
+                    self.package_markers[pkg.package_id]['pickup_text'] = self.ax.text(
+                        pkg.start[1], pkg.start[0], f'P{pkg.package_id}', ha='center', va='center',
+                        color='black', fontsize=7, zorder=2)
+                    self.package_markers[pkg.package_id]['target_text'] = self.ax.text(
+                        pkg.target[1], pkg.target[0], f'T{pkg.package_id}', ha='center', va='center',
+                        color='black', fontsize=7, zorder=1)
+                    self._background = None
+            slots = sorted(self.package_slots.items(), key=lambda item: item[1])
+            packages = [self.package_index[pkg_id] for pkg_id, _ in slots]
+            self.pickup_collection.set_verts([self._square(*p.start) for p in packages])
+            self.target_collection.set_verts([self._square(*p.target) for p in packages])
+            n_new = len(packages) - len(self.pickup_colors)
+            self.pickup_colors = np.vstack([self.pickup_colors, np.tile(self.rgba['package_waiting'], (n_new, 1))])
+            self.target_colors = np.vstack([self.target_colors, np.tile(self.rgba['target'], (n_new, 1))])
+
+        # Update colors of packages whose status changed, hide those not released yet (replay)
+        changed = False
+        for pkg_id, slot in self.package_slots.items():
+            pkg = self.package_index[pkg_id]
             marker = self.package_markers[pkg_id]
-            current_status = marker['status']
-            
-            if status != current_status:
-                marker['status'] = status
-                if status == 'in_transit':
-                    marker['pickup'].set_color(self.colors['package_transit'])
-                elif status == 'delivered':
-                    marker['target'].set_color(self.colors['package_delivered'])
-                elif status == 'waiting':
-                    marker['pickup'].set_color(self.colors['package_waiting'])
+            status = 'hidden' if (pkg.start_time > current_time and pkg.status == 'None') else pkg.status
+            if status == marker['status']:
+                continue
+            marker['status'] = status
+            changed = True
+            pickup_color = self.rgba['package_waiting']
+            target_color = self.rgba['target']
+            if status == 'in_transit':
+                pickup_color = self.rgba['package_transit']
+            elif status == 'delivered':
+                pickup_color = self.rgba['package_transit']
+                target_color = self.rgba['package_delivered']
+            self.pickup_colors[slot] = pickup_color
+            self.target_colors[slot] = target_color
+            if status == 'hidden':
+                self.pickup_colors[slot, 3] = 0
+                self.target_colors[slot, 3] = 0
+        if changed or new_packages:
+            self.pickup_collection.set_facecolors(self.pickup_colors)
+            self.target_collection.set_facecolors(self.target_colors)
     
     def run_animation(self, env, agents, steps=100):
         """Run the animation by simulating the environment"""
@@ -307,8 +350,14 @@ class DeliveryVisualizer:
         agents.init_agents(state)
         
         # Clear any existing visualizations
+        for marker in self.package_markers.values():
+            for key in ('pickup_text', 'target_text'):
+                if key in marker:
+                    marker[key].remove()
         self.package_markers = {}
-        self.robot_markers = []
+        self.package_index = {}
+        self._create_package_artists()
+        self._background = None
         
         done = False
         t = 0
@@ -351,13 +400,14 @@ class DeliveryVisualizer:
     
     def save_animation(self, filename='delivery_simulation2.gif', fps=5):
         """Save the animation as a video file"""
-        def animate(i):
-            if i < len(self.state_history):
-                self.update_display(self.state_history[i], 
-                                   self.reward_history[i] if i < len(self.reward_history) else 0)
-            return self.robot_markers + list(self.package_markers.values())
-        
-        ani = animation.FuncAnimation(self.fig, animate, frames=len(self.state_history),
+        def animate(frame):
+            state, reward, actions = frame
+            # Saving redraws the whole figure (animated artists included) for each frame
+            return self.update_display(state, reward, actions, redraw=False)
+        
+        # Frames are rebuilt one by one from the history instead of being held in memory
+        ani = animation.FuncAnimation(self.fig, animate, frames=iter(self.history),
+                                      save_count=len(self.history), cache_frame_data=False,
                                       interval=1000/fps, blit=False)
         ani.save(filename, writer='pillow', fps=fps)
         print(f"Animation saved to {filename}")
@@ -399,7 +449,6 @@ if __name__ == "__main__":
     parser.add_argument("--map", type=str, default="map5.txt", help="Map name")
 
     args = parser.parse_args()
-    np.random.seed(args.seed)
     visualize_delivery(
         map_file=args.map,
         num_agents=args.num_agents,